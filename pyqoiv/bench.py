@@ -0,0 +1,278 @@
+import json
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, Generator, List, Optional
+import numpy as np
+from numpy.typing import NDArray
+from .decode import Decoder
+from .encode import Encoder
+from .types import ColourSpace
+
+Clip = Callable[[], Generator[NDArray[np.uint8], None, None]]
+
+
+def create_static_clip(width: int, height: int, frames: int) -> Clip:
+    """Create a clip repeating a single textured frame."""
+    rng = np.random.default_rng(0)
+    blocks = rng.integers(0, 256, size=(height // 4 + 1, width // 4 + 1, 3))
+    frame = np.repeat(np.repeat(blocks.astype(np.uint8), 4, axis=0), 4, axis=1)
+    frame = np.ascontiguousarray(frame[:height, :width])
+
+    def static():
+        """Yield the frame, frames times."""
+        for _ in range(frames):
+            yield frame
+
+    return static
+
+
+def add_noise(clip: Clip, noise: int, seed: int = 1) -> Clip:
+    """Add uniform random noise below noise to every pixel of a clip.
+
+    Pixels are first limited so the noise never overflows them.
+    """
+
+    def noisy():
+        """Yield the frames of the clip with the noise added."""
+        rng = np.random.default_rng(seed)
+        for frame in clip():
+            grain = rng.integers(0, noise, size=frame.shape, dtype=np.uint8)
+            yield np.minimum(frame, max(0, 255 - noise)) + grain
+
+    return noisy
+
+
+def create_noise_clip(width: int, height: int, frames: int) -> Clip:
+    """Create a clip of uniform random noise, the worst case for compression."""
+    black = np.zeros((height, width, 3), dtype=np.uint8)
+    return add_noise(lambda: (black for _ in range(frames)), 256)
+
+
+def create_gradient_clip(width: int, height: int, frames: int) -> Clip:
+    """Create a clip of smooth gradients that slowly change colour."""
+    x = (np.arange(width, dtype=np.float32) % 256)[None, :]
+    y = (np.arange(height, dtype=np.float32) % 256)[:, None]
+
+    def gradient():
+        """Yield the frames, shifting the blue channel a level each frame."""
+        for i in range(frames):
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[..., 0] = np.broadcast_to(x, (height, width))
+            frame[..., 1] = np.broadcast_to(y, (height, width))
+            frame[..., 2] = ((x + y) / 2 + i) % 256
+            yield frame
+
+    return gradient
+
+
+def create_pan_clip(
+    width: int, height: int, frames: int, speed: int = 2, seed: int = 2
+) -> Clip:
+    """Create a clip panning horizontally across a blocky random texture."""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(
+        0, 256, size=(height // 8 + 1, (width + speed * frames) // 8 + 1, 3)
+    ).astype(np.uint8)
+    texture = np.repeat(np.repeat(blocks, 8, axis=0), 8, axis=1)[:height]
+
+    def pan():
+        """Yield the frames, moving speed pixels across the texture each frame."""
+        for i in range(frames):
+            yield np.ascontiguousarray(texture[:, i * speed : i * speed + width])
+
+    return pan
+
+
+def create_scene_cuts_clip(
+    width: int, height: int, frames: int, scene_length: int = 5
+) -> Clip:
+    """Create a clip cutting between unrelated scenes, each with a moving box."""
+    rng = np.random.default_rng(3)
+    scenes = (frames + scene_length - 1) // scene_length
+    backgrounds = rng.integers(0, 256, size=(scenes, 1, 1, 3), dtype=np.uint8)
+    size = max(1, min(width, height) // 4)
+
+    def scene_cuts():
+        """Yield the frames, cutting to the next scene every scene_length."""
+        for i in range(frames):
+            frame = np.repeat(
+                np.repeat(backgrounds[i // scene_length], height, 0), width, 1
+            )
+            x = (i * 2) % max(1, width - size)
+            frame[:size, x : x + size] = 255 - frame[:size, x : x + size]
+            yield frame
+
+    return scene_cuts
+
+
+CLIPS: Dict[str, Callable[[int, int, int], Clip]] = {
+    "static": create_static_clip,
+    "noise": create_noise_clip,
+    "gradient": create_gradient_clip,
+    "pan": create_pan_clip,
+    "scene_cuts": create_scene_cuts_clip,
+}
+
+
+@dataclass
+class BenchResult:
+    """The speed and compression of encoding and decoding one clip."""
+
+    clip: str
+    width: int
+    height: int
+    frames: int
+    raw_bytes: int
+    encoded_bytes: int
+    encode_seconds: float
+    decode_seconds: float
+    opcodes: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        """The name the result is stored under in a baseline."""
+        return f"{self.clip}-{self.width}x{self.height}"
+
+    @property
+    def compression_ratio(self) -> float:
+        """The raw size divided by the encoded size."""
+        return self.raw_bytes / self.encoded_bytes
+
+    @property
+    def encode_fps(self) -> float:
+        """Frames encoded per second."""
+        return self.frames / self.encode_seconds
+
+    @property
+    def decode_fps(self) -> float:
+        """Frames decoded per second."""
+        return self.frames / self.decode_seconds
+
+    @property
+    def encode_mbps(self) -> float:
+        """Raw megabytes encoded per second."""
+        return self.raw_bytes / self.encode_seconds / 1e6
+
+    @property
+    def decode_mbps(self) -> float:
+        """Raw megabytes decoded per second."""
+        return self.raw_bytes / self.decode_seconds / 1e6
+
+    def opcode_mix(self) -> Dict[str, float]:
+        """The fraction of opcodes of each type."""
+        total = sum(self.opcodes.values())
+        return {name: count / total for name, count in sorted(self.opcodes.items())}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a JSON serializable dictionary, including derived rates."""
+        return {
+            **asdict(self),
+            "compression_ratio": self.compression_ratio,
+            "encode_fps": self.encode_fps,
+            "decode_fps": self.decode_fps,
+            "encode_mbps": self.encode_mbps,
+            "decode_mbps": self.decode_mbps,
+        }
+
+
+def run_benchmark(
+    clip: str, width: int, height: int, frames: int, **encoder_options
+) -> BenchResult:
+    """Encode and decode a synthetic clip, checking it round trips."""
+    video = CLIPS[clip](width, height, frames)
+    file = BytesIO()
+    encoder = Encoder(file, width, height, ColourSpace.sRGB, **encoder_options)
+    start = perf_counter()
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+    encode_seconds = perf_counter() - start
+
+    file.seek(0)
+    decoder = Decoder(file)
+    opcodes: Counter = Counter()
+    decoded = []
+    start = perf_counter()
+    for frame, details in decoder:
+        opcodes.update(details)
+        decoded.append(frame)
+    decode_seconds = perf_counter() - start
+
+    if len(decoded) != frames or not all(
+        np.array_equal(a, b) for a, b in zip(video(), decoded)
+    ):
+        raise ValueError(f"Clip {clip} did not round trip.")
+
+    return BenchResult(
+        clip,
+        width,
+        height,
+        frames,
+        raw_bytes=width * height * 3 * frames,
+        encoded_bytes=len(file.getvalue()),
+        encode_seconds=encode_seconds,
+        decode_seconds=decode_seconds,
+        opcodes=dict(opcodes),
+    )
+
+
+def load_baseline(path: Path) -> Dict[str, Dict[str, float]]:
+    """Load a baseline, or an empty one if the file does not exist."""
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_baseline(
+    path: Path, results: List[BenchResult], include_speed: bool = True
+) -> None:
+    """Save results into a baseline for later runs to compare against.
+
+    Entries for other clips and resolutions already in the baseline are kept.
+    """
+    baseline = load_baseline(path)
+    for result in results:
+        entry = {"compression_ratio": round(result.compression_ratio, 6)}
+        if include_speed:
+            entry["encode_fps"] = result.encode_fps
+            entry["decode_fps"] = result.decode_fps
+        baseline[result.name] = entry
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+
+def compare_to_baseline(
+    results: List[BenchResult],
+    baseline: Dict[str, Dict[str, float]],
+    speed_tolerance: Optional[float] = 0.25,
+) -> List[str]:
+    """Describe every regression of the results against a baseline.
+
+    Compression ratios are deterministic, so any drop is a regression. Speeds
+    vary between runs and machines, so they only regress when more than
+    speed_tolerance slower, and are not compared if it is None.
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            continue
+        ratio = expected.get("compression_ratio")
+        if ratio is not None and result.compression_ratio < ratio * (1 - 1e-6):
+            regressions.append(
+                f"{result.name}: compression ratio {result.compression_ratio:.4f} "
+                f"is below the baseline {ratio:.4f}"
+            )
+        if speed_tolerance is None:
+            continue
+        for metric in ("encode_fps", "decode_fps"):
+            value = getattr(result, metric)
+            if metric in expected and value < expected[metric] * (1 - speed_tolerance):
+                regressions.append(
+                    f"{result.name}: {metric} {value:.2f} is more than "
+                    f"{speed_tolerance:.0%} below the baseline {expected[metric]:.2f}"
+                )
+    return regressions
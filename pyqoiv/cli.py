@@ -1,22 +1,108 @@
+import sys
+from io import BufferedIOBase
 import time
+from enum import Enum
 from numpy.typing import NDArray
 import typer
 from pathlib import Path
-from pyqoiv.encode import Encoder
-from pyqoiv.decode import Decoder
-from pyqoiv.types import ColourSpace
+from pyqoiv.encode import EncoderPreset
+from pyqoiv.bench import (
+    CLIPS,
+    compare_to_baseline,
+    load_baseline,
+    run_benchmark,
+    save_baseline,
+)
+from pyqoiv.hashing import HashStats, analyze_hashes, select_hash
+from pyqoiv.multistream import MultiStreamEncoder, MultiStreamServer
+from pyqoiv.scan import scan_frames, summarize
+from pyqoiv.pipeline import decode_pipeline, encode_pipeline
+from pyqoiv.y4m import Y4mWriter
+from pyqoiv.decode import DecodeMode, Decoder
+from pyqoiv.types import HASH_SIZES, ColourSpace, Compression, HashFunction
 import ffmpeg
 import numpy as np
 import tqdm as tqdm
-from typing import Generator
+from typing import BinaryIO, List, Optional
+from collections import Counter
 import json
 
 app = typer.Typer()
 
 
+class CompressionOption(str, Enum):
+    """Entropy coders pyqoiv encode can apply to each frame."""
+
+    none = "none"
+    zlib = "zlib"
+    lzma = "lzma"
+    zstd = "zstd"
+
+
+def readinto_exact(stream: BufferedIOBase, buffer: NDArray[np.uint8]) -> bool:
+    """Fill a buffer from a stream, returning False if the stream has ended."""
+    view = buffer.data.cast("B")
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            if filled:
+                raise ValueError("Stream ended part way through a frame.")
+            return False
+        filled += count
+    return True
+
+
 @app.command()
-def encode(input_file: Path, output_file: Path) -> None:
-    """Encode a qoiv formatted file from any video file ffmpeg supports."""
+def encode(
+    input_file: Path,
+    output_file: Path,
+    preset: EncoderPreset = EncoderPreset.balanced,
+    motion_range: Optional[int] = None,
+    keyframe_interval: int = 20,
+    scene_threshold: Optional[float] = None,
+    min_keyframe_interval: int = 1,
+    tolerance: int = 0,
+    compression: CompressionOption = CompressionOption.none,
+    jobs: int = 1,
+    verbose: bool = False,
+    hash_function: str = "qoi",
+    hash_size: int = 64,
+    proxy_scale: Optional[int] = None,
+    proxy_interval: Optional[int] = None,
+    tile_size: Optional[int] = None,
+    grayscale: bool = False,
+    colourspace: str = "sRGB",
+) -> None:
+    """Encode a qoiv formatted file from any video file ffmpeg supports.
+
+    The preset trades encoding speed against file size. A non-zero motion range enables global motion search for predicted frames,
+    which helps with panning content. A scene threshold between 0 and 1 places
+    keyframes early when that ratio of pixels changed from the last keyframe.
+    A non-zero tolerance enables near-lossless encoding, allowing each channel
+    of a decoded pixel to be off by up to that much. Compression applies zlib,
+    lzma or zstd to each frame individually. Reading, encoding and writing
+    run as overlapped stages, with jobs encoder processes. Verbose prints the
+    utilization of each stage. The hash function and size pick how colours are
+    indexed, and an auto hash function picks both from the first few frames.
+    A proxy scale embeds previews downscaled by that factor at each keyframe,
+    or every proxy interval frames. A tile size codes predicted frames as
+    tiles of that size, skipping those unchanged from the keyframe.
+    Grayscale encodes a single luma channel. ffmpeg's sRGB output is stored
+    in colourspace, sRGB or Linear.
+    """
+    if colourspace not in ColourSpace.__members__:
+        raise typer.BadParameter(
+            f"Colourspace must be one of {', '.join(ColourSpace.__members__)}."
+        )
+    if hash_function != "auto" and hash_function not in HashFunction.__members__:
+        raise typer.BadParameter(
+            f"Hash function must be auto or one of {', '.join(HashFunction.__members__)}."
+        )
+    if hash_size not in HASH_SIZES:
+        raise typer.BadParameter(
+            f"Hash size must be one of {', '.join(map(str, HASH_SIZES))}."
+        )
     probe = ffmpeg.probe(str(input_file))
     video_stream = next(
         (stream for stream in probe["streams"] if stream["codec_type"] == "video"), None
@@ -28,54 +114,167 @@ def encode(input_file: Path, output_file: Path) -> None:
     frame_rate = int(video_stream["avg_frame_rate"].split("/")[0])
     duration = float(probe["format"]["duration"])
     approx_frames = int(frame_rate * duration)
+    pix_fmt = "gray" if grayscale else "rgb24"
+    channels = 1 if grayscale else 3
 
-    encoder = Encoder(
-        output_file.open("wb"), width, height, ColourSpace.Linear, keyframe_interval=20
-    )
+    if hash_function == "auto":
+        sample, _ = (
+            ffmpeg.input(str(input_file))
+            .output("pipe:", format="rawvideo", pix_fmt=pix_fmt, vframes=5)
+            .run(capture_stdout=True, quiet=True)
+        )
+        frames = np.frombuffer(sample, dtype=np.uint8).reshape(
+            -1, height, width, channels
+        )
+        function, hash_size = select_hash(frames)
+        print(f"Hash: {function.name} over {hash_size} colours")
+    else:
+        function = HashFunction[hash_function]
 
     out = (
         ffmpeg.input(str(input_file))
-        .output("pipe:", format="rawvideo", pix_fmt="rgb24")
+        .output("pipe:", format="rawvideo", pix_fmt=pix_fmt)
         .run_async(pipe_stdout=True, quiet=True)
     )
 
-    def read_frames() -> Generator[NDArray[np.uint8], None, None]:
-        while True:
-            in_bytes = out.stdout.read(width * height * 3)
-            if not in_bytes:
-                break
-            in_frame = np.frombuffer(in_bytes, np.uint8).reshape((height, width, 3))
-            yield in_frame
-
-    for frame in tqdm.tqdm(read_frames(), total=approx_frames, desc="Encoding"):
-        encoder.push(frame)
+    with tqdm.tqdm(total=approx_frames, desc="Encoding") as progress:
+        encoder, stats = encode_pipeline(
+            lambda frame: readinto_exact(out.stdout, frame),
+            output_file.open("wb"),
+            width,
+            height,
+            ColourSpace[colourspace],
+            jobs=jobs,
+            progress=lambda: progress.update(),
+            keyframe_interval=keyframe_interval,
+            motion_search_range=motion_range,
+            scene_change_threshold=scene_threshold,
+            min_keyframe_interval=min_keyframe_interval,
+            preset=preset,
+            tolerance=tolerance,
+            compression=Compression[compression.value],
+            hash_function=function,
+            hash_size=hash_size,
+            proxy_scale=proxy_scale,
+            proxy_interval=proxy_interval,
+            tile_size=tile_size,
+            grayscale=grayscale,
+            input_colourspace=ColourSpace.sRGB,
+        )
     out.stdout.close()
+    encoder.flush()
+
+    reasons = Counter(d.reason.value for d in encoder.keyframe_decisions)
+    print(
+        f"Keyframes: {len(encoder.keyframe_decisions)} of {encoder.total_frames} frames "
+        f"{dict(reasons)}"
+    )
+    if verbose:
+        print(stats.report())
 
-    pass
+
+class OutputFormat(str, Enum):
+    """Formats pyqoiv decode can write."""
+
+    ffv1 = "ffv1"
+    raw = "raw"
+    y4m = "y4m"
 
 
 @app.command()
-def decode(input_file: Path, output_file: Path) -> None:
-    """Decode qoiv formatted file into a ffv1 encoded video file."""
+def decode(
+    input_file: Path,
+    output_file: Optional[Path] = None,
+    format: OutputFormat = OutputFormat.ffv1,
+    frame_rate: int = 30,
+    verbose: bool = False,
+    step: int = 1,
+    mode: DecodeMode = DecodeMode.strict,
+) -> None:
+    """Decode qoiv formatted file into a ffv1 encoded video file.
 
-    decoder = Decoder(input_file.open("rb"))
+    The raw format writes rgb24 (or gray) frames, and the y4m format a 4:4:4
+    (or mono) YUV4MPEG2 stream, to the output file or stdout so they can be
+    piped into other tools without re-encoding. Frames are always written in
+    sRGB, converting linear files. Frames are decoded on a separate thread to the one
+    writing them. Verbose prints the utilization of each stage. Step only
+    decodes every step-th frame, skipping the others, for previews. The fast
+    mode skips most validation, for trusted files.
+    """
+    if step < 1:
+        raise typer.BadParameter("step must be at least 1.")
+    decoder = Decoder(input_file.open("rb"), colourspace=ColourSpace.sRGB, mode=mode)
     width, height = decoder.header.width, decoder.header.height
-    out = (
-        ffmpeg.input("pipe:", format="rawvideo", pix_fmt="rgb24", s=f"{width}x{height}")
-        .output(str(output_file), vcodec="ffv1")
-        .run_async(pipe_stdin=True, quiet=True)
-    )
+    channels = decoder.header.channels
 
-    for frame, _ in tqdm.tqdm(decoder, desc="Decoding"):
-        out.stdin.write(frame.reshape(-1, 3, copy=False).tobytes())
+    out = None
+    stream: BinaryIO
+    if format == OutputFormat.ffv1:
+        if output_file is None:
+            raise typer.BadParameter("An output file is needed for ffv1 output.")
+        out = (
+            ffmpeg.input(
+                "pipe:",
+                format="rawvideo",
+                pix_fmt="gray" if channels == 1 else "rgb24",
+                s=f"{width}x{height}",
+                framerate=frame_rate,
+            )
+            .output(str(output_file), vcodec="ffv1")
+            .run_async(pipe_stdin=True, quiet=True)
+        )
+        stream = out.stdin
+    elif output_file is not None:
+        stream = output_file.open("wb")
+    else:
+        stream = sys.stdout.buffer
 
-    out.stdin.close()
-    out.wait()
+    if format == OutputFormat.y4m:
+        write = Y4mWriter(stream, width, height, frame_rate, channels).write
+    else:
+
+        def write(frame: NDArray[np.uint8]) -> None:
+            """Write the raw pixels of a frame."""
+            stream.write(frame.data)
+
+    with tqdm.tqdm(desc="Decoding") as progress:
+        stats = decode_pipeline(
+            decoder, write, progress=lambda: progress.update(), step=step
+        )
+
+    if out is not None:
+        out.stdin.close()
+        out.wait()
+    elif output_file is not None:
+        stream.close()
+    else:
+        stream.flush()
+    if verbose:
+        print(stats.report(), file=sys.stderr)
 
 
 @app.command()
-def frameinfo(input_file: Path) -> None:
-    """Print the information about frames and opcodes in a qoiv file."""
+def frameinfo(
+    input_file: Path, scan: bool = False, summary: bool = False, jobs: int = 1
+) -> None:
+    """Print the information about frames and opcodes in a qoiv file.
+
+    Scan tokenizes the opcodes without reconstructing any pixels, printing a
+    compact JSON line per frame, which is much faster on large files. Summary
+    implies scan, and prints the frame size percentiles, opcode mix per frame
+    type and group of pictures sizes instead. Jobs scans groups of pictures in
+    parallel, for files with compressed frames.
+    """
+    if scan or summary:
+        with input_file.open("rb") as file:
+            frames = scan_frames(file, jobs=jobs)
+            if summary:
+                print(json.dumps(summarize(frames).to_dict(), indent=2))
+                return
+            for frame in frames:
+                print(json.dumps(frame.to_dict(), separators=(",", ":")))
+        return
+
     decoder = Decoder(input_file.open("rb"))
     print(f"Header: {decoder.header}")
 
@@ -93,3 +292,131 @@ def frameinfo(input_file: Path) -> None:
         last_pos = decoder.file.tell()
         then = now
         print(json.dumps(frame_info, indent=2))
+
+
+@app.command()
+def bench(
+    clip: List[str] = typer.Option(list(CLIPS), help="Synthetic clips to run."),
+    resolution: List[str] = typer.Option(["64x64", "160x120"]),
+    frames: int = 10,
+    keyframe_interval: int = 5,
+    preset: EncoderPreset = EncoderPreset.balanced,
+    baseline: Optional[Path] = None,
+    update_baseline: bool = False,
+    record_speed: bool = True,
+    speed_tolerance: float = 0.25,
+) -> None:
+    """Benchmark encoding and decoding synthetic clips at several resolutions.
+
+    Reports frames and megabytes per second, compression ratio and opcode mix.
+    With a baseline, exits with an error if the compression ratio dropped or
+    either speed dropped by more than the speed tolerance, or records a new
+    baseline with update baseline. A negative speed tolerance only compares
+    compression ratios, which unlike speeds are reproducible between machines.
+    """
+    unknown = [name for name in clip if name not in CLIPS]
+    if unknown:
+        raise typer.BadParameter(f"Clips must be some of {', '.join(CLIPS)}.")
+    sizes = []
+    for size in resolution:
+        try:
+            width, height = (int(value) for value in size.split("x"))
+        except ValueError:
+            raise typer.BadParameter("Resolutions must be WIDTHxHEIGHT.")
+        sizes.append((width, height))
+
+    results = []
+    print(
+        f"{'clip':<20}{'ratio':>8}{'enc fps':>10}{'enc MB/s':>10}"
+        f"{'dec fps':>10}{'dec MB/s':>10}  opcodes"
+    )
+    for name in clip:
+        for width, height in sizes:
+            result = run_benchmark(
+                name,
+                width,
+                height,
+                frames,
+                keyframe_interval=keyframe_interval,
+                preset=preset,
+            )
+            results.append(result)
+            mix = ", ".join(
+                f"{opcode} {fraction:.0%}"
+                for opcode, fraction in result.opcode_mix().items()
+            )
+            print(
+                f"{result.name:<20}{result.compression_ratio:>8.2f}"
+                f"{result.encode_fps:>10.1f}{result.encode_mbps:>10.3f}"
+                f"{result.decode_fps:>10.1f}{result.decode_mbps:>10.3f}  {mix}"
+            )
+
+    if baseline is None:
+        return
+    if update_baseline:
+        save_baseline(baseline, results, include_speed=record_speed)
+        return
+    regressions = compare_to_baseline(
+        results,
+        load_baseline(baseline),
+        speed_tolerance if speed_tolerance >= 0 else None,
+    )
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    if regressions:
+        raise typer.Exit(1)
+
+
+@app.command()
+def hashinfo(input_file: Path, frames: Optional[int] = None) -> None:
+    """Compare colour hash functions and map sizes on the frames of a qoiv file.
+
+    Every frame is decoded and replayed through each hash map, reporting the
+    hit rate and evictions, where a colour was lost to a collision.
+    """
+    decoder = Decoder(input_file.open("rb"))
+    header = decoder.header
+    print(f"Current: {header.hash_function.name} over {header.hash_size} colours")
+    decoded = (frame for frame, _ in decoder)
+    if frames is not None:
+        decoded = (frame for frame, _ in zip(decoded, range(frames)))
+    results = analyze_hashes(tqdm.tqdm(decoded, desc="Analyzing"))
+
+    print(f"{'hash':<16}{'size':>6}{'hit rate':>10}{'hits':>10}{'evictions':>11}")
+    for (function, size), per_frame in results.items():
+        total = sum(per_frame, HashStats())
+        print(
+            f"{function.name:<16}{size:>6}{total.hit_rate:>10.2%}"
+            f"{total.hits:>10}{total.evictions:>11}"
+        )
+
+
+@app.command()
+def serve(
+    directory: Path,
+    host: str = "127.0.0.1",
+    port: int = 9000,
+    jobs: int = 1,
+    max_pending: int = 4,
+    keyframe_interval: int = 20,
+    preset: EncoderPreset = EncoderPreset.balanced,
+) -> None:
+    """Encode streams sent over TCP, sharing jobs encoder processes.
+
+    Each stream is written to <stream id>.qoiv in directory. See
+    pyqoiv.multistream.StreamClient for the protocol.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    with MultiStreamEncoder(jobs=jobs, max_pending=max_pending) as encoder:
+        with MultiStreamServer(
+            (host, port),
+            encoder,
+            directory,
+            keyframe_interval=keyframe_interval,
+            preset=preset,
+        ) as server:
+            print(f"Listening on {host}:{port}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
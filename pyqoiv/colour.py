@@ -0,0 +1,59 @@
+from typing import Optional
+import numpy as np
+from numpy.typing import NDArray
+from .types import ColourSpace
+
+
+def srgb_to_linear(values: NDArray[np.float64]) -> NDArray[np.float64]:
+    """Decode sRGB values between 0..1 into linear light."""
+    return np.where(
+        values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4
+    )
+
+
+def linear_to_srgb(values: NDArray[np.float64]) -> NDArray[np.float64]:
+    """Encode linear light between 0..1 into sRGB values."""
+    return np.where(
+        values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055
+    )
+
+
+_LEVELS = np.arange(256) / 255
+# Lookup tables between 8 bit sRGB and linear values, indexed by the source
+# value. With only 8 bits, linear values quantize dark sRGB values coarsely, so
+# converting to linear and back is not lossless.
+SRGB_TO_LINEAR = np.rint(srgb_to_linear(_LEVELS) * 255).astype(np.uint8)
+LINEAR_TO_SRGB = np.rint(linear_to_srgb(_LEVELS) * 255).astype(np.uint8)
+
+
+def conversion_table(
+    source: ColourSpace, target: ColourSpace
+) -> Optional[NDArray[np.uint8]]:
+    """The lookup table converting source values into target, None if they match."""
+    if source == target:
+        return None
+    if source == ColourSpace.sRGB and target == ColourSpace.Linear:
+        return SRGB_TO_LINEAR
+    if source == ColourSpace.Linear and target == ColourSpace.sRGB:
+        return LINEAR_TO_SRGB
+    raise ValueError(f"Can not convert from {source.name} to {target.name}")
+
+
+def convert(
+    frame: NDArray[np.uint8],
+    source: ColourSpace,
+    target: ColourSpace,
+    out: Optional[NDArray[np.uint8]] = None,
+) -> NDArray[np.uint8]:
+    """Convert a frame between colourspaces, into out if provided.
+
+    out may be the frame itself, to convert it in place. The frame is
+    returned as is when the colourspaces match.
+    """
+    table = conversion_table(source, target)
+    if table is None:
+        if out is not None and out is not frame:
+            np.copyto(out, frame)
+            return out
+        return frame
+    return np.take(table, frame, out=out)
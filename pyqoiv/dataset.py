@@ -0,0 +1,280 @@
+import sys
+from bisect import bisect_right
+from dataclasses import dataclass
+from multiprocessing import shared_memory, util
+from pathlib import Path
+from typing import (
+    Dict,
+    Generic,
+    List,
+    Literal,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+    overload,
+)
+import numpy as np
+from numpy.typing import NDArray
+from .decode import Decoder, KeyFrameCache
+from .types import QovHeader
+
+# Shared memory blocks this process has attached to, by name.
+_attached: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to a shared memory block created by another process, once."""
+    block = _attached.get(name)
+    if block is None:
+        # The creating process is responsible for unlinking the block.
+        if sys.version_info >= (3, 13):
+            block = shared_memory.SharedMemory(name, track=False)
+        else:
+            block = shared_memory.SharedMemory(name)
+        _attached[name] = block
+    return block
+
+
+def _release(block: shared_memory.SharedMemory) -> None:
+    """Remove a block created by this process."""
+    _attached.pop(block.name, None)
+    block.unlink()
+    try:
+        block.close()
+    except BufferError:
+        # Frames in the block are still in use, so it is unmapped with them.
+        pass
+
+
+class SharedFrame:
+    """A decoded frame held in shared memory, pickled by reference.
+
+    Pickling only records where the frame is, so passing one from a worker
+    process to another copies no pixels. The frame stays valid until the
+    worker that decoded it has decoded ring_size more frames.
+    """
+
+    def __init__(self, name: str, offset: int, shape: Tuple[int, int, int]):
+        """Refer to a frame at offset in the named shared memory block."""
+        self.name = name
+        self.offset = offset
+        self.shape = shape
+
+    @property
+    def array(self) -> NDArray[np.uint8]:
+        """A view of the frame, without copying it."""
+        return np.ndarray(
+            self.shape,
+            dtype=np.uint8,
+            buffer=_attach(self.name).buf,
+            offset=self.offset,
+        )
+
+    def __array__(self, dtype=None, copy=None) -> NDArray:
+        """Convert to a numpy array, copying only if asked to."""
+        array = self.array
+        if dtype is not None:
+            return array.astype(dtype)
+        return array.copy() if copy else array
+
+    def __reduce__(self):
+        """Pickle the location of the frame rather than its pixels."""
+        return SharedFrame, (self.name, self.offset, self.shape)
+
+
+class SharedFrameRing:
+    """A ring of frame sized slots in a shared memory block.
+
+    The block is removed when the ring is closed, or when the process
+    creating it exits, including data loader and pool worker processes.
+    """
+
+    def __init__(self, shape: Tuple[int, int, int], slots: int):
+        """Create a block holding slots frames of shape."""
+        self.shape = shape
+        self.frame_size = int(np.prod(shape))
+        self.slots = slots
+        self.next_slot = 0
+        self.block = shared_memory.SharedMemory(
+            create=True, size=self.frame_size * slots
+        )
+        _attached[self.block.name] = self.block
+        # Frames outlive the ring, as they are handed to other processes, so
+        # the block is only removed once the creating process exits.
+        self._release = util.Finalize(None, _release, (self.block,), exitpriority=0)
+
+    def put(self, frame: NDArray[np.uint8]) -> SharedFrame:
+        """Copy a frame into the next slot, overwriting the oldest frame."""
+        shared = SharedFrame(
+            self.block.name, self.next_slot * self.frame_size, self.shape
+        )
+        shared.array[...] = frame
+        self.next_slot = (self.next_slot + 1) % self.slots
+        return shared
+
+    def close(self) -> None:
+        """Release and remove the block."""
+        self._release()
+
+
+@dataclass
+class FileIndex:
+    """Where the frames of a file are, and which keyframe each depends on."""
+
+    path: Path
+    header: QovHeader
+    positions: List[int]
+    keyframes: List[int]
+
+    @classmethod
+    def build(cls, path: Path) -> "FileIndex":
+        """Index a file by scanning it, without decoding any pixels."""
+        with open(path, "rb") as file:
+            decoder = Decoder(file, key_cache_bytes=0)
+            positions, keyframes = decoder.index()
+        return cls(path, decoder.header, positions, keyframes)
+
+    def __len__(self) -> int:
+        """The number of frames in the file."""
+        return len(self.positions)
+
+
+# Frames are returned as arrays, or as SharedFrames with shared_memory.
+Frame = TypeVar("Frame", NDArray[np.uint8], SharedFrame)
+
+
+class QoivDataset(Generic[Frame]):
+    """Random access to the frames of many qoiv files, for training pipelines.
+
+    Frames are numbered across the files in order. Each file is indexed when
+    the dataset is constructed, so reading a frame only decodes it and,
+    unless it is cached, its keyframe. Open files and the cache are per
+    process, so every worker of a data loader keeps its own.
+
+    With shared_memory, frames are returned as SharedFrames in a ring of
+    ring_size slots, so they can be returned from worker processes without
+    pickling their pixels.
+    """
+
+    @overload
+    def __init__(
+        self: "QoivDataset[NDArray[np.uint8]]",
+        paths: Sequence[Union[str, Path]],
+        key_cache_bytes: int = 64 * 1024 * 1024,
+        shared_memory: Literal[False] = False,
+        ring_size: int = 16,
+    ) -> None:
+        """Index the files of a dataset returning frames as arrays."""
+
+    @overload
+    def __init__(
+        self: "QoivDataset[SharedFrame]",
+        paths: Sequence[Union[str, Path]],
+        key_cache_bytes: int = 64 * 1024 * 1024,
+        *,
+        shared_memory: Literal[True],
+        ring_size: int = 16,
+    ) -> None:
+        """Index the files of a dataset returning frames in shared memory."""
+
+    def __init__(
+        self,
+        paths: Sequence[Union[str, Path]],
+        key_cache_bytes: int = 64 * 1024 * 1024,
+        shared_memory: bool = False,
+        ring_size: int = 16,
+    ) -> None:
+        """Index the files of the dataset."""
+        if key_cache_bytes < 0:
+            raise ValueError("key_cache_bytes must not be negative.")
+        if ring_size < 1:
+            raise ValueError("ring_size must be at least 1.")
+        self.files = [FileIndex.build(Path(path)) for path in paths]
+        self.key_cache_bytes = key_cache_bytes
+        self.shared_memory = shared_memory
+        self.ring_size = ring_size
+        self.starts: List[int] = []
+        total = 0
+        for index in self.files:
+            self.starts.append(total)
+            total += len(index)
+        self.length = total
+        self._reset()
+
+    def _reset(self) -> None:
+        """Forget the per process state."""
+        self.decoders: Dict[int, Decoder] = {}
+        self.key_cache = KeyFrameCache(self.key_cache_bytes)
+        self.rings: Dict[Tuple[int, int, int], SharedFrameRing] = {}
+
+    def __getstate__(self) -> Dict:
+        """Pickle the index, but not open files, the cache or shared memory."""
+        state = self.__dict__.copy()
+        del state["decoders"], state["key_cache"], state["rings"]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        """Restore the index, starting with fresh per process state."""
+        self.__dict__.update(state)
+        self._reset()
+
+    def __len__(self) -> int:
+        """The number of frames across all the files."""
+        return self.length
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """Find the file and frame number within it of a dataset index."""
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Frame index out of range.")
+        file_index = bisect_right(self.starts, index) - 1
+        return file_index, index - self.starts[file_index]
+
+    def __getitem__(self, index: int) -> Frame:
+        """Decode a frame, in shared memory if enabled."""
+        frame = self.read(*self.locate(index))
+        if not self.shared_memory:
+            return cast(Frame, frame)
+        shape = cast(Tuple[int, int, int], frame.shape)
+        ring = self.rings.get(shape)
+        if ring is None:
+            ring = self.rings[shape] = SharedFrameRing(shape, self.ring_size)
+        return cast(Frame, ring.put(frame))
+
+    def _decoder(self, file_index: int) -> Decoder:
+        """Open a file for this process, if it has not been already.
+
+        The decoders share the dataset's key frame cache and reuse its index.
+        """
+        decoder = self.decoders.get(file_index)
+        if decoder is None:
+            index = self.files[file_index]
+            decoder = self.decoders[file_index] = Decoder(
+                open(index.path, "rb"),
+                key_cache=self.key_cache,
+                index=(index.positions, index.keyframes),
+            )
+        return decoder
+
+    def read(self, file_index: int, frame_number: int) -> NDArray[np.uint8]:
+        """Decode a frame of one of the files."""
+        return self._decoder(file_index).frame(frame_number)
+
+    def close(self) -> None:
+        """Close the files and release the shared memory of this process."""
+        for decoder in self.decoders.values():
+            decoder.file.close()
+        for ring in self.rings.values():
+            ring.close()
+        self._reset()
+
+    def __enter__(self) -> "QoivDataset[Frame]":
+        """Use the dataset as a context manager."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Close the dataset."""
+        self.close()
@@ -1,9 +1,40 @@
-from collections import defaultdict
-from io import BufferedIOBase
-from typing import Dict, Tuple
+from collections import OrderedDict, defaultdict
+from enum import Enum
+import itertools
+from io import SEEK_CUR, SEEK_END, BufferedIOBase, BytesIO
+import struct
+from time import perf_counter
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
 from numpy.typing import NDArray
 import numpy as np
-from .types import QovHeader, QovFrameHeader, FrameType, PixelHashMap
+from .colour import conversion_table
+from .entropy import decompress
+from .layout import PixelLayout
+from .metrics import Metrics
+from .motion import shift_frame
+from .scan import (
+    ABOVE_DIFF,
+    ABOVE_RUN,
+    DIFF,
+    DIFF_FRAME,
+    FRAME_RUN,
+    GRAY,
+    GRAY_DIFF,
+    INDEX,
+    OPCODE_NAMES,
+    RGB,
+    RUN,
+    scan_frames,
+)
+from .tiles import bitmap_size, gather_tiles, pad_to_tiles, scatter_tiles, unpack_bitmap
+from .types import (
+    ColourSpace,
+    HashFunction,
+    QovHeader,
+    QovFrameHeader,
+    FrameType,
+    PixelHashMap,
+)
 from .opcodes import (
     RgbOpcode,
     DiffOpcode,
@@ -11,129 +42,832 @@ from .opcodes import (
     FrameRunOpcode,
     RunOpcode,
     DiffFrameOpcode,
+    AboveRunOpcode,
+    AboveDiffOpcode,
+    GrayOpcode,
+    GrayDiffOpcode,
 )
 
 
+KeyState = Tuple[NDArray[np.uint8], PixelHashMap]
+# The least the fast decoder reads from an unsized stream at a time.
+READ_CHUNK = 64 * 1024
+
+
+class DecodeMode(str, Enum):
+    """Enum to differentiate how thoroughly the decoder validates frames."""
+
+    # Every opcode is validated as it is read, and errors report the offset
+    # of the opcode and the pixel it was decoding.
+    strict = "strict"
+    # Opcodes are classified by their leading byte and decoded without
+    # reading them into opcode objects. Only the bounds of runs, and the
+    # number of pixels decoded, are checked, so corrupt frames still raise
+    # a ValueError, but without the offset. For trusted files.
+    fast = "fast"
+
+
+class KeyFrameCache:
+    """A least recently used cache of decoded key frames and their hash maps.
+
+    Entries are evicted once the key frames and hash maps held take more than
+    max_bytes, so a cache of 0 bytes holds nothing.
+    """
+
+    def __init__(self, max_bytes: int):
+        """Construct an empty cache."""
+        if max_bytes < 0:
+            raise ValueError("max_bytes must not be negative.")
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries: OrderedDict[Hashable, KeyState] = OrderedDict()
+
+    @staticmethod
+    def size_of(state: KeyState) -> int:
+        """The bytes a key frame and its hash map take."""
+        key_frame_flat, key_pixels = state
+        return key_frame_flat.nbytes + key_pixels.pixels.nbytes
+
+    def get(self, key: Hashable) -> Optional[KeyState]:
+        """Find a key frame, marking it as the most recently used."""
+        state = self.entries.get(key)
+        if state is not None:
+            self.entries.move_to_end(key)
+        return state
+
+    def put(self, key: Hashable, state: KeyState) -> None:
+        """Add a key frame, evicting the least recently used to make room."""
+        size = self.size_of(state)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= self.size_of(self.entries.pop(key))
+        self.entries[key] = state
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= self.size_of(evicted)
+
+    def __len__(self) -> int:
+        """The number of key frames held."""
+        return len(self.entries)
+
+
+_decoder_ids = itertools.count()
+
+
 class Decoder:
     """Decode a QOIV file into frames."""
 
-    def __init__(self, file: BufferedIOBase):
-        """Construct a new decoder."""
+    def __init__(
+        self,
+        file: BufferedIOBase,
+        metrics: Optional[Metrics] = None,
+        key_cache_bytes: int = 64 * 1024 * 1024,
+        colourspace: Optional[ColourSpace] = None,
+        mode: DecodeMode = DecodeMode.strict,
+        key_cache: Optional[KeyFrameCache] = None,
+        index: Optional[Tuple[List[int], List[int]]] = None,
+    ):
+        """Construct a new decoder, collecting into metrics if provided.
+
+        Key frames decoded for random access are cached, up to key_cache_bytes,
+        or in key_cache if provided, which can be shared between decoders. If
+        colourspace differs from the file's, decoded frames are converted
+        into it with a lookup table. Mode sets how thoroughly opcodes are
+        validated. An index of the file, as returned by index, saves
+        scanning it again.
+        """
         self.file = file
+        self.metrics = metrics
+        self.mode = mode
         self.header = QovHeader.read(file)
         self.first_frame_pos = file.tell()
         self.pixel_count = self.header.width * self.header.height
-        self.key_pixels = PixelHashMap()
+        self.output_table = conversion_table(
+            self.header.colourspace,
+            self.header.colourspace if colourspace is None else colourspace,
+        )
+        self.key_pixels = self.new_pixel_map()
+        self.key_frame_flat: Optional[NDArray[np.uint8]] = None
+        self.key_cache = (
+            KeyFrameCache(key_cache_bytes) if key_cache is None else key_cache
+        )
+        # Distinguishes this decoder's key frames in a shared cache.
+        self.cache_id = next(_decoder_ids)
+        self._index = index
+
+    def new_pixel_map(self) -> PixelHashMap:
+        """Create an empty colour hash map, hashed as the header specifies."""
+        return PixelHashMap(
+            self.header.hash_size, self.header.hash_function, self.header.channels
+        )
 
     def __iter__(self) -> "Decoder":
         """Setup the iterator"""
         self.frame_pos = self.first_frame_pos
         self.file.seek(self.frame_pos)
-        self.key_pixels = PixelHashMap()
+        self.key_pixels = self.new_pixel_map()
         self.key_frame_flat = None
         return self
 
     def __next__(self):
         """Get the next frame."""
+        if not self.skip_proxies():
+            raise StopIteration
         return self.read_frame()
 
-    def read_frame(self) -> Tuple[NDArray[np.uint8], Dict[str, int]]:
-        """Read the next frame from the file."""
+    def index(self) -> Tuple[List[int], List[int]]:
+        """Locate every frame, and the key frame it depends on.
+
+        The file is scanned the first time, without reconstructing any pixels,
+        and returned to where it was.
+        """
+        if self._index is None:
+            position = self.file.tell()
+            positions: List[int] = []
+            keyframes: List[int] = []
+            for frame in scan_frames(self.file, opcodes=False):
+                if frame.frame_type == FrameType.Key or not keyframes:
+                    key = frame.frame_number
+                positions.append(frame.frame_position)
+                keyframes.append(key)
+            self.file.seek(position)
+            self._index = (positions, keyframes)
+        return self._index
+
+    @property
+    def frame_count(self) -> int:
+        """The number of frames in the file."""
+        return len(self.index()[0])
+
+    def frame(self, frame_number: int) -> NDArray[np.uint8]:
+        """Decode a frame by its number.
+
+        The key frame it depends on is decoded first, unless it is cached, so
+        stepping through the frames of a group of pictures in any order costs
+        one frame decode per step. Afterwards, the decoder continues from the
+        following frame.
+        """
+        positions, keyframes = self.index()
+        if not 0 <= frame_number < len(positions):
+            raise IndexError("Frame number out of range.")
+        key = keyframes[frame_number]
+        state = self.key_cache.get((self.cache_id, key))
+        if state is None:
+            self.file.seek(positions[key])
+            frame, _ = self.read_frame()
+            assert self.key_frame_flat is not None
+            self.key_cache.put(
+                (self.cache_id, key), (self.key_frame_flat, self.key_pixels)
+            )
+            if frame_number == key:
+                # Unless converted, the frame is the cached key frame, so must
+                # not be modified.
+                return frame if self.output_table is not None else frame.copy()
+        else:
+            self.key_frame_flat, self.key_pixels = state
+            if frame_number == key:
+                if frame_number + 1 < len(positions):
+                    self.file.seek(positions[frame_number + 1])
+                else:
+                    self.file.seek(0, SEEK_END)
+                return self.output(
+                    self.key_frame_flat.reshape(
+                        self.header.height, self.header.width, self.header.channels
+                    ),
+                    in_place=False,
+                )
+        self.file.seek(positions[frame_number])
+        frame, _ = self.read_frame()
+        return frame
+
+    def frames(
+        self, start: Optional[int] = None, stop: Optional[int] = None, step: int = 1
+    ) -> Iterator[NDArray[np.uint8]]:
+        """Decode the frames selected as if slicing a list, in any direction."""
+        for frame_number in range(self.frame_count)[start:stop:step]:
+            yield self.frame(frame_number)
+
+    def reverse(self) -> Iterator[NDArray[np.uint8]]:
+        """Decode the frames from last to first."""
+        return self.frames(step=-1)
+
+    def iter(self, step: int = 1) -> Iterator[NDArray[np.uint8]]:
+        """Decode every step-th frame, skipping the others.
+
+        Skipped frames are located through the index without decoding them,
+        so only the selected frames and the key frames they depend on are.
+        """
+        if step < 1:
+            raise ValueError("step must be at least 1.")
+        return self.frames(step=step)
+
+    def keyframe_numbers(self) -> List[int]:
+        """The numbers of the key frames, in order."""
+        return sorted(set(self.index()[1]))
+
+    def keyframes(self) -> Iterator[NDArray[np.uint8]]:
+        """Decode only the key frames, numbered as keyframe_numbers.
+
+        They are decoded through the key frame cache, so are shared with
+        random access.
+        """
+        for frame_number in self.keyframe_numbers():
+            yield self.frame(frame_number)
+
+    def read_size(self) -> int:
+        """Read the size prefix of a frame's opcodes."""
+        size = self.file.read(4)
+        if len(size) != 4:
+            raise ValueError("Frame ends part way through its header.")
+        (size,) = struct.unpack("<I", size)
+        return size
+
+    def read_block(self) -> BytesIO:
+        """Read the size prefixed opcodes of a frame, decompressing them."""
+        size = self.read_size()
+        return BytesIO(decompress(self.file.read(size), self.header.compression))
+
+    def skip_proxies(self) -> bool:
+        """Skip any proxy frames, returning False at the end of the file."""
+        while True:
+            position = self.file.tell()
+            frame_type = self.file.read(1)
+            if not frame_type:
+                return False
+            self.file.seek(position)
+            if frame_type[0] != FrameType.Proxy:
+                return True
+            if self.header.version < 3:
+                raise ValueError("Proxy frames need format version 3.")
+            QovFrameHeader.read(self.file)
+            self.file.seek(self.read_size(), SEEK_CUR)
+
+    def proxies(self) -> Iterator[Tuple[int, NDArray[np.uint8]]]:
+        """Decode only the proxy frames, with the number of the frame they proxy.
+
+        The other frames are skipped using their size prefixes, so this costs
+        no more than decoding the proxies. Files without sized frames can not
+        hold proxies.
+        """
+        if not self.header.sized:
+            return
+        self.file.seek(self.first_frame_pos)
+        frame_number = 0
+        while self.file.read(1):
+            self.file.seek(-1, SEEK_CUR)
+            frame_header = QovFrameHeader.read(self.file)
+            if frame_header.frame_type != FrameType.Proxy:
+                self.file.seek(self.read_size(), SEEK_CUR)
+                frame_number += 1
+                continue
+            frame, _, _ = self.decode_opcodes(
+                self.read_block(),
+                FrameType.Key,
+                frame_header.width,
+                frame_header.height,
+                None,
+            )
+            yield frame_number, self.output(frame)
+
+    def read_into(self, buffer, layout: PixelLayout = PixelLayout()) -> bool:
+        """Decode the next frame into a buffer in layout, returning False at the end.
+
+        The frame is written in the same pass as colourspace conversion.
+        """
+        if not self.skip_proxies():
+            return False
+        if layout.pixel_format.channels != self.header.channels:
+            raise ValueError("Pixel format does not match the file's channels.")
+        frame, _ = self.read_frame(convert=False)
+        layout.pack(frame, buffer, self.output_table)
+        return True
+
+    def read_frame(
+        self, convert: bool = True
+    ) -> Tuple[NDArray[np.uint8], Dict[str, int]]:
+        """Read the next frame from the file, skipping any proxy frames.
+
+        Unless convert is False, the frame is converted into the requested
+        colourspace.
+        """
+        for frame_type, frame, _, opcodes_read in self.read_rows():
+            pass
+        if convert and self.output_table is not None:
+            # Key frames are the reference for the frames that follow them.
+            frame = self.output(frame, frame_type != FrameType.Key)
+        return frame, opcodes_read
+
+    def read_rows(
+        self,
+    ) -> Iterator[Tuple[FrameType, NDArray[np.uint8], int, Dict[str, int]]]:
+        """Read the next frame, yielding its progress as rows are decoded.
+
+        Each step is the frame type, the frame being decoded, its number of
+        complete rows and the opcodes read so far. The last step is yielded
+        once the decoder has finished with the frame. Tiled frames only
+        complete at the end.
+        """
+        metrics = self.metrics.start_frame() if self.metrics is not None else None
+        self.skip_proxies()
+        if metrics is not None:
+            position = self.file.tell()
+            start = perf_counter()
         frame_header = QovFrameHeader.read(self.file)
+        frame_type = frame_header.frame_type
+        stream = self.read_block() if self.header.sized else self.file
+        if metrics is not None:
+            start = metrics.time("io", start)
+
+        if frame_type == FrameType.Tiled:
+            frame, pixels, opcodes_read = self.decode_tiled(
+                stream, frame_header.tile_size
+            )
+        else:
+            # Predicted frames reference the key frame, offset for Motion frames.
+            reference = self.key_frame_flat
+            if frame_type == FrameType.Motion and reference is not None:
+                reference = shift_frame(
+                    reference.reshape(
+                        self.header.height, self.header.width, self.header.channels
+                    ),
+                    frame_header.dx,
+                    frame_header.dy,
+                ).reshape(-1, self.header.channels)
+
+            frame = np.zeros(
+                (self.header.height, self.header.width, self.header.channels),
+                dtype=np.uint8,
+            )
+            pixels = self.new_pixel_map()
+            opcodes_read = defaultdict(int)
+            for rows in self.decode_pixels(
+                stream, frame_type, frame, pixels, opcodes_read, reference
+            ):
+                # The last rows wait until the decoder is done with the frame.
+                if rows < self.header.height:
+                    yield frame_type, frame, rows, opcodes_read
+
+        if frame_type == FrameType.Key:
+            self.key_pixels = pixels
+            self.key_frame_flat = frame.reshape(-1, self.header.channels)
+
+        if metrics is not None:
+            assert self.metrics is not None
+            metrics.time("decode", start)
+            metrics.frame_type = frame_type.name
+            metrics.size = self.file.tell() - position
+            metrics.opcodes = dict(opcodes_read)
+            self.metrics.record(metrics)
+
+        yield frame_type, frame, self.header.height, opcodes_read
+
+    def rows(self, rows: int = 1) -> Iterator[NDArray[np.uint8]]:
+        """Decode the next frame, yielding blocks of rows as they are reconstructed.
+
+        Blocks are read-only views of up to rows rows, shaped (count, width,
+        channels), converted into the requested colourspace. Nothing is
+        yielded at the end of the file. Sized frames are still read whole
+        before any rows are decoded.
+        """
+        if rows < 1:
+            raise ValueError("rows must be at least 1.")
+        if not self.skip_proxies():
+            return
+        done = 0
+        for frame_type, frame, decoded, _ in self.read_rows():
+            while done < decoded and (
+                decoded - done >= rows or decoded == self.header.height
+            ):
+                end = min(done + rows, decoded)
+                block = frame[done:end]
+                if self.output_table is not None:
+                    # Rows are converted in place only once the frame is
+                    # decoded, as later opcodes may read them, and never for
+                    # key frames, the reference for the frames that follow.
+                    block = self.output(
+                        block,
+                        frame_type != FrameType.Key and decoded == self.header.height,
+                    )
+                block.flags.writeable = False
+                yield block
+                done = end
+
+    def output(
+        self, frame: NDArray[np.uint8], in_place: bool = True
+    ) -> NDArray[np.uint8]:
+        """Convert a decoded frame into the requested colourspace.
+
+        Frames not converted in place are converted into a new array, or
+        copied if no conversion is needed.
+        """
+        if self.output_table is None:
+            return frame if in_place else frame.copy()
+        return np.take(self.output_table, frame, out=frame if in_place else None)
+
+    def decode_tiled(
+        self, stream: BufferedIOBase | BytesIO, tile_size: int
+    ) -> Tuple[NDArray[np.uint8], PixelHashMap, Dict[str, int]]:
+        """Decode a tiled frame, copying the unchanged tiles from the key frame."""
+        if self.header.version < 4:
+            raise ValueError("Tiled frames need format version 4.")
+        if self.key_frame_flat is None:
+            raise ValueError("Unexpected tiled frame without key frame.")
+        width, height = self.header.width, self.header.height
+        size = bitmap_size(width, height, tile_size)
+        bitmap = stream.read(size)
+        if len(bitmap) != size:
+            raise ValueError("Tiled frame ends part way through its bitmap.")
+        changed = unpack_bitmap(bitmap, width, height, tile_size)
+        padded = pad_to_tiles(
+            self.key_frame_flat.reshape(height, width, self.header.channels), tile_size
+        )
+        key_tiles = gather_tiles(padded, changed, tile_size)
+        tiles, pixels, opcodes_read = self.decode_opcodes(
+            stream,
+            FrameType.Tiled,
+            tile_size,
+            len(key_tiles),
+            key_tiles.reshape(-1, self.header.channels),
+        )
+        scatter_tiles(padded, changed, tile_size, tiles)
+        return np.ascontiguousarray(padded[:height, :width]), pixels, opcodes_read
 
-        frame = np.zeros((self.header.height, self.header.width, 3), dtype=np.uint8)
+    def decode_opcodes(
+        self,
+        stream: BufferedIOBase | BytesIO,
+        frame_type: FrameType,
+        width: int,
+        height: int,
+        reference: Optional[NDArray[np.uint8]],
+    ) -> Tuple[NDArray[np.uint8], PixelHashMap, Dict[str, int]]:
+        """Decode the opcodes of a frame, returning it and its hash map."""
+        frame = np.zeros((height, width, self.header.channels), dtype=np.uint8)
+        pixels = self.new_pixel_map()
+        opcodes_read: Dict[str, int] = defaultdict(int)
+        for _ in self.decode_pixels(
+            stream, frame_type, frame, pixels, opcodes_read, reference
+        ):
+            pass
+        return frame, pixels, opcodes_read
 
-        pixels = PixelHashMap()
+    def decode_pixels(
+        self,
+        stream: BufferedIOBase | BytesIO,
+        frame_type: FrameType,
+        frame: NDArray[np.uint8],
+        pixels: PixelHashMap,
+        opcodes_read: Dict[str, int],
+        reference: Optional[NDArray[np.uint8]],
+    ) -> Iterator[int]:
+        """Decode the opcodes of a frame into it, yielding each time a row completes.
 
-        opcodes_read = defaultdict(int)
+        The number of complete rows is yielded, so callers can use the rows
+        while the rest are decoded. In strict mode, errors report the offset
+        of the opcode in the stream, which is within the decompressed block
+        for sized frames.
+        """
+        if self.mode == DecodeMode.fast:
+            yield from self.decode_pixels_fast(
+                stream, frame_type, frame, pixels, opcodes_read, reference
+            )
+            return
+        height, width = frame.shape[:2]
+        pixel_count = width * height
+        frame_flat = frame.reshape(-1, self.header.channels)
+        has_above = self.header.version >= 1
+        gray = self.header.grayscale
+        channels = self.header.channels
 
         pixel_read = 0
-        while pixel_read < self.pixel_count:
-            cy = pixel_read // self.header.width
-            cx = pixel_read % self.header.width
-            if RgbOpcode.is_next(self.file):
-                opcode = RgbOpcode.read(self.file)
-                frame[
-                    cy,
-                    cx,
-                ] = [opcode.r, opcode.g, opcode.b]
-                pixels.push(frame[cy, cx])
-                pixel_read += 1
-                opcodes_read["rgb"] += 1
-            elif DiffOpcode.is_next(self.file):
-                opcode = DiffOpcode.read(self.file)
-                frame[cy, cx] = frame[
-                    (pixel_read - 1) // self.header.width,
-                    (pixel_read - 1) % self.header.width,
-                ] + np.array([opcode.dr, opcode.dg, opcode.db])
-                pixels.push(frame[cy, cx])
-                pixel_read += 1
-                opcodes_read["diff"] += 1
-            elif RunOpcode.is_next(self.file):
-                opcode = RunOpcode.read(self.file)
-                last_pixel = frame[
-                    (pixel_read - 1) // self.header.width,
-                    (pixel_read - 1) % self.header.width,
-                ]
-                frame.reshape(-1, 3, copy=False)[
-                    pixel_read : pixel_read + opcode.run
-                ] = last_pixel
-                pixel_read += opcode.run
-                opcodes_read["run"] += 1
-            elif IndexOpcode.is_next(self.file):
-                index_opcode = IndexOpcode.read(self.file)
-                frame[cy, cx] = pixels[index_opcode.index]
-                pixel_read += 1
-                opcodes_read["index"] += 1
-            elif DiffFrameOpcode.is_next(self.file):
-                if self.key_frame_flat is None:
-                    raise ValueError("Unexpected DiffFrameOpcode without key frame.")
-                if frame_header.frame_type == FrameType.Key:
-                    raise ValueError("Unexpected DiffFrameOpcode in key frame.")
-
-                diff_frame_opcode = DiffFrameOpcode.read(self.file)
-                if diff_frame_opcode.key_frame:
-                    if diff_frame_opcode.use_index:
-                        pixel = self.key_pixels[diff_frame_opcode.index] + np.array(
-                            [
-                                diff_frame_opcode.dr,
-                                diff_frame_opcode.dg,
-                                diff_frame_opcode.db,
-                            ]
+        row_end = width
+        position = stream.tell()
+        try:
+            while pixel_read < pixel_count:
+                if pixel_read >= row_end:
+                    yield pixel_read // width
+                    row_end = (pixel_read // width + 1) * width
+                position = stream.tell()
+                cy = pixel_read // width
+                cx = pixel_read % width
+                if gray and GrayOpcode.is_next(stream):
+                    gray_opcode = GrayOpcode.read(stream)
+                    frame_flat[pixel_read] = gray_opcode.value
+                    pixels.push(frame_flat[pixel_read])
+                    pixel_read += 1
+                    opcodes_read["gray"] += 1
+                elif gray and GrayDiffOpcode.is_next(stream):
+                    gray_diff_opcode = GrayDiffOpcode.read(stream)
+                    frame_flat[pixel_read] = frame_flat[pixel_read - 1] + np.uint8(
+                        gray_diff_opcode.diff & 0xFF
+                    )
+                    pixels.push(frame_flat[pixel_read])
+                    pixel_read += 1
+                    opcodes_read["gray_diff"] += 1
+                elif RgbOpcode.is_next(stream):
+                    opcode = RgbOpcode.read(stream)
+                    frame[
+                        cy,
+                        cx,
+                    ] = [opcode.r, opcode.g, opcode.b]
+                    pixels.push(frame[cy, cx])
+                    pixel_read += 1
+                    opcodes_read["rgb"] += 1
+                elif DiffOpcode.is_next(stream):
+                    opcode = DiffOpcode.read(stream)
+                    frame[cy, cx] = frame[
+                        (pixel_read - 1) // width,
+                        (pixel_read - 1) % width,
+                    ] + np.array([opcode.dr, opcode.dg, opcode.db])
+                    pixels.push(frame[cy, cx])
+                    pixel_read += 1
+                    opcodes_read["diff"] += 1
+                elif RunOpcode.is_next(stream):
+                    opcode = RunOpcode.read(stream)
+                    last_pixel = frame[
+                        (pixel_read - 1) // width,
+                        (pixel_read - 1) % width,
+                    ]
+                    frame.reshape(-1, self.header.channels, copy=False)[
+                        pixel_read : pixel_read + opcode.run
+                    ] = last_pixel
+                    pixel_read += opcode.run
+                    opcodes_read["run"] += 1
+                elif IndexOpcode.is_next(stream):
+                    index_opcode = IndexOpcode.read(stream)
+                    frame[cy, cx] = pixels[index_opcode.index]
+                    pixel_read += 1
+                    opcodes_read["index"] += 1
+                elif has_above and AboveRunOpcode.is_next(stream):
+                    opcode = AboveRunOpcode.read(stream)
+                    if opcode.run > width or pixel_read < width:
+                        raise ValueError("AboveRunOpcode references undecoded pixels.")
+                    frame_flat[pixel_read : pixel_read + opcode.run] = frame_flat[
+                        pixel_read - width : pixel_read - width + opcode.run
+                    ]
+                    pixel_read += opcode.run
+                    opcodes_read["above_run"] += 1
+                elif has_above and AboveDiffOpcode.is_next(stream):
+                    opcode = AboveDiffOpcode.read(stream)
+                    if pixel_read < width:
+                        raise ValueError("AboveDiffOpcode in the first row.")
+                    frame_flat[pixel_read] = frame_flat[pixel_read - width] + np.array(
+                        [
+                            opcode.diff + opcode.dr,
+                            opcode.diff + opcode.dg,
+                            opcode.diff + opcode.db,
+                        ][:channels]
+                    )
+                    pixels.push(frame_flat[pixel_read])
+                    pixel_read += 1
+                    opcodes_read["above_diff"] += 1
+                elif DiffFrameOpcode.is_next(stream):
+                    if reference is None:
+                        raise ValueError(
+                            "Unexpected DiffFrameOpcode without key frame."
                         )
+                    if frame_type == FrameType.Key:
+                        raise ValueError("Unexpected DiffFrameOpcode in key frame.")
 
-                        frame[cy, cx] = pixel
-                        pixels.push(pixel)
+                    diff_frame_opcode = DiffFrameOpcode.read(stream)
+                    if diff_frame_opcode.key_frame:
+                        if diff_frame_opcode.use_index:
+                            pixel = self.key_pixels[diff_frame_opcode.index] + np.array(
+                                [
+                                    diff_frame_opcode.dr,
+                                    diff_frame_opcode.dg,
+                                    diff_frame_opcode.db,
+                                ][:channels]
+                            )
+
+                            frame[cy, cx] = pixel
+                            pixels.push(pixel)
+                        else:
+                            pixel = reference[pixel_read] + np.array(
+                                [
+                                    diff_frame_opcode.diff + diff_frame_opcode.dr,
+                                    diff_frame_opcode.diff + diff_frame_opcode.dg,
+                                    diff_frame_opcode.diff + diff_frame_opcode.db,
+                                ][:channels]
+                            )
+
+                            frame[cy, cx] = pixel
+                            pixels.push(pixel)
                     else:
-                        pixel = self.key_frame_flat[pixel_read] + np.array(
-                            [
-                                diff_frame_opcode.diff + diff_frame_opcode.dr,
-                                diff_frame_opcode.diff + diff_frame_opcode.dg,
-                                diff_frame_opcode.diff + diff_frame_opcode.db,
-                            ]
-                        )
+                        raise ValueError("Invalid DiffFrame opcode.")
+                    pixel_read += 1
+                    opcodes_read["diff_frame"] += 1
+                elif FrameRunOpcode.is_next(stream) and reference is not None:
+                    opcode = FrameRunOpcode.read(stream)
+                    if not opcode.is_keyframe:
+                        raise ValueError("Invalid FrameRun opcode.")
 
-                        frame[cy, cx] = pixel
-                        pixels.push(pixel)
+                    frame.reshape(-1, self.header.channels, copy=False)[
+                        pixel_read : pixel_read + opcode.run
+                    ] = reference[pixel_read : pixel_read + opcode.run]
+                    pixel_read += opcode.run
+                    opcodes_read["frame_run"] += 1
                 else:
-                    raise NotImplementedError()
-                pixel_read += 1
-                opcodes_read["diff_frame"] += 1
-            elif FrameRunOpcode.is_next(self.file) and self.key_frame_flat is not None:
-                opcode = FrameRunOpcode.read(self.file)
-                if not opcode.is_keyframe:
-                    raise NotImplementedError()
-
-                frame.reshape(-1, 3, copy=False)[
-                    pixel_read : pixel_read + opcode.run
-                ] = self.key_frame_flat[pixel_read : pixel_read + opcode.run]
-                pixel_read += opcode.run
-                opcodes_read["frame_run"] += 1
-            else:
-                raise ValueError("Unexpected opcode in key frame.")
-
-        if frame_header.frame_type == FrameType.Key:
-            self.key_pixels = pixels
-            self.key_frame_flat = frame.reshape(-1, 3)
+                    raise ValueError("Unexpected opcode in key frame.")
+            if pixel_read > pixel_count:
+                raise ValueError("Run past the end of the frame.")
+        except (IndexError, ValueError) as error:
+            raise ValueError(
+                f"{error} (opcode at offset {position}, pixel {pixel_read})"
+            ) from error
+        yield height
 
-        return frame, opcodes_read
+    def decode_pixels_fast(
+        self,
+        stream: BufferedIOBase | BytesIO,
+        frame_type: FrameType,
+        frame: NDArray[np.uint8],
+        pixels: PixelHashMap,
+        opcodes_read: Dict[str, int],
+        reference: Optional[NDArray[np.uint8]],
+    ) -> Iterator[int]:
+        """Decode the opcodes of a frame like decode_pixels, validating once per frame.
+
+        Opcodes are classified by their leading byte, as scan does, and
+        decoded straight from the bytes of the frame into a byte view of it.
+        The only checks are those keeping runs within the frame and the row
+        above, and that the opcodes decode exactly the pixels of the frame.
+        """
+        height, width = frame.shape[:2]
+        channels = self.header.channels
+        pixel_count = width * height
+        has_above = self.header.version >= 1
+        gray = self.header.grayscale
+        # No opcode takes more than 4 bytes for a pixel, so a row of opcodes
+        # takes at most lookahead bytes.
+        lookahead = width * 4
+        if isinstance(stream, BytesIO):
+            # Sized frames are already in memory, so are decoded in place.
+            data = stream.getvalue()
+            offset, position = 0, stream.tell()
+            ended = True
+        else:
+            # Data is offset bytes into the stream, and refilled a row ahead.
+            offset, position = stream.tell(), 0
+            data = stream.read(max(lookahead, READ_CHUNK))
+            ended = not data
+        # Viewed flat, as frames without pixels can not be cast.
+        out = frame.reshape(-1).data
+        black = bytes(channels)
+        table = [bytes(pixel) for pixel in pixels.pixels.tolist()]
+        size = pixels.size
+
+        def qoi_index_of(r: int, g: int, b: int) -> int:
+            """Hash a colour as PixelHashMap.index_of does, without its checks."""
+            return (r * 3 + g * 5 + b * 7) % size
+
+        index_of = (
+            qoi_index_of
+            if pixels.hash_function == HashFunction.qoi
+            else pixels.index_of
+        )
+        # Frames can run from the reference, but only predicted frames can
+        # difference it, so DiffFrame opcodes in key frames fail to index it.
+        ref = b"" if reference is None else reference.tobytes()
+        if frame_type == FrameType.Key or reference is None:
+            diff_ref = b""
+            key_table: List[bytes] = []
+        else:
+            diff_ref = ref
+            key_table = [bytes(pixel) for pixel in self.key_pixels.pixels.tolist()]
+        counts = [0] * len(OPCODE_NAMES)
+
+        def count() -> None:
+            """Add the opcodes counted since the last row to opcodes_read."""
+            for name, number in zip(OPCODE_NAMES, counts):
+                if number:
+                    opcodes_read[name] += number
+            counts[:] = [0] * len(OPCODE_NAMES)
+
+        pixel_read = 0
+        row_end = width
+        try:
+            while pixel_read < pixel_count:
+                if pixel_read >= row_end:
+                    count()
+                    yield pixel_read // width
+                    row_end = (pixel_read // width + 1) * width
+                    if not ended and len(data) - position < lookahead:
+                        more = stream.read(max(lookahead, READ_CHUNK))
+                        ended = not more
+                        offset += position
+                        data = data[position:] + more
+                        position = 0
+                o = pixel_read * channels
+                code = data[position]
+                if code < 0x40:
+                    out[o : o + channels] = table[code]
+                    counts[INDEX] += 1
+                    position += 1
+                    pixel_read += 1
+                elif code < 0x80:
+                    if gray:
+                        v = ((out[o - 1] if o else 0) + (code & 0x3F) - 32) & 0xFF
+                        out[o] = v
+                        table[index_of(v, v, v)] = bytes((v,))
+                        counts[GRAY_DIFF] += 1
+                    else:
+                        r, g, b = out[o - 3 : o] if o else black
+                        r = (r + ((code >> 4) & 0x03) - 2) & 0xFF
+                        g = (g + ((code >> 2) & 0x03) - 2) & 0xFF
+                        b = (b + (code & 0x03) - 2) & 0xFF
+                        pixel = bytes((r, g, b))
+                        out[o : o + 3] = pixel
+                        table[index_of(r, g, b)] = pixel
+                        counts[DIFF] += 1
+                    position += 1
+                    pixel_read += 1
+                elif code < 0xC0:
+                    second = data[position + 1]
+                    diff = (code & 0x3F) - 32
+                    dr = ((second >> 4) & 0x03) - 2
+                    dg = ((second >> 2) & 0x03) - 2
+                    db = (second & 0x03) - 2
+                    if has_above and not second & 0xC0:
+                        if pixel_read < width:
+                            raise ValueError("AboveDiff opcode in the first row.")
+                        base = out[
+                            o - width * channels : o - width * channels + channels
+                        ]
+                        counts[ABOVE_DIFF] += 1
+                    elif not second & 0x80:
+                        raise ValueError("Invalid DiffFrame opcode.")
+                    elif second & 0x40:
+                        base = key_table[code & 0x3F]
+                        diff = 0
+                        counts[DIFF_FRAME] += 1
+                    else:
+                        base = diff_ref[o : o + channels]
+                        counts[DIFF_FRAME] += 1
+                    if gray:
+                        v = (base[0] + diff + dr) & 0xFF
+                        out[o] = v
+                        table[index_of(v, v, v)] = bytes((v,))
+                    else:
+                        r = (base[0] + diff + dr) & 0xFF
+                        g = (base[1] + diff + dg) & 0xFF
+                        b = (base[2] + diff + db) & 0xFF
+                        pixel = bytes((r, g, b))
+                        out[o : o + 3] = pixel
+                        table[index_of(r, g, b)] = pixel
+                    position += 2
+                    pixel_read += 1
+                elif code < 0xFE:
+                    run = (code & 0x3F) + 1
+                    last = out[o - channels : o] if o else black
+                    out[o : o + run * channels] = bytes(last) * run
+                    counts[RUN] += 1
+                    position += 1
+                    pixel_read += run
+                elif code == 0xFE:
+                    if gray:
+                        v = data[position + 1]
+                        out[o] = v
+                        table[index_of(v, v, v)] = bytes((v,))
+                        counts[GRAY] += 1
+                        position += 2
+                    else:
+                        r, g, b = pixel = data[position + 1 : position + 4]
+                        out[o : o + 3] = pixel
+                        table[index_of(r, g, b)] = pixel
+                        counts[RGB] += 1
+                        position += 4
+                    pixel_read += 1
+                else:
+                    second = data[position + 1]
+                    run = (second & 0x7F) + 1
+                    end = o + run * channels
+                    if second & 0x80:
+                        out[o:end] = ref[o:end]
+                        counts[FRAME_RUN] += 1
+                    elif has_above:
+                        if run > width or pixel_read < width:
+                            raise ValueError(
+                                "AboveRun opcode references undecoded pixels."
+                            )
+                        above = o - width * channels
+                        out[o:end] = out[above : above + run * channels]
+                        counts[ABOVE_RUN] += 1
+                    else:
+                        raise ValueError("Invalid FrameRun opcode.")
+                    position += 2
+                    pixel_read += run
+        except (IndexError, ValueError) as error:
+            # Reading past the end of the frame or a reference it does not
+            # have, or a run past the end of the frame.
+            raise ValueError(f"Corrupt frame: {error}") from error
+        finally:
+            pixels.pixels[:] = np.frombuffer(b"".join(table), np.uint8).reshape(
+                size, channels
+            )
+            count()
+        if pixel_read != pixel_count:
+            raise ValueError("Opcodes do not decode the pixels of the frame.")
+        stream.seek(offset + position)
+        yield height
@@ -1,19 +1,42 @@
-from .types import ColourSpace, QovHeader, PixelHashMap, QovFrameHeader, FrameType
+from .types import (
+    ColourSpace,
+    Compression,
+    QovHeader,
+    PixelHashMap,
+    QovFrameHeader,
+    FrameType,
+    FORMAT_VERSION,
+    HashFunction,
+)
 from .opcodes import (
     Opcode,
+    AboveDiffOpcode,
+    AboveRunOpcode,
     RgbOpcode,
     IndexOpcode,
     DiffOpcode,
     RunOpcode,
     DiffFrameOpcode,
     FrameRunOpcode,
+    GrayDiffOpcode,
+    GrayOpcode,
 )
-from typing import Optional
+from .colour import conversion_table
+from .layout import PixelLayout
+from .entropy import compress, is_available
+from .metrics import FrameMetrics, Metrics
+from .motion import estimate_motion, shift_frame
+from .tiles import gather_tiles, pack_bitmap, pad_to_tiles, tile_view
+from typing import Optional, Union, overload
 import numpy as np
 from numpy.typing import NDArray
 from dataclasses import dataclass
-from typing import List
-from io import BufferedIOBase
+from enum import Enum
+from collections.abc import Buffer
+from typing import List, Tuple
+from io import BufferedIOBase, BytesIO
+import struct
+from time import perf_counter
 
 
 @dataclass
@@ -22,16 +45,147 @@ class EncodedFrame:
 
     header: QovFrameHeader
     opcodes: List[Opcode]
+    # Data written before the opcodes, such as the bitmap of a tiled frame.
+    prefix: bytes = b""
 
     def __len__(self):
         """Report the size of the frame in bytes."""
-        return sum([len(opcode) for opcode in self.opcodes])
+        return len(self.prefix) + sum([len(opcode) for opcode in self.opcodes])
 
-    def write(self, file: BufferedIOBase) -> None:
-        """Convert and write the frame to the provided file handle."""
+    def write(
+        self,
+        file: BufferedIOBase,
+        compression: Compression = Compression.none,
+        level: Optional[int] = None,
+        sized: bool = False,
+    ) -> None:
+        """Convert and write the frame to the provided file handle.
+
+        With compression or sized, the opcodes are written as a size prefixed
+        block. Proxy frames are always size prefixed.
+        """
         self.header.write(file)
+        sized = sized or self.header.frame_type == FrameType.Proxy
+        if compression == Compression.none and not sized:
+            file.write(self.prefix)
+            for opcode in self.opcodes:
+                opcode.write(file)
+            return
+
+        opcodes = BytesIO()
+        opcodes.write(self.prefix)
         for opcode in self.opcodes:
-            opcode.write(file)
+            opcode.write(opcodes)
+        block = compress(opcodes.getvalue(), compression, level)
+        file.write(struct.pack("<I", len(block)))
+        file.write(block)
+
+
+@dataclass(frozen=True)
+class SearchOptions:
+    """Which of the more costly searches the encoder runs for each pixel."""
+
+    # Look up pixels in the keyframe's hash map.
+    key_pixels: bool = True
+    # Look for a keyframe hash map entry within a small difference on a miss.
+    near_key_pixels: bool = False
+    # Encode pixels as a small difference from the keyframe.
+    key_frame_diff: bool = True
+    # Encode pixels as a small difference from the pixel above.
+    above_diff: bool = True
+    # Allow keyframe differences to be offset by a common difference.
+    offset_diffs: bool = False
+    # The motion search range used when the encoder is not given one.
+    motion_search_range: int = 0
+    # Also encode motion frames without the motion vector, keeping the smaller.
+    verify_motion: bool = False
+
+
+class EncoderPreset(str, Enum):
+    """Trade off encoding speed against the size of the output."""
+
+    fast = "fast"
+    balanced = "balanced"
+    small = "small"
+
+    @property
+    def search(self) -> SearchOptions:
+        """The searches run by this preset."""
+        match self:
+            case EncoderPreset.fast:
+                return SearchOptions(
+                    key_pixels=False, key_frame_diff=False, above_diff=False
+                )
+            case EncoderPreset.balanced:
+                return SearchOptions()
+            case EncoderPreset.small:
+                return SearchOptions(
+                    near_key_pixels=True,
+                    offset_diffs=True,
+                    motion_search_range=16,
+                    verify_motion=True,
+                )
+
+
+class FramePool:
+    """A fixed number of reusable frame buffers, to avoid allocating each frame."""
+
+    def __init__(self, shape: Tuple[int, ...], size: int):
+        """Allocate the pool's buffers up front."""
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(size)]
+        self.free = list(self.buffers)
+
+    def acquire(self) -> NDArray[np.uint8]:
+        """Take a writable buffer from the pool."""
+        if not self.free:
+            raise RuntimeError("All frame buffers are in use")
+        return self.free.pop()
+
+    def owns(self, buffer: NDArray[np.uint8]) -> bool:
+        """Check the buffer belongs to the pool."""
+        return any(buffer is b for b in self.buffers)
+
+    def release(self, buffer: NDArray[np.uint8]) -> None:
+        """Return a buffer to the pool."""
+        if not self.owns(buffer):
+            raise ValueError("Buffer does not belong to this pool")
+        if not any(buffer is b for b in self.free):
+            self.free.append(buffer)
+
+
+def downscale(frame: NDArray[np.uint8], scale: int) -> NDArray[np.uint8]:
+    """Shrink a frame by averaging blocks of scale by scale pixels.
+
+    Pixels past the last whole block are dropped.
+    """
+    height, width = frame.shape[0] // scale, frame.shape[1] // scale
+    blocks = frame[: height * scale, : width * scale].reshape(
+        height, scale, width, scale, frame.shape[2]
+    )
+    return np.round(blocks.mean(axis=(1, 3))).astype(np.uint8)
+
+
+class KeyframeReason(Enum):
+    """Enum to differentiate why the encoder placed a keyframe."""
+
+    # The first frame of the stream.
+    First = "first"
+    # Requested through Encoder.trigger_keyframe.
+    Forced = "forced"
+    # The keyframe interval was reached, or no interval was set.
+    Interval = "interval"
+    # The frame differed too much from the current keyframe.
+    SceneChange = "scene_change"
+
+
+@dataclass
+class KeyframeDecision:
+    """Records where and why the encoder placed a keyframe."""
+
+    frame: int
+    reason: KeyframeReason
+    # The sampled ratio of changed pixels, when scene detection was run.
+    changed_ratio: Optional[float] = None
 
 
 class Encoder:
@@ -44,20 +198,153 @@ class Encoder:
         height: int,
         colourspace: ColourSpace,
         keyframe_interval: Optional[int] = None,
+        motion_search_range: Optional[int] = None,
+        version: int = FORMAT_VERSION,
+        scene_change_threshold: Optional[float] = None,
+        min_keyframe_interval: int = 1,
+        preset: EncoderPreset = EncoderPreset.balanced,
+        tolerance: int | Tuple[int, int, int] = 0,
+        compression: Compression = Compression.none,
+        compression_level: Optional[int] = None,
+        buffer_pool_size: int = 2,
+        metrics: Optional[Metrics] = None,
+        hash_function: HashFunction = HashFunction.qoi,
+        hash_size: int = 64,
+        proxy_scale: Optional[int] = None,
+        proxy_interval: Optional[int] = None,
+        tile_size: Optional[int] = None,
+        grayscale: bool = False,
+        input_colourspace: Optional[ColourSpace] = None,
     ):
-        """Construct a new encoder."""
-        self.header = QovHeader(width=width, height=height, colourspace=colourspace)
+        """Construct a new encoder.
+
+        The preset picks which searches are run for each pixel, trading speed
+        against size. If motion_search_range is non-zero, predicted frames are searched for a
+        global motion vector of up to that many pixels in each direction.
+        Opcodes introduced after the requested format version are not used.
+
+        If scene_change_threshold is set, a keyframe is placed early when the
+        sampled ratio of pixels that differ from the keyframe exceeds it, as
+        long as the group of pictures is at least min_keyframe_interval frames
+        long. keyframe_interval still bounds the group of pictures length.
+
+        A non-zero tolerance enables near-lossless encoding, where runs and
+        frame runs extend over pixels that differ by up to that much per
+        channel. Predictions are made from the reconstructed pixels, so the
+        error of any decoded pixel never exceeds the tolerance.
+
+        With compression, each frame's opcodes are compressed separately, so
+        frames can still be streamed and located without decompressing them.
+
+        Frames can be written directly into buffers from acquire_buffer, which
+        are returned to the pool once pushed. The encoder keeps its own copy of
+        the keyframe, so callers are free to reuse any frame once pushed.
+
+        Timings, opcode and hash map statistics are collected into metrics if
+        provided. Hash map lookups include every encoding tried for a frame.
+
+        The hash function and size of the colour hash map can be changed from
+        format version 2, see pyqoiv.hashing.select_hash to pick them.
+
+        If proxy_scale is set, a proxy frame downscaled by that factor is
+        written before every keyframe, or every proxy_interval frames if set.
+        Proxies need format version 3, and make every frame size prefixed so
+        a decoder can skip between them.
+
+        If tile_size is set, predicted frames without motion are coded as
+        tiled frames, which only code the tiles of that size that changed from
+        the keyframe. Tiled frames need format version 4.
+
+        Grayscale encoders take frames shaped (height, width, 1), and need
+        format version 5.
+
+        Frames are stored in colourspace. If input_colourspace differs, pushed
+        frames are converted with a lookup table, in place for buffers from
+        acquire_buffer.
+        """
+        if not is_available(compression):
+            raise ValueError(f"{compression.name} compression is not available")
+        if proxy_scale is not None:
+            if version < 3:
+                raise ValueError("Proxy frames need format version 3")
+            if not 1 <= proxy_scale <= min(width, height):
+                raise ValueError("Proxy scale must be between 1 and the frame size")
+        if proxy_interval is not None and proxy_interval < 1:
+            raise ValueError("Proxy interval must be at least 1")
+        if tile_size is not None:
+            if version < 4:
+                raise ValueError("Tiled frames need format version 4")
+            if not 1 <= tile_size <= 255:
+                raise ValueError("Tile size must be between 1 and 255")
+        if grayscale and version < 5:
+            raise ValueError("Grayscale needs format version 5")
+        self.header = QovHeader(
+            width=width,
+            height=height,
+            colourspace=colourspace,
+            version=version,
+            compression=compression,
+            sized_frames=proxy_scale is not None,
+            grayscale=grayscale,
+            hash_function=hash_function,
+            hash_size=hash_size,
+        )
+        self.input_table = conversion_table(
+            colourspace if input_colourspace is None else input_colourspace,
+            colourspace,
+        )
+        self.proxy_scale = proxy_scale
+        self.proxy_interval = proxy_interval
+        self.tile_size = tile_size
+        self.compression_level = compression_level
         self.file = file
         self.keyframe_interval = keyframe_interval
-        self.last_keyframe: Optional[NDArray[np.uint8]] = None
+        self.preset = preset
+        self.search = preset.search
+        self.motion_search_range = (
+            self.search.motion_search_range
+            if motion_search_range is None
+            else motion_search_range
+        )
+        self.tolerance: Optional[NDArray[np.int16]] = (
+            np.broadcast_to(
+                np.array(tolerance, dtype=np.int16), (self.header.channels,)
+            )
+            if np.any(np.array(tolerance) > 0)
+            else None
+        )
+        self.scene_change_threshold = scene_change_threshold
+        self.min_keyframe_interval = min_keyframe_interval
+        self.keyframe_decisions: List[KeyframeDecision] = []
+        channels = self.header.channels
+        self.pool = FramePool((height, width, channels), buffer_pool_size)
+        # The encoder owns the keyframe reference, and a scratch buffer used to
+        # reconstruct predicted frames when encoding with a tolerance.
+        self.key_frame: NDArray[np.uint8] = np.empty(
+            (height, width, channels), np.uint8
+        )
+        self.key_frame_flat = self.key_frame.reshape(-1, channels)
+        self.scratch: Optional[NDArray[np.uint8]] = None
         self.frames_since_last_keyframe: int = -1
         self.total_frames = 0
+        self.metrics = metrics
+        self.frame_metrics: Optional[FrameMetrics] = None
+        # The frame being pushed a block of rows at a time, see begin_frame.
+        self.row_frame: Optional[EncodedFrame] = None
+        self.row_pixels: Optional[PixelHashMap] = None
+        self.rows_pushed = 0
         self.header.write(file)
-        self.pixels = PixelHashMap()
+        self.pixels = self.new_pixel_map()
 
     def __repr__(self) -> str:
         """String representation of the encoder."""
-        return f"Encoder(width={self.header.width}, height={self.header.height}, colourspace={self.header.colourspace}, keyframe_interval={self.keyframe_interval}, total_frames={self.total_frames})"
+        return f"Encoder(width={self.header.width}, height={self.header.height}, colourspace={self.header.colourspace}, keyframe_interval={self.keyframe_interval}, preset={self.preset.value}, total_frames={self.total_frames})"
+
+    def new_pixel_map(self) -> PixelHashMap:
+        """Create an empty colour hash map, hashed as the header specifies."""
+        return PixelHashMap(
+            self.header.hash_size, self.header.hash_function, self.header.channels
+        )
 
     def trigger_keyframe(self) -> None:
         """Ensure that the next frame is a keyframe."""
@@ -65,24 +352,93 @@ class Encoder:
 
     @property
     def is_next_frame_keyframe(self) -> bool:
-        """Determine if the next frame is a keyframe."""
+        """Determine if the next frame is a keyframe, without scene detection."""
+        return self.next_keyframe_decision() is not None
+
+    def next_keyframe_decision(
+        self, frame: Optional[NDArray[np.uint8]] = None
+    ) -> Optional[KeyframeDecision]:
+        """Determine if the next frame is a keyframe, and why.
+
+        Scene detection is only run if the frame is provided.
+        """
+        changed_ratio = None
         if self.frames_since_last_keyframe == -1:
-            self.frames_since_last_keyframe = 0
-            return True
+            reason = (
+                KeyframeReason.First
+                if self.total_frames == 0
+                else KeyframeReason.Forced
+            )
+        elif self.keyframe_interval is None:
+            reason = KeyframeReason.Interval
+        elif self.frames_since_last_keyframe >= self.keyframe_interval:
+            reason = KeyframeReason.Interval
+        elif (
+            frame is not None
+            and self.scene_change_threshold is not None
+            and self.frames_since_last_keyframe + 1 >= self.min_keyframe_interval
+        ):
+            changed_ratio = Encoder.changed_ratio(frame, self.key_frame)
+            if changed_ratio <= self.scene_change_threshold:
+                return None
+            reason = KeyframeReason.SceneChange
+        else:
+            return None
 
-        if self.keyframe_interval is None:
-            return True
+        self.frames_since_last_keyframe = 0
+        return KeyframeDecision(self.total_frames, reason, changed_ratio)
+
+    @staticmethod
+    def changed_ratio(
+        frame: NDArray[np.uint8], key_frame: NDArray[np.uint8], stride: int = 4
+    ) -> float:
+        """Estimate the ratio of pixels that differ between two frames.
+
+        Only every stride'th pixel of every stride'th row is compared.
+        """
+        return float(
+            np.mean(
+                np.any(frame[::stride, ::stride] != key_frame[::stride, ::stride], -1)
+            )
+        )
 
-        if self.frames_since_last_keyframe >= self.keyframe_interval:
-            self.frames_since_last_keyframe = 0
-            return True
+    def is_proxy_due(self, keyframe: bool) -> bool:
+        """Check if a proxy should precede the next frame."""
+        if self.proxy_scale is None:
+            return False
+        if self.proxy_interval is None:
+            return keyframe
+        return self.total_frames % self.proxy_interval == 0
+
+    def encode_proxy(self, frame: NDArray[np.uint8]) -> EncodedFrame:
+        """Encode a downscaled copy of a frame as a proxy frame."""
+        assert self.proxy_scale is not None
+        proxy = downscale(frame, self.proxy_scale)
+        # Proxies are not part of the video, so are left out of the metrics.
+        metrics, self.frame_metrics = self.frame_metrics, None
+        try:
+            encoded = self._encode_frame(proxy, self.new_pixel_map(), None, None)
+        finally:
+            self.frame_metrics = metrics
+        encoded.header = QovFrameHeader(
+            frame_type=FrameType.Proxy, width=proxy.shape[1], height=proxy.shape[0]
+        )
+        return encoded
 
-        return False
+    def write(self, encoded: EncodedFrame, file: BufferedIOBase) -> None:
+        """Write an encoded frame as laid out by the header."""
+        encoded.write(
+            file, self.header.compression, self.compression_level, self.header.sized
+        )
 
     def encode_keyframe(
         self, frame: NDArray[np.uint8], pixels: PixelHashMap
     ) -> EncodedFrame:
-        """Encode a frame as a keyframe."""
+        """Encode a frame as a keyframe.
+
+        If the encoder has a tolerance, the frame is updated in place to the
+        pixels a decoder will reconstruct.
+        """
         return self._encode_frame(frame, pixels, None, None)
 
     @staticmethod
@@ -98,6 +454,13 @@ class Encoder:
                 return i
         return len(pixels) - 1
 
+    @staticmethod
+    def run_lengths(equal: NDArray[np.bool_]) -> NDArray[np.intp]:
+        """Count the consecutive True values starting at every position."""
+        positions = np.arange(len(equal))
+        ends = np.append(np.flatnonzero(~equal), len(equal))
+        return ends[np.searchsorted(ends, positions)] - positions
+
     def _encode_frame(
         self,
         frame: NDArray[np.uint8],
@@ -107,87 +470,201 @@ class Encoder:
     ) -> EncodedFrame:
         """Encode a single frame."""
         opcodes: List[Opcode] = []
+        search = self.search
+        metrics = self.frame_metrics
+        start = perf_counter() if metrics is not None else 0.0
 
         last_pixel: Optional[NDArray[np.uint8]] = None
-        last_pixel_count: int = 0
         is_kf_flat = key_frame_flat is not None
-        is_kf_pixels = key_pixels is not None
-        frame_flat = frame.reshape(-1, 3, copy=False)
+        is_kf_pixels = key_pixels is not None and search.key_pixels
+        frame_flat = frame.reshape(-1, frame.shape[2], copy=False)
+        gray = frame_flat.shape[1] == 1
         pixel_pos = 0
         pixel_len = len(frame_flat)
+
+        # Runs are found for the whole frame up front, so each pixel only needs
+        # a table lookup rather than a comparison of the pixels that follow it.
+        # Within a tolerance, runs of the previous pixel and the row above
+        # depend on the reconstructed pixels, so those are compared as we go.
+        tolerance = self.tolerance
+        runs = Encoder.run_lengths(np.all(frame_flat[1:] == frame_flat[:-1], axis=1))
+        key_runs = (
+            Encoder.run_lengths(self.matches(frame_flat, key_frame_flat))
+            if key_frame_flat is not None
+            else np.zeros(0, dtype=np.intp)
+        )
+
+        # Runs matching the row above are limited to a row, so the decoder only
+        # ever copies decoded pixels.
+        width = frame.shape[1]
+        use_above = self.header.version >= 1 and pixel_len > width
+        above_runs = (
+            Encoder.run_lengths(
+                np.all(frame_flat[width:] == frame_flat[:-width], axis=1)
+            )
+            if use_above and tolerance is None
+            else np.zeros(0, dtype=np.intp)
+        )
+        max_above_run = min(128, width)
+        if metrics is not None:
+            start = metrics.time("compare", start)
+
         while pixel_pos < pixel_len:
             pixel = frame_flat[pixel_pos]
             if last_pixel is not None:
                 # Handle runs
-                count = Encoder.pixels_equal(frame_flat[pixel_pos - 1 : pixel_pos + 62])
+                if tolerance is None:
+                    count = min(int(runs[pixel_pos - 1]), 62)
+                else:
+                    count = Encoder.leading_true(
+                        self.matches(frame_flat[pixel_pos : pixel_pos + 62], last_pixel)
+                    )
+                    frame_flat[pixel_pos : pixel_pos + count] = last_pixel
                 if count > 0:
                     opcodes.append(RunOpcode(run=count))
                     pixel_pos += count
                     continue
 
-                dr, dg, db = pixel - last_pixel
+            key_count = min(int(key_runs[pixel_pos]), 128) if is_kf_flat else 0
+
+            is_above = use_above and pixel_pos >= width
+            if is_above:
+                if tolerance is None:
+                    count = min(int(above_runs[pixel_pos - width]), max_above_run)
+                else:
+                    limit = min(max_above_run, pixel_len - pixel_pos)
+                    count = Encoder.leading_true(
+                        self.matches(
+                            frame_flat[pixel_pos : pixel_pos + limit],
+                            frame_flat[pixel_pos - width : pixel_pos - width + limit],
+                        )
+                    )
+                if count > 1 and count > key_count:
+                    opcodes.append(AboveRunOpcode(run=count))
+                    if tolerance is not None:
+                        frame_flat[pixel_pos : pixel_pos + count] = frame_flat[
+                            pixel_pos - width : pixel_pos - width + count
+                        ]
+                    pixel_pos += count
+                    last_pixel = frame_flat[pixel_pos - 1]
+                    continue
+
+            if last_pixel is not None and gray:
+                d = int(pixel[0]) - int(last_pixel[0])
+                if -32 <= d < 32:
+                    opcodes.append(GrayDiffOpcode(d))
+                    pixels.push(pixel)
+                    last_pixel = pixel
+                    pixel_pos += 1
+                    continue
+            elif last_pixel is not None:
+                dr, dg, db = pixel.astype(np.int16) - last_pixel
                 if -2 <= dr < 2 and -2 <= dg < 2 and -2 <= db < 2:
-                    opcodes.append(DiffOpcode(dr, dg, db))
+                    opcodes.append(DiffOpcode(int(dr), int(dg), int(db)))
                     pixels.push(pixel)
                     last_pixel = pixel
                     pixel_pos += 1
                     continue
 
-            if pixel in pixels:
-                opcodes.append(
-                    IndexOpcode(index=pixels.index_of(pixel[0], pixel[1], pixel[2]))
-                )
+            found = pixel in pixels
+            if metrics is not None:
+                metrics.count_lookup(pixels, pixel, found)
+            if found:
+                opcodes.append(IndexOpcode(index=pixels.index_of_pixel(pixel)))
                 pixels.push(pixel)
                 last_pixel = pixel
                 pixel_pos += 1
                 continue
 
-            if is_kf_flat:
-                count = Encoder.get_pixels_equal(
-                    frame_flat[pixel_pos : pixel_pos + 128],
-                    key_frame_flat[pixel_pos : pixel_pos + 128],
-                )
-                match count:
-                    case 0:
-                        dr, dg, db = pixel - key_frame_flat[pixel_pos]
-                        if -2 <= dr < 2 and -2 <= dg < 2 and -2 <= db < 2:
-                            opcodes.append(
-                                DiffFrameOpcode(True, False, dr, dg, db, diff=0)
-                            )
-                            pixels.push(pixel)
-                            last_pixel = pixel
-                            pixel_pos += 1
-                            continue
-                    case 1:
-                        opcodes.append(DiffFrameOpcode(True, False, 0, 0, 0, diff=0))
+            if key_frame_flat is not None:
+                if key_count > 1:
+                    opcodes.append(FrameRunOpcode(is_keyframe=True, run=key_count))
+                    if tolerance is not None:
+                        frame_flat[pixel_pos : pixel_pos + key_count] = key_frame_flat[
+                            pixel_pos : pixel_pos + key_count
+                        ]
+                    pixel_pos += key_count
+                    last_pixel = frame_flat[pixel_pos - 1]
+                    continue
+                if key_count == 1:
+                    opcodes.append(DiffFrameOpcode(True, False, 0, 0, 0, diff=0))
+                    if tolerance is not None:
+                        pixel[:] = key_frame_flat[pixel_pos]
+                    pixels.push(pixel)
+                    last_pixel = pixel
+                    pixel_pos += 1
+                    continue
+                if search.key_frame_diff and gray:
+                    d = int(pixel[0]) - int(key_frame_flat[pixel_pos, 0])
+                    if -32 <= d < 32:
+                        opcodes.append(DiffFrameOpcode(True, False, 0, 0, 0, diff=d))
                         pixels.push(pixel)
                         last_pixel = pixel
                         pixel_pos += 1
                         continue
-                    case _:
-                        m = min(128, count)
-                        opcodes.append(FrameRunOpcode(is_keyframe=True, run=m))
-                        pixel_pos += m
-                        last_pixel = frame_flat[pixel_pos - 1]
+                elif search.key_frame_diff:
+                    d = pixel.astype(np.int16) - key_frame_flat[pixel_pos]
+                    diff = Encoder.common_diff(d) if search.offset_diffs else 0
+                    if diff is not None and np.all((-2 <= d - diff) & (d - diff < 2)):
+                        dr, dg, db = (int(c) for c in d - diff)
+                        opcodes.append(
+                            DiffFrameOpcode(True, False, dr, dg, db, diff=diff)
+                        )
+                        pixels.push(pixel)
+                        last_pixel = pixel
+                        pixel_pos += 1
                         continue
 
-            if is_kf_pixels and pixel in key_pixels:
-                key_index = key_pixels.index_of(pixel[0], pixel[1], pixel[2])
-                opcodes.append(DiffFrameOpcode(True, True, 0, 0, 0, index=key_index))
-                pixels.push(pixel)
-                last_pixel = pixel
-                pixel_pos += 1
-                continue
+            if is_above and search.above_diff and gray:
+                d = int(pixel[0]) - int(frame_flat[pixel_pos - width, 0])
+                if -32 <= d < 32:
+                    opcodes.append(AboveDiffOpcode(d, 0, 0, 0))
+                    pixels.push(pixel)
+                    last_pixel = pixel
+                    pixel_pos += 1
+                    continue
+            elif is_above and search.above_diff:
+                d = pixel.astype(np.int16) - frame_flat[pixel_pos - width]
+                diff = Encoder.common_diff(d)
+                if diff is not None:
+                    dr, dg, db = (int(c) for c in d - diff)
+                    opcodes.append(AboveDiffOpcode(diff, dr, dg, db))
+                    pixels.push(pixel)
+                    last_pixel = pixel
+                    pixel_pos += 1
+                    continue
+
+            if is_kf_pixels and key_pixels is not None:
+                key_index = None
+                dr = dg = db = 0
+                if pixel in key_pixels:
+                    key_index = key_pixels.index_of_pixel(pixel)
+                elif search.near_key_pixels and not gray:
+                    d = pixel.astype(np.int16) - key_pixels.pixels
+                    near = np.flatnonzero(np.all((-2 <= d) & (d < 2), axis=1))
+                    if len(near) > 0:
+                        key_index = int(near[0])
+                        dr, dg, db = (int(c) for c in d[key_index])
+                if key_index is not None:
+                    opcodes.append(
+                        DiffFrameOpcode(True, True, dr, dg, db, index=key_index)
+                    )
+                    pixels.push(pixel)
+                    last_pixel = pixel
+                    pixel_pos += 1
+                    continue
 
             # Fallback to RGB opcode
             pixels.push(pixel)
             last_pixel = pixel
             pixel_pos += 1
-            opcodes.append(RgbOpcode(r=pixel[0], g=pixel[1], b=pixel[2]))
-
-        if last_pixel_count > 0:
-            opcodes.append(RunOpcode(run=last_pixel_count))
+            if gray:
+                opcodes.append(GrayOpcode(value=pixel[0]))
+            else:
+                opcodes.append(RgbOpcode(r=pixel[0], g=pixel[1], b=pixel[2]))
 
+        if metrics is not None:
+            metrics.time("select", start)
         frame_type = FrameType.Key if key_pixels is None else FrameType.Predicted
         return EncodedFrame(
             header=QovFrameHeader(
@@ -196,6 +673,29 @@ class Encoder:
             opcodes=opcodes,
         )
 
+    def matches(self, a: NDArray[np.uint8], b: NDArray[np.uint8]) -> NDArray[np.bool_]:
+        """Check which pixels of a match b, within the tolerance if set."""
+        if self.tolerance is None:
+            return np.all(a == b, axis=-1)
+        return np.all(np.abs(a.astype(np.int16) - b) <= self.tolerance, axis=-1)
+
+    @staticmethod
+    def leading_true(values: NDArray[np.bool_]) -> int:
+        """Count the True values at the start of an array."""
+        return int(np.argmin(values)) if not np.all(values) else len(values)
+
+    @staticmethod
+    def common_diff(d: NDArray[np.int16]) -> Optional[int]:
+        """Find a difference applied to all channels leaving each within -2..1.
+
+        Returns None if the channel differences are too far apart, or the common
+        difference does not fit in -32..31.
+        """
+        low, high = int(d.min()), int(d.max())
+        if high - low > 3 or not (-31 <= high <= 32):
+            return None
+        return high - 1
+
     @staticmethod
     def get_pixels_equal(a: NDArray[np.uint8], b: NDArray[np.uint8]) -> int:
         """Return the number of pixels that are equal in two arrays."""
@@ -210,28 +710,298 @@ class Encoder:
         pixels: PixelHashMap,
         key_frame_flat: NDArray[np.uint8],
         key_pixels: PixelHashMap,
+        motion: Tuple[int, int] = (0, 0),
     ) -> EncodedFrame:
-        """Encode a predicted frame."""
-        return self._encode_frame(frame, pixels, key_frame_flat, key_pixels)
+        """Encode a predicted frame.
+
+        A non-zero motion vector means key_frame_flat has already been offset
+        by it, and the frame is marked as a Motion frame. If the encoder has a
+        tolerance, the frame is updated in place to the reconstructed pixels.
+        """
+        encoded = self._encode_frame(frame, pixels, key_frame_flat, key_pixels)
+        if motion != (0, 0):
+            encoded.header = QovFrameHeader(
+                frame_type=FrameType.Motion, dx=motion[0], dy=motion[1]
+            )
+        return encoded
 
-    def push(self, frame: NDArray[np.uint8]) -> None:
-        """Push a new frame into the encoder."""
+    def encode_tiled(
+        self,
+        frame: NDArray[np.uint8],
+        pixels: PixelHashMap,
+        key_frame: NDArray[np.uint8],
+        key_pixels: PixelHashMap,
+    ) -> EncodedFrame:
+        """Encode a predicted frame as a tiled frame.
+
+        Changed tiles are found with one comparison of the whole frame, and
+        only those are coded.
+        """
+        assert self.tile_size is not None
+        tile_size = self.tile_size
+        start = perf_counter()
+        padded = pad_to_tiles(frame, tile_size)
+        padded_key = pad_to_tiles(key_frame, tile_size)
+        changed = ~np.all(
+            self.matches(
+                tile_view(padded, tile_size), tile_view(padded_key, tile_size)
+            ),
+            axis=(2, 3),
+        )
+        tiles = gather_tiles(padded, changed, tile_size)
+        key_tiles = gather_tiles(padded_key, changed, tile_size)
+        if self.frame_metrics is not None:
+            self.frame_metrics.time("compare", start)
+        encoded = self._encode_frame(
+            tiles, pixels, key_tiles.reshape(-1, self.header.channels), key_pixels
+        )
+        encoded.header = QovFrameHeader(frame_type=FrameType.Tiled, tile_size=tile_size)
+        encoded.prefix = pack_bitmap(changed)
+        return encoded
 
-        if self.is_next_frame_keyframe:
-            self.pixels.clear()
-            encoded = self.encode_keyframe(frame, self.pixels)
-            self.key_frame_flat = frame.reshape(-1, 3)
-            encoded.write(self.file)
+    def acquire_buffer(self) -> NDArray[np.uint8]:
+        """Take a writable frame buffer to fill and then push.
 
+        The buffer is returned to the pool when it is pushed, or it can be
+        handed back unused with release_buffer.
+        """
+        return self.pool.acquire()
+
+    def release_buffer(self, buffer: NDArray[np.uint8]) -> None:
+        """Return an unused buffer from acquire_buffer to the pool."""
+        self.pool.release(buffer)
+
+    @staticmethod
+    def copy_into(
+        target: Optional[NDArray[np.uint8]], frame: NDArray[np.uint8]
+    ) -> NDArray[np.uint8]:
+        """Copy a frame into a buffer, only allocating if it does not fit."""
+        if target is None or target.shape != frame.shape or target.dtype != frame.dtype:
+            target = np.empty(frame.shape, dtype=frame.dtype)
+        np.copyto(target, frame)
+        return target
+
+    def ingest(
+        self, frame: NDArray[np.uint8], in_place: Optional[bool] = None
+    ) -> NDArray[np.uint8]:
+        """Convert a frame into the colourspace it is stored in.
+
+        Unless in_place says otherwise, only buffers from acquire_buffer are
+        converted in place, and other frames into a new array.
+        """
+        if self.input_table is None:
+            return frame
+        if in_place is None:
+            in_place = self.pool.owns(frame)
+        return np.take(self.input_table, frame, out=frame if in_place else None)
+
+    def gather(self, pixels: NDArray[np.uint8]) -> NDArray[np.uint8]:
+        """Copy a strided view of a frame into a buffer, converting its colourspace."""
+        if pixels.shape != self.key_frame.shape:
+            raise ValueError("Frame does not match the encoder dimensions.")
+        buffer = (
+            self.pool.acquire() if self.pool.free else np.empty_like(self.key_frame)
+        )
+        if self.input_table is None:
+            np.copyto(buffer, pixels)
         else:
-            encoded = self.encode_predicted(
-                frame, PixelHashMap(), self.key_frame_flat, self.pixels
-            )
-            encoded.write(self.file)
+            # The indices are bytes, so can not be out of range.
+            np.take(self.input_table, pixels, out=buffer, mode="clip")
+        return buffer
+
+    @overload
+    def push(self, frame: NDArray[np.uint8], layout: None = None) -> None:
+        """Push a new frame, as an array, into the encoder."""
+
+    @overload
+    def push(self, frame: Buffer, layout: PixelLayout) -> None:
+        """Push a new frame, in any buffer laid out as layout, into the encoder."""
+
+    def push(
+        self,
+        frame: Union[NDArray[np.uint8], Buffer],
+        layout: Optional[PixelLayout] = None,
+    ) -> None:
+        """Push a new frame into the encoder.
+
+        With a layout, frame can be any buffer holding the frame in it, such
+        as BGRA or padded rows. Such frames, and frames that are strided views,
+        are gathered into a buffer in the same pass as colourspace conversion.
+        """
+        if self.row_frame is not None:
+            raise ValueError("A frame is being pushed a block of rows at a time.")
+        if layout is not None:
+            if layout.pixel_format.channels != self.header.channels:
+                raise ValueError("Pixel format does not match the encoder channels.")
+            frame = layout.unpack(frame, self.header.width, self.header.height)
+        elif not isinstance(frame, np.ndarray):
+            raise TypeError("Frames that are not arrays need a layout.")
+        frame = self.ingest(frame) if frame.flags.c_contiguous else self.gather(frame)
+        try:
+            self._push(frame)
+        finally:
+            if self.pool.owns(frame):
+                self.pool.release(frame)
+
+    def _push(self, frame: NDArray[np.uint8]) -> None:
+        """Encode and write a frame."""
+        if self.metrics is not None:
+            self.frame_metrics = self.metrics.start_frame()
+        decision = self.next_keyframe_decision(frame)
+        if self.is_proxy_due(decision is not None):
+            self.write(self.encode_proxy(frame), self.file)
+        if decision is not None:
+            self.keyframe_decisions.append(decision)
+            encoded = self.encode_next_keyframe(frame)
+        else:
+            encoded = self.encode_next_predicted(frame)
             self.frames_since_last_keyframe += 1
+        if self.frame_metrics is None:
+            self.write(encoded, self.file)
+        else:
+            self.write_measured(encoded, self.frame_metrics)
+        self.total_frames += 1
 
+    def begin_frame(self) -> None:
+        """Start a frame that is pushed a block of rows at a time.
+
+        Rows are encoded as they are pushed, and without compression or sized
+        frames their opcodes are written straight away. Keyframes are placed
+        by the interval alone, as scene detection needs the whole frame, and
+        predicted frames never use motion or tiles. Proxies are not supported.
+        """
+        if self.row_frame is not None:
+            raise ValueError("A frame is already being pushed.")
+        if self.proxy_scale is not None:
+            raise ValueError("Proxy frames need whole frames.")
+        if self.metrics is not None:
+            self.frame_metrics = self.metrics.start_frame()
+        decision = self.next_keyframe_decision()
+        if decision is not None:
+            self.keyframe_decisions.append(decision)
+            self.pixels.clear()
+            self.row_pixels = self.pixels
+            frame_type = FrameType.Key
+        else:
+            self.frames_since_last_keyframe += 1
+            self.row_pixels = self.new_pixel_map()
+            frame_type = FrameType.Predicted
+        self.row_frame = EncodedFrame(QovFrameHeader(frame_type=frame_type), [])
+        self.rows_pushed = 0
+        if not self.header.sized:
+            self.row_frame.header.write(self.file)
+
+    def push_rows(self, rows: NDArray[np.uint8]) -> None:
+        """Encode the next rows of the frame, shaped (count, width, channels).
+
+        Runs and differences do not continue from one block to the next, so
+        larger blocks encode slightly smaller.
+        """
+        if self.row_frame is None or self.row_pixels is None:
+            raise ValueError("begin_frame must be called before push_rows.")
+        start, end = self.rows_pushed, self.rows_pushed + len(rows)
+        if rows.shape[1:] != self.key_frame.shape[1:] or end > self.header.height:
+            raise ValueError("Rows do not fit the frame.")
+        rows = self.ingest(np.ascontiguousarray(rows))
+        if self.row_frame.header.frame_type == FrameType.Key:
+            # As for whole frames, the keyframe is encoded from the encoder's copy.
+            working = self.key_frame[start:end]
+            np.copyto(working, rows)
+            encoded = self._encode_frame(working, self.row_pixels, None, None)
+        else:
+            width = self.header.width
+            encoded = self._encode_frame(
+                rows if self.tolerance is None else rows.copy(),
+                self.row_pixels,
+                self.key_frame_flat[start * width : end * width],
+                self.pixels,
+            )
+        self.rows_pushed = end
+        if self.header.sized or self.frame_metrics is not None:
+            self.row_frame.opcodes.extend(encoded.opcodes)
+        if not self.header.sized:
+            for opcode in encoded.opcodes:
+                opcode.write(self.file)
+
+    def end_frame(self) -> None:
+        """Finish the frame begun with begin_frame, once all its rows are pushed."""
+        if self.row_frame is None:
+            raise ValueError("No frame is being pushed.")
+        if self.rows_pushed != self.header.height:
+            raise ValueError("The frame is missing rows.")
+        encoded, self.row_frame, self.row_pixels = self.row_frame, None, None
+        if self.header.sized:
+            if self.frame_metrics is None:
+                self.write(encoded, self.file)
+            else:
+                self.write_measured(encoded, self.frame_metrics)
+        elif self.frame_metrics is not None:
+            assert self.metrics is not None
+            self.frame_metrics.frame_type = encoded.header.frame_type.name
+            # The opcodes are already written, after the 1 byte frame header.
+            self.frame_metrics.size = len(encoded) + 1
+            self.frame_metrics.count_opcodes(encoded.opcodes)
+            self.metrics.record(self.frame_metrics)
+            self.frame_metrics = None
         self.total_frames += 1
 
+    def write_measured(self, encoded: EncodedFrame, metrics: FrameMetrics) -> None:
+        """Write a frame, timing serialization separately from the write."""
+        start = perf_counter()
+        buffer = BytesIO()
+        self.write(encoded, buffer)
+        start = metrics.time("serialize", start)
+        self.file.write(buffer.getbuffer())
+        metrics.time("io", start)
+        metrics.frame_type = encoded.header.frame_type.name
+        metrics.size = buffer.tell()
+        metrics.count_opcodes(encoded.opcodes)
+        self.frame_metrics = None
+        assert self.metrics is not None
+        self.metrics.record(metrics)
+
+    def encode_next_keyframe(self, frame: NDArray[np.uint8]) -> EncodedFrame:
+        """Encode a frame as a keyframe, and make it the reference for later frames."""
+        self.pixels.clear()
+        # The keyframe is encoded from the encoder's own copy, which then holds
+        # the reconstructed pixels if encoding with a tolerance.
+        self.key_frame = Encoder.copy_into(self.key_frame, frame)
+        self.key_frame_flat = self.key_frame.reshape(-1, self.header.channels)
+        return self.encode_keyframe(self.key_frame, self.pixels)
+
+    def encode_next_predicted(self, frame: NDArray[np.uint8]) -> EncodedFrame:
+        """Encode a frame as predicted from the current keyframe."""
+        motion = (0, 0)
+        reference = self.key_frame_flat
+        if self.motion_search_range > 0:
+            start = perf_counter()
+            motion = estimate_motion(frame, self.key_frame, self.motion_search_range)
+            if self.frame_metrics is not None:
+                self.frame_metrics.time("motion", start)
+            if motion != (0, 0):
+                reference = shift_frame(self.key_frame, *motion).reshape(
+                    -1, self.header.channels
+                )
+        working = frame
+        if self.tolerance is not None:
+            working = self.scratch = Encoder.copy_into(self.scratch, frame)
+        if self.tile_size is not None and motion == (0, 0):
+            return self.encode_tiled(
+                working, self.new_pixel_map(), self.key_frame, self.pixels
+            )
+        encoded = self.encode_predicted(
+            working, self.new_pixel_map(), reference, self.pixels, motion
+        )
+        if motion != (0, 0) and self.search.verify_motion:
+            if self.tolerance is not None:
+                working = self.scratch = Encoder.copy_into(self.scratch, frame)
+            unshifted = self.encode_predicted(
+                working, self.new_pixel_map(), self.key_frame_flat, self.pixels
+            )
+            if len(unshifted) <= len(encoded):
+                encoded = unshifted
+        return encoded
+
     def flush(self) -> None:
         """Flush the encoder to the file."""
         self.file.flush()
@@ -0,0 +1,68 @@
+import importlib
+import lzma
+import zlib
+from types import ModuleType
+from typing import Optional
+from .types import Compression
+
+zstd: Optional[ModuleType]
+try:
+    zstd = importlib.import_module("compression.zstd")
+except ImportError:
+    try:
+        zstd = importlib.import_module("zstandard")
+    except ImportError:
+        zstd = None
+
+
+def is_available(compression: Compression) -> bool:
+    """Check the entropy coder can be used in this environment."""
+    return compression != Compression.zstd or zstd is not None
+
+
+def compress(
+    data: bytes, compression: Compression, level: Optional[int] = None
+) -> bytes:
+    """Compress a block of data with the requested entropy coder."""
+    match compression:
+        case Compression.none:
+            return data
+        case Compression.zlib:
+            return zlib.compress(data, -1 if level is None else level)
+        case Compression.lzma:
+            return lzma.compress(data, preset=level)
+        case Compression.zstd:
+            if zstd is None:
+                raise ValueError("zstd compression requires the zstandard package")
+            if level is None:
+                return zstd.compress(data)
+            return zstd.compress(data, level)
+    raise ValueError("Invalid compression")
+
+
+def decompress(data: bytes, compression: Compression) -> bytes:
+    """Decompress a block of data with the requested entropy coder.
+
+    Corrupt blocks raise ValueError, whichever coder they are for.
+    """
+    match compression:
+        case Compression.none:
+            return data
+        case Compression.zlib:
+            try:
+                return zlib.decompress(data)
+            except zlib.error as error:
+                raise ValueError(f"Corrupt zlib block: {error}") from error
+        case Compression.lzma:
+            try:
+                return lzma.decompress(data)
+            except lzma.LZMAError as error:
+                raise ValueError(f"Corrupt lzma block: {error}") from error
+        case Compression.zstd:
+            if zstd is None:
+                raise ValueError("zstd compression requires the zstandard package")
+            try:
+                return zstd.decompress(data)
+            except zstd.ZstdError as error:
+                raise ValueError(f"Corrupt zstd block: {error}") from error
+    raise ValueError("Invalid compression")
@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from itertools import product
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from numpy.typing import NDArray
+from .types import HASH_SIZES, HashFunction, hash_indices
+
+HashOption = Tuple[HashFunction, int]
+
+# Every hash function at every map size.
+ALL_HASH_OPTIONS: List[HashOption] = list(product(HashFunction, HASH_SIZES))
+
+
+@dataclass
+class HashStats:
+    """Colour hash map lookups for a frame, and how they fared.
+
+    A hit could be encoded as a 1 byte IndexOpcode. Misses include evictions,
+    where the slot held a different colour that had been pushed earlier in
+    the frame, which are the hits lost to collisions.
+    """
+
+    lookups: int = 0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups that found the colour."""
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def __add__(self, other: "HashStats") -> "HashStats":
+        """Combine the statistics of two frames."""
+        return HashStats(
+            self.lookups + other.lookups,
+            self.hits + other.hits,
+            self.misses + other.misses,
+            self.evictions + other.evictions,
+        )
+
+
+def simulate_hash_map(
+    frame: NDArray[np.uint8], function: HashFunction, size: int
+) -> HashStats:
+    """Replay a frame through a colour hash map.
+
+    As in the encoder, the map starts empty for each frame, and every pixel
+    that differs from the previous pixel is looked up and then pushed. Pixels
+    the encoder would code with another opcode are counted too, so this models
+    the hash map rather than predicting the exact number of IndexOpcodes.
+    """
+    flat = frame.reshape(-1, 3)
+    changed = np.ones(len(flat), dtype=np.bool_)
+    changed[1:] = np.any(flat[1:] != flat[:-1], axis=1)
+    colours = flat[changed]
+    packed = (
+        colours[:, 0].astype(np.int64) << 16
+        | colours[:, 1].astype(np.int64) << 8
+        | colours[:, 2]
+    ).tolist()
+    indices = hash_indices(function, colours, size).tolist()
+
+    # An empty map holds black, but black has not been pushed.
+    slots = [0] * size
+    pushed = [False] * size
+    stats = HashStats(lookups=len(packed))
+    for colour, index in zip(packed, indices):
+        if slots[index] == colour:
+            stats.hits += 1
+            continue
+        stats.misses += 1
+        if pushed[index]:
+            stats.evictions += 1
+        slots[index] = colour
+        pushed[index] = True
+    return stats
+
+
+def analyze_hashes(
+    frames: Iterable[NDArray[np.uint8]],
+    options: Optional[Sequence[HashOption]] = None,
+) -> Dict[HashOption, List[HashStats]]:
+    """Record the per frame statistics of each hash function and map size."""
+    options = ALL_HASH_OPTIONS if options is None else options
+    results: Dict[HashOption, List[HashStats]] = {option: [] for option in options}
+    for frame in frames:
+        for function, size in options:
+            results[(function, size)].append(simulate_hash_map(frame, function, size))
+    return results
+
+
+def select_hash(
+    frames: Iterable[NDArray[np.uint8]],
+    options: Optional[Sequence[HashOption]] = None,
+) -> HashOption:
+    """Pick the hash function and map size with the most hits over some frames.
+
+    Ties keep the earliest option, so the QOI hash at 64 colours wins unless
+    another option does better.
+    """
+    results = analyze_hashes(frames, options)
+    return max(results, key=lambda option: sum(stats.hits for stats in results[option]))
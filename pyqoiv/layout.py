@@ -0,0 +1,114 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+import numpy as np
+from numpy.typing import NDArray
+
+
+class PixelFormat(Enum):
+    """Enum to differentiate the order and number of channels in a buffer."""
+
+    RGB = "rgb"
+    BGR = "bgr"
+    RGBA = "rgba"
+    BGRA = "bgra"
+    GRAY = "gray"
+
+    @property
+    def bytes_per_pixel(self) -> int:
+        """The channels stored for each pixel, including any alpha."""
+        return {"rgb": 3, "bgr": 3, "rgba": 4, "bgra": 4, "gray": 1}[self.value]
+
+    @property
+    def channels(self) -> int:
+        """The channels encoded for each pixel, ignoring any alpha."""
+        return 1 if self == PixelFormat.GRAY else 3
+
+    @property
+    def colour_slice(self) -> slice:
+        """Select the colour channels of a pixel, in RGB order, as a view."""
+        if self in (PixelFormat.BGR, PixelFormat.BGRA):
+            return slice(2, None, -1)
+        return slice(0, self.channels)
+
+
+@dataclass(frozen=True)
+class PixelLayout:
+    """Describes how the pixels of a frame are laid out in a buffer.
+
+    Pixels are interleaved unless planar, when each channel is stored in its
+    own plane, one after another. The stride is the bytes from the start of
+    one row to the next, within a plane if planar, and defaults to no
+    padding.
+    """
+
+    pixel_format: PixelFormat = PixelFormat.RGB
+    planar: bool = False
+    stride: Optional[int] = None
+
+    def row_size(self, width: int) -> int:
+        """The bytes of pixels in a row, without any padding."""
+        return width if self.planar else width * self.pixel_format.bytes_per_pixel
+
+    def row_stride(self, width: int) -> int:
+        """The bytes from the start of one row to the next."""
+        return self.row_size(width) if self.stride is None else self.stride
+
+    def frame_size(self, width: int, height: int) -> int:
+        """The bytes a buffer must hold for a frame."""
+        stride = self.row_stride(width)
+        size = stride * (height - 1) + self.row_size(width)
+        if self.planar:
+            size += stride * height * (self.pixel_format.bytes_per_pixel - 1)
+        return size
+
+    def view(self, buffer, width: int, height: int) -> NDArray[np.uint8]:
+        """View a buffer as (height, width, bytes_per_pixel), without copying.
+
+        Channels are in the order they are stored. The buffer can be any
+        contiguous object supporting the buffer protocol, and the view is
+        writable if it is.
+        """
+        stride = self.row_stride(width)
+        if stride < self.row_size(width):
+            raise ValueError("Stride is shorter than a row of pixels.")
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        if len(data) < self.frame_size(width, height):
+            raise ValueError("Buffer is too small for the frame.")
+        if self.planar:
+            strides = (stride, 1, stride * height)
+        else:
+            strides = (stride, self.pixel_format.bytes_per_pixel, 1)
+        return np.lib.stride_tricks.as_strided(
+            data,
+            (height, width, self.pixel_format.bytes_per_pixel),
+            strides,
+            writeable=data.flags.writeable,
+        )
+
+    def unpack(self, buffer, width: int, height: int) -> NDArray[np.uint8]:
+        """View the colour channels of a buffer in RGB order, without copying."""
+        return self.view(buffer, width, height)[..., self.pixel_format.colour_slice]
+
+    def pack(
+        self,
+        frame: NDArray[np.uint8],
+        buffer,
+        table: Optional[NDArray[np.uint8]] = None,
+    ) -> None:
+        """Write a frame into a buffer, through a lookup table if provided.
+
+        Any alpha channel is set to opaque.
+        """
+        height, width = frame.shape[:2]
+        if frame.shape[2] != self.pixel_format.channels:
+            raise ValueError("Frame channels do not match the pixel format.")
+        view = self.view(buffer, width, height)
+        colour = view[..., self.pixel_format.colour_slice]
+        if table is None:
+            np.copyto(colour, frame)
+        else:
+            # The indices are bytes, so can not be out of range.
+            np.take(table, frame, out=colour, mode="clip")
+        if self.pixel_format.bytes_per_pixel == 4:
+            view[..., 3] = 255
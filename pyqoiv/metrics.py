@@ -0,0 +1,247 @@
+import json
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable, Dict, List, Mapping, Optional
+from numpy.typing import NDArray
+import numpy as np
+from .opcodes import (
+    AboveDiffOpcode,
+    AboveRunOpcode,
+    DiffFrameOpcode,
+    DiffOpcode,
+    FrameRunOpcode,
+    GrayDiffOpcode,
+    GrayOpcode,
+    IndexOpcode,
+    Opcode,
+    RgbOpcode,
+    RunOpcode,
+)
+from .types import PixelHashMap
+
+# Opcodes are reported by the names the decoder counts them by.
+OPCODE_NAMES = {
+    RgbOpcode: "rgb",
+    DiffOpcode: "diff",
+    RunOpcode: "run",
+    IndexOpcode: "index",
+    DiffFrameOpcode: "diff_frame",
+    FrameRunOpcode: "frame_run",
+    AboveRunOpcode: "above_run",
+    AboveDiffOpcode: "above_diff",
+    GrayOpcode: "gray",
+    GrayDiffOpcode: "gray_diff",
+}
+OPCODE_SIZES = {
+    "rgb": 4,
+    "diff": 1,
+    "run": 1,
+    "index": 1,
+    "diff_frame": 2,
+    "frame_run": 2,
+    "above_run": 2,
+    "above_diff": 2,
+    "gray": 2,
+    "gray_diff": 1,
+}
+
+
+@dataclass
+class FrameMetrics:
+    """What it took to encode or decode a single frame."""
+
+    frame_number: int
+    frame_type: str = ""
+    size: int = 0
+    opcodes: Dict[str, int] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    hash_lookups: int = 0
+    hash_hits: int = 0
+    hash_collisions: int = 0
+
+    @property
+    def opcode_bytes(self) -> Dict[str, int]:
+        """The bytes spent on each kind of opcode."""
+        return {
+            name: count * OPCODE_SIZES[name] for name, count in self.opcodes.items()
+        }
+
+    def time(self, stage: str, start: float) -> float:
+        """Add the time since start to a stage, returning the current time."""
+        now = perf_counter()
+        self.timings[stage] += now - start
+        return now
+
+    def count_lookup(
+        self, pixels: PixelHashMap, pixel: NDArray[np.uint8], found: bool
+    ) -> None:
+        """Count a hash map lookup, and whether another colour held the slot."""
+        self.hash_lookups += 1
+        if found:
+            self.hash_hits += 1
+        elif pixels.written[pixels.index_of_pixel(pixel)]:
+            self.hash_collisions += 1
+
+    def count_opcodes(self, opcodes: List[Opcode]) -> None:
+        """Count the opcodes of an encoded frame by kind."""
+        counts = Counter(map(type, opcodes))
+        self.opcodes = {OPCODE_NAMES[kind]: count for kind, count in counts.items()}
+
+    def to_dict(self) -> Dict:
+        """Convert to a JSON serializable dictionary."""
+        return {
+            "frame_number": self.frame_number,
+            "frame_type": self.frame_type,
+            "size": self.size,
+            "opcodes": dict(self.opcodes),
+            "opcode_bytes": self.opcode_bytes,
+            "timings": dict(self.timings),
+            "hash_lookups": self.hash_lookups,
+            "hash_hits": self.hash_hits,
+            "hash_collisions": self.hash_collisions,
+        }
+
+
+class Metrics:
+    """Aggregated metrics for an encoder or decoder.
+
+    Passing an instance to an Encoder or Decoder enables collection, which is
+    otherwise skipped entirely. Callbacks are called with the FrameMetrics of
+    every frame once it has been written or read.
+
+    Encoders time the motion, compare (finding runs for the frame), select
+    (choosing opcodes), serialize and io stages. Decoders time the io stage
+    (reading and decompressing size prefixed frames) and the decode stage,
+    which includes reading uncompressed opcodes.
+    """
+
+    def __init__(
+        self,
+        name: str = "encoder",
+        callbacks: Optional[List[Callable[[FrameMetrics], None]]] = None,
+    ):
+        """Construct an empty set of metrics."""
+        self.name = name
+        self.callbacks: List[Callable[[FrameMetrics], None]] = list(callbacks or [])
+        self.frames: Counter = Counter()
+        self.bytes = 0
+        self.opcodes: Counter = Counter()
+        self.opcode_bytes: Counter = Counter()
+        self.timings: Dict[str, float] = defaultdict(float)
+        self.hash_lookups = 0
+        self.hash_hits = 0
+        self.hash_collisions = 0
+
+    def add_callback(self, callback: Callable[[FrameMetrics], None]) -> None:
+        """Call a function with the metrics of every following frame."""
+        self.callbacks.append(callback)
+
+    def start_frame(self) -> FrameMetrics:
+        """Create the metrics for the next frame."""
+        return FrameMetrics(frame_number=sum(self.frames.values()))
+
+    def record(self, frame: FrameMetrics) -> None:
+        """Include a frame in the aggregates, and pass it to the callbacks."""
+        self.frames[frame.frame_type] += 1
+        self.bytes += frame.size
+        self.opcodes.update(frame.opcodes)
+        self.opcode_bytes.update(frame.opcode_bytes)
+        for stage, seconds in frame.timings.items():
+            self.timings[stage] += seconds
+        self.hash_lookups += frame.hash_lookups
+        self.hash_hits += frame.hash_hits
+        self.hash_collisions += frame.hash_collisions
+        for callback in self.callbacks:
+            callback(frame)
+
+    @property
+    def hash_hit_rate(self) -> float:
+        """The fraction of hash map lookups that found the colour."""
+        return self.hash_hits / self.hash_lookups if self.hash_lookups else 0.0
+
+    @property
+    def hash_collision_rate(self) -> float:
+        """The fraction of lookups missed as another colour held the slot."""
+        return self.hash_collisions / self.hash_lookups if self.hash_lookups else 0.0
+
+    def to_dict(self) -> Dict:
+        """Convert to a JSON serializable dictionary."""
+        return {
+            "name": self.name,
+            "frames": dict(self.frames),
+            "bytes": self.bytes,
+            "opcodes": dict(self.opcodes),
+            "opcode_bytes": dict(self.opcode_bytes),
+            "timings": dict(self.timings),
+            "hash_lookups": self.hash_lookups,
+            "hash_hits": self.hash_hits,
+            "hash_collisions": self.hash_collisions,
+            "hash_hit_rate": self.hash_hit_rate,
+            "hash_collision_rate": self.hash_collision_rate,
+        }
+
+    def to_json(self) -> str:
+        """Export the metrics as JSON."""
+        return json.dumps(self.to_dict())
+
+    def to_prometheus(self, namespace: str = "qoiv") -> str:
+        """Export the metrics in the Prometheus text exposition format."""
+        prefix = f"{namespace}_{self.name}"
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help: str, values: Mapping[str, float]):
+            """Add a metric's help, type and a sample for each set of labels."""
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in values.items():
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        def labelled(label: str, values: Mapping[str, float]) -> Dict[str, float]:
+            """Key values by a label, as a metric's samples."""
+            return {f'{{{label}="{key}"}}': value for key, value in values.items()}
+
+        metric(
+            "frames_total",
+            "counter",
+            "Frames by frame type.",
+            labelled("type", self.frames),
+        )
+        metric("bytes_total", "counter", "Bytes of frames.", {"": self.bytes})
+        metric(
+            "opcodes_total",
+            "counter",
+            "Opcodes by kind.",
+            labelled("opcode", self.opcodes),
+        )
+        metric(
+            "opcode_bytes_total",
+            "counter",
+            "Bytes of opcodes by kind.",
+            labelled("opcode", self.opcode_bytes),
+        )
+        metric(
+            "stage_seconds_total",
+            "counter",
+            "Time spent in each stage.",
+            labelled("stage", self.timings),
+        )
+        metric(
+            "hash_lookups_total",
+            "counter",
+            "Colour hash map lookups.",
+            {"": self.hash_lookups},
+        )
+        metric(
+            "hash_hits_total",
+            "counter",
+            "Colour hash map lookups that found the colour.",
+            {"": self.hash_hits},
+        )
+        metric(
+            "hash_collisions_total",
+            "counter",
+            "Colour hash map lookups missed as another colour held the slot.",
+            {"": self.hash_collisions},
+        )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,80 @@
+from typing import Tuple, TypeVar
+import numpy as np
+from numpy.typing import NDArray
+
+# Frames are shifted as bytes, and as wider integers when comparing them.
+Scalar = TypeVar("Scalar", bound=np.generic)
+
+
+def shift_frame(frame: NDArray[Scalar], dx: int, dy: int) -> NDArray[Scalar]:
+    """Offset a frame by a motion vector, clamping lookups to the frame edges.
+
+    The pixel at (x, y) of the result is taken from (x + dx, y + dy) of the
+    source frame, so a motion vector describes where the content of the
+    current frame came from in the reference frame.
+    """
+    height, width = frame.shape[:2]
+    rows = np.clip(np.arange(height) + dy, 0, height - 1)
+    cols = np.clip(np.arange(width) + dx, 0, width - 1)
+    return frame[rows[:, None], cols[None, :]]
+
+
+def count_matching(a: NDArray[np.uint8], b: NDArray[np.uint8]) -> int:
+    """Count the pixels that are identical in two equally shaped frames."""
+    return int(np.count_nonzero(np.all(a == b, axis=-1)))
+
+
+def estimate_motion(
+    frame: NDArray[np.uint8],
+    key_frame: NDArray[np.uint8],
+    search_range: int,
+    scale: int = 4,
+) -> Tuple[int, int]:
+    """Estimate a single motion vector between a frame and its key frame.
+
+    A coarse exhaustive search minimising the sum of absolute differences is
+    run over frames downsampled by ``scale``, followed by a refinement around
+    the best coarse vector on every ``scale``th row at full horizontal
+    resolution. The refinement scores vectors by the number of exactly
+    matching pixels, as those are what frame runs can encode. (0, 0) is
+    returned unless another vector is strictly better.
+    """
+    height, width = frame.shape[:2]
+    scale = max(1, min(scale, height, width))
+    coarse_range = max(1, search_range // scale)
+
+    small = frame[::scale, ::scale].astype(np.int16)
+    key_small = key_frame[::scale, ::scale].astype(np.int16)
+    best_coarse = (0, 0)
+    best_cost = int(np.abs(small - key_small).sum())
+    for sy in range(-coarse_range, coarse_range + 1):
+        for sx in range(-coarse_range, coarse_range + 1):
+            if sx == 0 and sy == 0:
+                continue
+            cost = int(np.abs(small - shift_frame(key_small, sx, sy)).sum())
+            if cost < best_cost:
+                best_coarse, best_cost = (sx, sy), cost
+
+    sample_rows = np.arange(0, height, scale)
+    sample = frame[sample_rows]
+    cols = np.arange(width)
+
+    def score_vector(dx: int, dy: int) -> int:
+        """Count the sampled pixels matching the key frame shifted by a vector."""
+        rows = np.clip(sample_rows + dy, 0, height - 1)
+        shifted = key_frame[rows[:, None], np.clip(cols + dx, 0, width - 1)[None, :]]
+        return count_matching(sample, shifted)
+
+    best = (0, 0)
+    best_score = score_vector(0, 0)
+    cx, cy = best_coarse[0] * scale, best_coarse[1] * scale
+    for dy in range(cy - scale + 1, cy + scale):
+        for dx in range(cx - scale + 1, cx + scale):
+            if abs(dx) > search_range or abs(dy) > search_range:
+                continue
+            if dx == 0 and dy == 0:
+                continue
+            score = score_vector(dx, dy)
+            if score > best_score:
+                best, best_score = (dx, dy), score
+    return best
@@ -0,0 +1,440 @@
+import multiprocessing
+import socketserver
+import struct
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BufferedIOBase
+from pathlib import Path
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+)
+import numpy as np
+from numpy.typing import NDArray
+from .encode import Encoder
+from .pipeline import (
+    EncodeResult,
+    _encode_keyframe,
+    _encode_predicted,
+    _plan_frame,
+)
+from .types import ColourSpace
+
+
+class _Stream:
+    """The state of one stream of a MultiStreamEncoder."""
+
+    def __init__(self, file: BufferedIOBase, encoder: Encoder, options: Dict[str, Any]):
+        """Construct the state of a new stream."""
+        self.file = file
+        self.encoder = encoder
+        self.options = options
+        # Frames waiting to be scheduled, and if each is a keyframe.
+        self.pending: Deque[Tuple[NDArray[np.uint8], bool, bool]] = deque()
+        # Scheduled frames, written in order as they complete.
+        self.in_flight: Deque[Future] = deque()
+        self.key_future: Optional[Future] = None
+        self.key_state: Optional[Tuple[NDArray[np.uint8], NDArray[np.uint8]]] = None
+        self.frames_written = 0
+        self.error: Optional[BaseException] = None
+
+    @property
+    def idle(self) -> bool:
+        """If every frame pushed to the stream has been written."""
+        return not self.pending and not self.in_flight
+
+
+class MultiStreamEncoder:
+    """Encode many streams, sharing a pool of encoder processes between them.
+
+    Each stream keeps its own keyframe decisions, keyframe reference and
+    colour hash map, and its frames are written in the order they were
+    pushed. A scheduler thread takes one frame from each stream in turn, so
+    a busy stream cannot starve the others. Each stream may have max_pending
+    frames waiting to be scheduled, after which push blocks, and at most
+    max_in_flight frames are encoded at once over all streams.
+
+    Predicted frames only depend on their keyframe, so they are scheduled as
+    soon as the keyframe of their group of pictures has been encoded.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 1,
+        max_pending: int = 4,
+        max_in_flight: Optional[int] = None,
+    ):
+        """Construct a new encoder, starting the scheduler and worker pool."""
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self.max_pending = max_pending
+        self.max_in_flight = 2 * jobs if max_in_flight is None else max_in_flight
+        self.streams: Dict[Hashable, _Stream] = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        # Jobs waiting for the scheduler to run them, without a pool.
+        self.inline_jobs: List[Tuple[Future, Callable[..., EncodeResult], Tuple]] = []
+        self.executor = (
+            ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("spawn"))
+            if jobs > 1
+            else None
+        )
+        self.scheduler = threading.Thread(
+            target=self._run, name="qoiv-multistream", daemon=True
+        )
+        self.scheduler.start()
+
+    def __enter__(self) -> "MultiStreamEncoder":
+        """Use the encoder as a context manager, closing it on exit."""
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Close every stream and stop the workers."""
+        self.close()
+
+    def add_stream(
+        self,
+        stream_id: Hashable,
+        file: BufferedIOBase,
+        width: int,
+        height: int,
+        colourspace: ColourSpace,
+        **encoder_options,
+    ) -> Encoder:
+        """Start a new stream, written to file.
+
+        The encoder options are those of Encoder. The returned encoder records
+        the stream's keyframe decisions, but frames must be pushed here.
+        """
+        options: Dict[str, Any] = dict(
+            width=width, height=height, colourspace=colourspace, **encoder_options
+        )
+        with self.condition:
+            if self.closed:
+                raise ValueError("The encoder is closed.")
+            if stream_id in self.streams:
+                raise ValueError(f"Stream {stream_id!r} already exists.")
+            encoder = Encoder(file, **options)
+            self.streams[stream_id] = _Stream(file, encoder, options)
+        return encoder
+
+    def push(
+        self,
+        stream_id: Hashable,
+        frame: NDArray[np.uint8],
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Queue a frame of a stream to be encoded.
+
+        The frame is copied, so it can be reused once this returns. Blocks while
+        the stream already has max_pending frames waiting, raising TimeoutError
+        if that takes longer than timeout seconds.
+        """
+        with self.condition:
+            stream = self._stream(stream_id)
+            header = stream.encoder.header
+            if frame.shape != (header.height, header.width, header.channels):
+                raise ValueError("Frame does not match the stream dimensions.")
+            if not self.condition.wait_for(
+                lambda: (
+                    stream.error is not None or len(stream.pending) < self.max_pending
+                ),
+                timeout,
+            ):
+                raise TimeoutError(f"Stream {stream_id!r} is backed up.")
+            if stream.error is not None:
+                raise stream.error
+            frame = stream.encoder.ingest(np.array(frame, dtype=np.uint8), True)
+            is_key, proxy = _plan_frame(stream.encoder, frame)
+            stream.pending.append((frame, is_key, proxy))
+            self.condition.notify_all()
+
+    def close_stream(self, stream_id: Hashable) -> Encoder:
+        """Wait for a stream's frames to be written, then remove it."""
+        with self.condition:
+            stream = self._stream(stream_id)
+            self.condition.wait_for(lambda: stream.error is not None or stream.idle)
+            del self.streams[stream_id]
+            self.condition.notify_all()
+        stream.file.flush()
+        if stream.error is not None:
+            raise stream.error
+        return stream.encoder
+
+    def close(self) -> None:
+        """Close every stream, and stop the scheduler and workers."""
+        errors: List[BaseException] = []
+        for stream_id in list(self.streams):
+            try:
+                self.close_stream(stream_id)
+            except Exception as e:
+                errors.append(e)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.scheduler.join()
+        if self.executor is not None:
+            self.executor.shutdown()
+        if errors:
+            raise errors[0]
+
+    def frames_written(self, stream_id: Hashable) -> int:
+        """The number of frames of a stream written so far."""
+        with self.condition:
+            return self._stream(stream_id).frames_written
+
+    def _stream(self, stream_id: Hashable) -> _Stream:
+        """Find a stream by ID."""
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            raise KeyError(f"Unknown stream {stream_id!r}")
+        return stream
+
+    def _notify(self, _: Future) -> None:
+        """Wake the scheduler once an encode job has finished."""
+        with self.condition:
+            self.condition.notify_all()
+
+    def _submit(self, function, *args) -> Future:
+        """Run an encode job in the pool, or queue it for the scheduler without one."""
+        if self.executor is None:
+            future: Future = Future()
+            self.inline_jobs.append((future, function, args))
+            return future
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(self._notify)
+        return future
+
+    def _schedule(self) -> bool:
+        """Start at most one frame from each stream, returning if any started."""
+        started = False
+        in_flight = sum(len(stream.in_flight) for stream in self.streams.values())
+        for stream in list(self.streams.values()):
+            if in_flight >= self.max_in_flight:
+                break
+            if not stream.pending or stream.error is not None:
+                continue
+            frame, is_key, proxy = stream.pending[0]
+            if is_key:
+                future = stream.key_future = self._submit(
+                    _encode_keyframe, stream.options, frame, proxy
+                )
+                stream.key_state = None
+            else:
+                if stream.key_state is None:
+                    assert stream.key_future is not None
+                    if not stream.key_future.done():
+                        continue
+                    try:
+                        result: EncodeResult = stream.key_future.result()
+                    except BaseException as e:
+                        stream.error = e
+                        continue
+                    assert result.key_frame is not None
+                    assert result.key_pixels is not None
+                    stream.key_state = (result.key_frame, result.key_pixels)
+                future = self._submit(
+                    _encode_predicted, stream.options, frame, *stream.key_state, proxy
+                )
+            stream.pending.popleft()
+            stream.in_flight.append(future)
+            in_flight += 1
+            started = True
+        return started
+
+    def _run_inline_jobs(self) -> None:
+        """Run the queued encode jobs, releasing the lock while they run.
+
+        Streams are only removed once idle, so those of the jobs remain.
+        """
+        jobs, self.inline_jobs = self.inline_jobs, []
+        self.condition.release()
+        try:
+            for future, function, args in jobs:
+                try:
+                    future.set_result(function(*args))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            self.condition.acquire()
+
+    def _write_completed(self) -> bool:
+        """Write the finished frames at the head of each stream, in order."""
+        written = False
+        for stream in self.streams.values():
+            while stream.in_flight and stream.in_flight[0].done():
+                future = stream.in_flight.popleft()
+                written = True
+                try:
+                    stream.file.write(future.result().payload)
+                    stream.frames_written += 1
+                except BaseException as e:
+                    stream.error = e
+            if stream.error is not None:
+                stream.pending.clear()
+                stream.in_flight.clear()
+        return written
+
+    def _run(self) -> None:
+        """Schedule frames and write results until closed."""
+        with self.condition:
+            while not self.closed:
+                progressed = self._schedule()
+                if self.inline_jobs:
+                    self._run_inline_jobs()
+                progressed = self._write_completed() or progressed
+                if progressed:
+                    self.condition.notify_all()
+                    self._rotate()
+                else:
+                    self.condition.wait(0.1)
+
+    def _rotate(self) -> None:
+        """Move the first stream to the end, so no stream is always first."""
+        if len(self.streams) > 1:
+            first = next(iter(self.streams))
+            self.streams[first] = self.streams.pop(first)
+
+
+# The front end protocol. Every message starts with a kind and a stream ID.
+MESSAGE = struct.Struct("<cI")
+# Opening a stream is followed by its dimensions and colourspace.
+OPEN = struct.Struct("<IIB")
+OPEN_STREAM = b"O"
+# A frame is followed by width * height * 3 bytes of RGB pixels.
+FRAME = b"F"
+CLOSE_STREAM = b"C"
+
+
+class StreamClient:
+    """Send frames to a multi-stream front end, over a socket or pipe."""
+
+    def __init__(self, file: BinaryIO):
+        """Construct a client writing to file."""
+        self.file = file
+
+    def open_stream(
+        self, stream_id: int, width: int, height: int, colourspace: ColourSpace
+    ) -> None:
+        """Start a new stream."""
+        self.file.write(MESSAGE.pack(OPEN_STREAM, stream_id))
+        self.file.write(OPEN.pack(width, height, colourspace))
+
+    def send_frame(self, stream_id: int, frame: NDArray[np.uint8]) -> None:
+        """Send the next frame of a stream."""
+        self.file.write(MESSAGE.pack(FRAME, stream_id))
+        self.file.write(memoryview(np.ascontiguousarray(frame, dtype=np.uint8)))
+
+    def close_stream(self, stream_id: int) -> None:
+        """Finish a stream."""
+        self.file.write(MESSAGE.pack(CLOSE_STREAM, stream_id))
+        self.file.flush()
+
+
+def _read_exact(file: BufferedIOBase, size: int) -> Optional[bytes]:
+    """Read exactly size bytes, or None at the end of the stream."""
+    data = file.read(size)
+    if not data:
+        return None
+    while len(data) < size:
+        more = file.read(size - len(data))
+        if not more:
+            raise ValueError("Stream ended part way through a message.")
+        data += more
+    return data
+
+
+def serve_stream(
+    encoder: MultiStreamEncoder,
+    file: BufferedIOBase,
+    directory: Path,
+    **encoder_options,
+) -> None:
+    """Handle the messages of one connection until it ends.
+
+    Each stream is written to <stream id>.qoiv in directory. Streams left open
+    when the connection ends are closed.
+    """
+    opened: Dict[int, Tuple[BufferedIOBase, Tuple[int, int, int]]] = {}
+    try:
+        while (message := _read_exact(file, MESSAGE.size)) is not None:
+            kind, stream_id = MESSAGE.unpack(message)
+            if kind == OPEN_STREAM:
+                data = _read_exact(file, OPEN.size)
+                if data is None:
+                    raise ValueError("Stream ended part way through a message.")
+                width, height, colourspace = OPEN.unpack(data)
+                output = (directory / f"{stream_id}.qoiv").open("wb")
+                channels = encoder.add_stream(
+                    stream_id,
+                    output,
+                    width,
+                    height,
+                    ColourSpace(colourspace),
+                    **encoder_options,
+                ).header.channels
+                opened[stream_id] = (output, (height, width, channels))
+            elif kind == FRAME:
+                if stream_id not in opened:
+                    raise ValueError(f"Frame for unopened stream {stream_id}.")
+                _, shape = opened[stream_id]
+                data = _read_exact(file, shape[0] * shape[1] * shape[2])
+                if data is None:
+                    raise ValueError("Stream ended part way through a message.")
+                encoder.push(stream_id, np.frombuffer(data, np.uint8).reshape(shape))
+            elif kind == CLOSE_STREAM:
+                if stream_id not in opened:
+                    raise ValueError(f"Close of unopened stream {stream_id}.")
+                output, _ = opened.pop(stream_id)
+                try:
+                    encoder.close_stream(stream_id)
+                finally:
+                    output.close()
+            else:
+                raise ValueError(f"Unknown message {kind!r}")
+    finally:
+        for stream_id, (output, _) in opened.items():
+            try:
+                encoder.close_stream(stream_id)
+            finally:
+                output.close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Serve the messages of one connection."""
+
+    def handle(self) -> None:
+        """Handle the connection until the client disconnects."""
+        server: Any = self.server
+        serve_stream(server.encoder, self.rfile, server.directory, **server.options)
+
+
+class MultiStreamServer(socketserver.ThreadingTCPServer):
+    """A local TCP front end to a MultiStreamEncoder, mainly for testing.
+
+    Each connection may carry any number of streams, written to directory.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        encoder: MultiStreamEncoder,
+        directory: Path,
+        **encoder_options,
+    ):
+        """Construct a server listening on address."""
+        self.encoder = encoder
+        self.directory = directory
+        self.options = encoder_options
+        super().__init__(address, _Handler)
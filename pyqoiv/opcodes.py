@@ -34,7 +34,7 @@ class RgbOpcode(Opcode):
     def is_next(file: BufferedIOBase) -> bool:
         """Read the next byte and determine if it is a RgbOpcode."""
         code = file.read(1)
-        file.seek(-1, os.SEEK_CUR)
+        file.seek(-len(code), os.SEEK_CUR)
         return code == b"\xfe"
 
     @staticmethod
@@ -47,6 +47,38 @@ class RgbOpcode(Opcode):
         return RgbOpcode(r, g, b)
 
 
+@dataclass
+class GrayOpcode(Opcode):
+    """Encodes a single grayscale pixel, in place of the RgbOpcode.
+
+    This shares the 0xFE tag of the RgbOpcode, and is only used in grayscale
+    files, from format version 5.
+    """
+
+    value: int
+
+    def write(self, file: BufferedIOBase) -> None:
+        """Write the Gray opcode to the provided file handle."""
+        file.write(struct.pack("<BB", 0xFE, self.value))
+
+    def __len__(self) -> int:
+        """Fixed size of 2"""
+        return 2
+
+    @staticmethod
+    def is_next(file: BufferedIOBase) -> bool:
+        """Read the next byte and determine if it is a GrayOpcode."""
+        return RgbOpcode.is_next(file)
+
+    @staticmethod
+    def read(file: BufferedIOBase) -> "GrayOpcode":
+        """Read a Gray opcode from the provided file handle."""
+        code = file.read(2)
+        if len(code) != 2 or code[0] != 0xFE:
+            raise ValueError("Invalid Gray opcode")
+        return GrayOpcode(code[1])
+
+
 @dataclass
 class IndexOpcode(Opcode):
     """The QOI_OP_INDEX opcode, encodes an index into the pixel hash map."""
@@ -67,7 +99,7 @@ class IndexOpcode(Opcode):
     def is_next(file: BufferedIOBase) -> bool:
         """Read the next byte and determine if it is an IndexOpcode."""
         code = file.read(1)
-        file.seek(-1, os.SEEK_CUR)
+        file.seek(-len(code), os.SEEK_CUR)
         return 0 <= code[0] <= 63
 
     @staticmethod
@@ -105,7 +137,7 @@ class DiffOpcode(Opcode):
     def is_next(file: BufferedIOBase) -> bool:
         """Determine if the next opcode is a DiffOpcode."""
         code = file.read(1)
-        file.seek(-1, os.SEEK_CUR)
+        file.seek(-len(code), os.SEEK_CUR)
         return code[0] & 0xC0 == 0x40
 
     @staticmethod
@@ -120,6 +152,41 @@ class DiffOpcode(Opcode):
         return DiffOpcode(dr, dg, db)
 
 
+@dataclass
+class GrayDiffOpcode(Opcode):
+    """Encodes a difference from the last grayscale pixel, in place of the DiffOpcode.
+
+    This shares the tag of the DiffOpcode, and is only used in grayscale files,
+    from format version 5. With a single channel, all 6 bits hold the
+    difference, which is between -32..31.
+    """
+
+    diff: int
+
+    def write(self, file: BufferedIOBase) -> None:
+        """Write the GrayDiff opcode to the provided file handle."""
+        if not (-32 <= self.diff < 32):
+            raise ValueError("diff must be between -32 and 31")
+        file.write(struct.pack("<B", 0x40 | (self.diff + 32)))
+
+    def __len__(self) -> int:
+        """Fixed size of 1"""
+        return 1
+
+    @staticmethod
+    def is_next(file: BufferedIOBase) -> bool:
+        """Determine if the next opcode is a GrayDiffOpcode."""
+        return DiffOpcode.is_next(file)
+
+    @staticmethod
+    def read(file: BufferedIOBase) -> "GrayDiffOpcode":
+        """Read a GrayDiff opcode from the provided file handle."""
+        code = file.read(1)
+        if len(code) != 1 or code[0] & 0xC0 != 0x40:
+            raise ValueError("Invalid GrayDiff opcode")
+        return GrayDiffOpcode((code[0] & 0x3F) - 32)
+
+
 @dataclass
 class RunOpcode(Opcode):
     """The QOI_OP_RUN opcode, encodes a run of identical pixels."""
@@ -140,7 +207,7 @@ class RunOpcode(Opcode):
     def is_next(file: BufferedIOBase) -> bool:
         """Determine if the next opcode is a RunOpcode."""
         code = file.read(1)
-        file.seek(-1, os.SEEK_CUR)
+        file.seek(-len(code), os.SEEK_CUR)
         return (code[0] & 0xC0) == 0xC0 and code[0] != 0xFF and code[0] != 0xFE
 
     @staticmethod
@@ -155,7 +222,10 @@ class RunOpcode(Opcode):
 
 @dataclass
 class FrameRunOpcode(Opcode):
-    """This Opcode replaces the QOI_OP_RGBA opcode, and is used to represent a run of identical pixels from a previous frame."""
+    """This Opcode replaces the QOI_OP_RGBA opcode, and is used to represent a run of identical pixels from a previous frame.
+
+    From format version 1, is_keyframe == False is the AboveRunOpcode instead.
+    """
 
     is_keyframe: bool
     run: int
@@ -172,7 +242,7 @@ class FrameRunOpcode(Opcode):
     @staticmethod
     def is_next(file: BufferedIOBase) -> bool:
         code = file.read(1)
-        file.seek(-1, os.SEEK_CUR)
+        file.seek(-len(code), os.SEEK_CUR)
         return code[0] == 0xFF
 
     @staticmethod
@@ -186,6 +256,96 @@ class FrameRunOpcode(Opcode):
         return FrameRunOpcode(is_keyframe, run)
 
 
+@dataclass
+class AboveRunOpcode(Opcode):
+    """Represents a run of pixels copied from the row above in the current frame.
+
+    This shares the 0xFF tag of the FrameRunOpcode, using the encoding with the
+    keyframe bit clear, and is only valid from format version 1. The run may not
+    be longer than the frame width, so the source pixels are always decoded.
+    """
+
+    run: int
+
+    def write(self, file: BufferedIOBase) -> None:
+        """Write the AboveRunOpcode to the provided file handle."""
+        if not (1 <= self.run <= 128):
+            raise ValueError("Run value must be between 1 and 128")
+        file.write(struct.pack("<BB", 0xFF, self.run - 1))
+
+    def __len__(self) -> int:
+        """Fixed size of 2"""
+        return 2
+
+    @staticmethod
+    def is_next(file: BufferedIOBase) -> bool:
+        """Determine if the next opcode is an AboveRunOpcode."""
+        code = file.read(2)
+        file.seek(-len(code), os.SEEK_CUR)
+        return len(code) == 2 and code[0] == 0xFF and code[1] & 0x80 == 0
+
+    @staticmethod
+    def read(file: BufferedIOBase) -> "AboveRunOpcode":
+        """Read an AboveRunOpcode from the provided file handle."""
+        code = file.read(2)
+        if len(code) != 2 or code[0] != 0xFF or code[1] & 0x80 != 0:
+            raise ValueError("Invalid AboveRun opcode")
+        return AboveRunOpcode(run=code[1] + 1)
+
+
+@dataclass
+class AboveDiffOpcode(Opcode):
+    """Represents a pixel as a difference from the pixel above it in the current frame.
+
+    This shares the tag of the DiffFrameOpcode, using the encoding with both the
+    key_frame and use_index bits clear, and is only valid from format version 1.
+    diff is applied to every channel, and is between -32..31. dr, dg and db are
+    then applied per channel, and are between -2..1.
+    """
+
+    diff: int
+    dr: int
+    dg: int
+    db: int
+
+    def write(self, file: BufferedIOBase) -> None:
+        """Write the AboveDiffOpcode to the provided file handle."""
+        if not (-32 <= self.diff < 32):
+            raise ValueError("diff must be between -32 and 31")
+        if not (-2 <= self.dr < 2 and -2 <= self.dg < 2 and -2 <= self.db < 2):
+            raise ValueError("Diff values must be between -2 and 1")
+        file.write(
+            struct.pack(
+                "<BB",
+                0x80 | (self.diff + 32),
+                (self.dr + 2) << 4 | (self.dg + 2) << 2 | (self.db + 2),
+            )
+        )
+
+    def __len__(self) -> int:
+        """Fixed size of 2"""
+        return 2
+
+    @staticmethod
+    def is_next(file: BufferedIOBase) -> bool:
+        """Determine if the next opcode is an AboveDiffOpcode."""
+        code = file.read(2)
+        file.seek(-len(code), os.SEEK_CUR)
+        return len(code) == 2 and code[0] & 0xC0 == 0x80 and code[1] & 0xC0 == 0
+
+    @staticmethod
+    def read(file: BufferedIOBase) -> "AboveDiffOpcode":
+        """Read an AboveDiffOpcode from the provided file handle."""
+        b = file.read(2)
+        if len(b) != 2 or b[0] & 0xC0 != 0x80 or b[1] & 0xC0 != 0:
+            raise ValueError("Invalid AboveDiff opcode")
+        diff = (b[0] & 0x3F) - 32
+        dr = ((b[1] >> 4) & 0x03) - 2
+        dg = ((b[1] >> 2) & 0x03) - 2
+        db = (b[1] & 0x03) - 2
+        return AboveDiffOpcode(diff, dr, dg, db)
+
+
 class DiffFrameOpcode(Opcode):
     """This Opcode replaces the QOI_OP_LUMA opcode, and is used to query data from previous frames.
 
@@ -195,6 +355,8 @@ class DiffFrameOpcode(Opcode):
     If use_index is False, then the value is fetched from the frame buffer.
 
     key_frame == False and use_index == True is an invalid state.
+    From format version 1, key_frame == False and use_index == False is the
+    AboveDiffOpcode instead.
 
     dr, dg, and db are the differences in red, green, and blue channels respectively from the pixel fetched from the above location.
     If use_index is False, these differences are added to the value in index, which will be between -32..31.
@@ -246,7 +408,7 @@ class DiffFrameOpcode(Opcode):
     def is_next(file: BufferedIOBase) -> bool:
         """Determine if the next opcode is a DiffFrameOpcode."""
         code = file.read(1)
-        file.seek(-1, os.SEEK_CUR)
+        file.seek(-len(code), os.SEEK_CUR)
         return (code[0] & 0xC0) == 0x80
 
     @staticmethod
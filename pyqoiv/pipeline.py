@@ -0,0 +1,499 @@
+import multiprocessing
+import queue
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from io import BufferedIOBase, BytesIO
+from multiprocessing import shared_memory
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from numpy.typing import NDArray
+from .decode import Decoder
+from .encode import Encoder
+from .types import ColourSpace
+
+
+@dataclass
+class StageStats:
+    """Records how long a pipeline stage spent working."""
+
+    name: str
+    workers: int = 1
+    busy: float = 0.0
+    items: int = 0
+
+    def utilization(self, elapsed: float) -> float:
+        """The fraction of the elapsed time the stage's workers were busy."""
+        if elapsed <= 0:
+            return 0.0
+        return self.busy / (elapsed * self.workers)
+
+
+@dataclass
+class PipelineStats:
+    """Per stage statistics for a pipeline run."""
+
+    elapsed: float = 0.0
+    stages: List[StageStats] = field(default_factory=list)
+
+    def report(self) -> str:
+        """Describe the utilization of each stage, to find the bottleneck."""
+        lines = [f"Elapsed: {self.elapsed:.2f}s"]
+        for stage in self.stages:
+            lines.append(
+                f"{stage.name}: {stage.utilization(self.elapsed):.0%} busy, "
+                f"{stage.items} frames, {stage.busy:.2f}s "
+                f"over {stage.workers} worker(s)"
+            )
+        return "\n".join(lines)
+
+
+@dataclass
+class EncodeResult:
+    """The serialized frame from an encode job, and the keyframe it produced."""
+
+    payload: bytes
+    seconds: float
+    key_frame: Optional[NDArray[np.uint8]] = None
+    key_pixels: Optional[NDArray[np.uint8]] = None
+
+
+# Encoders used by encode jobs, by their options. Jobs carry all the state
+# they need, so one encoder serves every stream it suits. They are kept per
+# thread, as jobs run inline on the threads of concurrent pipelines must not
+# share one, and only the most recently used are kept.
+_workers = threading.local()
+MAX_WORKERS = 4
+
+
+def _worker_for(options: Dict[str, Any]) -> Encoder:
+    """Get the encoder used by encode jobs with these options on this thread."""
+    workers: Optional[OrderedDict[str, Encoder]] = getattr(_workers, "encoders", None)
+    if workers is None:
+        workers = _workers.encoders = OrderedDict()
+    key = repr(sorted(options.items()))
+    encoder = workers.get(key)
+    if encoder is None:
+        encoder = workers[key] = Encoder(BytesIO(), **options)
+        if len(workers) > MAX_WORKERS:
+            workers.popitem(last=False)
+    else:
+        workers.move_to_end(key)
+    return encoder
+
+
+@dataclass(frozen=True)
+class SharedKeyState:
+    """Where a keyframe and its hash map are in shared memory.
+
+    Predicted jobs run in worker processes carry this rather than the key
+    state itself, so the key state is copied to each worker once per group
+    of pictures rather than pickled with every frame.
+    """
+
+    name: str
+    frame_shape: Tuple[int, ...]
+    pixels_shape: Tuple[int, ...]
+
+    @classmethod
+    def create(
+        cls, key_frame: NDArray[np.uint8], key_pixels: NDArray[np.uint8]
+    ) -> Tuple[shared_memory.SharedMemory, "SharedKeyState"]:
+        """Copy a key state into a new block, which the caller must unlink."""
+        block = shared_memory.SharedMemory(
+            create=True, size=key_frame.nbytes + key_pixels.nbytes
+        )
+        state = cls(block.name, key_frame.shape, key_pixels.shape)
+        shared_frame, shared_pixels = state.arrays(block)
+        shared_frame[...] = key_frame
+        shared_pixels[...] = key_pixels
+        return block, state
+
+    def arrays(
+        self, block: shared_memory.SharedMemory
+    ) -> Tuple[NDArray[np.uint8], NDArray[np.uint8]]:
+        """View the keyframe and hash map in their block."""
+        key_frame: NDArray[np.uint8] = np.ndarray(self.frame_shape, np.uint8, block.buf)
+        key_pixels: NDArray[np.uint8] = np.ndarray(
+            self.pixels_shape, np.uint8, block.buf, offset=key_frame.nbytes
+        )
+        return key_frame, key_pixels
+
+
+# Key states attached by the predicted jobs of this process, by block name.
+# Groups of pictures are encoded in order, so only the latest are kept.
+_key_states: OrderedDict[
+    str, Tuple[shared_memory.SharedMemory, NDArray[np.uint8], NDArray[np.uint8]]
+] = OrderedDict()
+MAX_KEY_STATES = 2
+
+
+def _attach_key_state(
+    state: SharedKeyState,
+) -> Tuple[NDArray[np.uint8], NDArray[np.uint8]]:
+    """Get the keyframe and hash map of a shared key state, attaching once."""
+    entry = _key_states.get(state.name)
+    if entry is None:
+        # The pipeline is responsible for unlinking the block.
+        if sys.version_info >= (3, 13):
+            block = shared_memory.SharedMemory(state.name, track=False)
+        else:
+            block = shared_memory.SharedMemory(state.name)
+        key_frame, key_pixels = state.arrays(block)
+        # Every job of the group of pictures shares them.
+        key_frame.flags.writeable = key_pixels.flags.writeable = False
+        entry = _key_states[state.name] = (block, key_frame, key_pixels)
+        if len(_key_states) > MAX_KEY_STATES:
+            evicted = _key_states.popitem(last=False)[1][0]
+            try:
+                evicted.close()
+            except BufferError:
+                # Still in use, so it is unmapped once its arrays are freed.
+                pass
+    else:
+        _key_states.move_to_end(state.name)
+    return entry[1], entry[2]
+
+
+def _release_key_state(block: shared_memory.SharedMemory) -> None:
+    """Close and remove a key state block created by a pipeline."""
+    block.close()
+    block.unlink()
+
+
+def _serialize(
+    encoder: Encoder, encoded, proxy: Optional[NDArray[np.uint8]] = None
+) -> bytes:
+    """Write an encoded frame as the encoder would to its file.
+
+    If a frame to proxy is provided, its proxy frame is written first.
+    """
+    buffer = BytesIO()
+    if proxy is not None:
+        encoder.write(encoder.encode_proxy(proxy), buffer)
+    encoder.write(encoded, buffer)
+    return buffer.getvalue()
+
+
+def _encode_keyframe(
+    options: Dict[str, Any], frame: NDArray[np.uint8], proxy: bool = False
+) -> EncodeResult:
+    """Encode a keyframe, returning the reference predicted frames need."""
+    worker = _worker_for(options)
+    start = perf_counter()
+    # Keyframes are encoded from the worker's copy, so frame is left as is.
+    payload = _serialize(
+        worker, worker.encode_next_keyframe(frame), frame if proxy else None
+    )
+    # The worker's buffers are reused by the next keyframe job.
+    return EncodeResult(
+        payload,
+        perf_counter() - start,
+        worker.key_frame.copy(),
+        worker.pixels.pixels.copy(),
+    )
+
+
+def _encode_predicted(
+    options: Dict[str, Any],
+    frame: NDArray[np.uint8],
+    key_frame: NDArray[np.uint8],
+    key_pixels: NDArray[np.uint8],
+    proxy: bool = False,
+) -> EncodeResult:
+    """Encode a predicted frame against the provided keyframe."""
+    worker = _worker_for(options)
+    start = perf_counter()
+    own = worker.key_frame, worker.key_frame_flat, worker.pixels.pixels
+    worker.key_frame = key_frame
+    worker.key_frame_flat = key_frame.reshape(-1, key_frame.shape[2])
+    worker.pixels.pixels = key_pixels
+    try:
+        payload = _serialize(
+            worker, worker.encode_next_predicted(frame), frame if proxy else None
+        )
+    finally:
+        worker.key_frame, worker.key_frame_flat, worker.pixels.pixels = own
+    return EncodeResult(payload, perf_counter() - start)
+
+
+def _encode_shared_predicted(
+    options: Dict[str, Any],
+    frame: NDArray[np.uint8],
+    key_state: SharedKeyState,
+    proxy: bool = False,
+) -> EncodeResult:
+    """Encode a predicted frame against a keyframe in shared memory."""
+    return _encode_predicted(options, frame, *_attach_key_state(key_state), proxy)
+
+
+def _plan_frame(encoder: Encoder, frame: NDArray[np.uint8]) -> Tuple[bool, bool]:
+    """Decide if a frame is a keyframe, updating the encoder as if it was pushed.
+
+    Only the decisions are made, the frame is encoded elsewhere. Returns if the
+    frame is a keyframe, and if a proxy frame should precede it. The keyframe
+    is copied so later frames can still be compared against it.
+    """
+    decision = encoder.next_keyframe_decision(frame)
+    proxy = encoder.is_proxy_due(decision is not None)
+    if decision is not None:
+        encoder.keyframe_decisions.append(decision)
+        encoder.key_frame = Encoder.copy_into(encoder.key_frame, frame)
+    else:
+        encoder.frames_since_last_keyframe += 1
+    encoder.total_frames += 1
+    return decision is not None, proxy
+
+
+def _run_inline(function: Callable[..., EncodeResult], *args) -> Future:
+    """Run a job immediately, for pipelines without a process pool."""
+    future: Future = Future()
+    future.set_result(function(*args))
+    return future
+
+
+def encode_pipeline(
+    read_frame: Callable[[NDArray[np.uint8]], bool],
+    file: BufferedIOBase,
+    width: int,
+    height: int,
+    colourspace: ColourSpace,
+    jobs: int = 1,
+    queue_size: int = 4,
+    progress: Optional[Callable[[], object]] = None,
+    **encoder_options,
+) -> Tuple[Encoder, PipelineStats]:
+    """Encode frames with overlapped read, encode and write stages.
+
+    read_frame fills the provided buffer with the next frame, returning False
+    once there are no more frames. It is called from a reader thread. Frames
+    are encoded by a pool of jobs worker processes, or on the calling thread
+    if jobs is 1, and written in order by a writer thread. Predicted frames
+    only depend on their keyframe, so all the frames of a group of pictures
+    can be encoded at once. Bounded queues between the stages limit the
+    number of frames in flight.
+    """
+    options: Dict[str, Any] = dict(
+        width=width, height=height, colourspace=colourspace, **encoder_options
+    )
+    pool_size = 2 * queue_size + jobs + 1
+    encoder = Encoder(file, buffer_pool_size=pool_size, **options)
+    read_stats = StageStats("read")
+    encode_stats = StageStats("encode", workers=jobs)
+    write_stats = StageStats("write")
+    stats = PipelineStats(stages=[read_stats, encode_stats, write_stats])
+
+    # Buffers are only returned to the pool once written, so the reader waits
+    # for a free slot rather than the pool running dry.
+    slots = threading.Semaphore(pool_size)
+    frames: queue.Queue[Optional[NDArray[np.uint8]]] = queue.Queue(queue_size)
+    encoded: queue.Queue[Optional[Tuple[Future, NDArray[np.uint8]]]] = queue.Queue(
+        queue_size + jobs
+    )
+    errors: List[BaseException] = []
+    stop = threading.Event()
+
+    def put_frame(frame: Optional[NDArray[np.uint8]]) -> bool:
+        """Queue a frame to encode, returning False if the pipeline stopped."""
+        while not stop.is_set():
+            try:
+                frames.put(frame, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get_frame() -> Optional[NDArray[np.uint8]]:
+        """Take the next frame to encode, or None once there are no more."""
+        while True:
+            try:
+                return frames.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return None
+
+    def reader() -> None:
+        """Read frames into pooled buffers, until there are no more."""
+        try:
+            while True:
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                buffer = encoder.acquire_buffer()
+                start = perf_counter()
+                more = read_frame(buffer)
+                read_stats.busy += perf_counter() - start
+                if not more:
+                    encoder.release_buffer(buffer)
+                    slots.release()
+                    break
+                encoder.ingest(buffer)
+                read_stats.items += 1
+                if not put_frame(buffer):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put_frame(None)
+
+    def writer() -> None:
+        """Write the encoded frames in order, as their jobs finish."""
+        try:
+            while (item := encoded.get()) is not None:
+                future, buffer = item
+                result: EncodeResult = future.result()
+                encode_stats.busy += result.seconds
+                encode_stats.items += 1
+                start = perf_counter()
+                file.write(result.payload)
+                write_stats.busy += perf_counter() - start
+                write_stats.items += 1
+                encoder.release_buffer(buffer)
+                slots.release()
+                if progress is not None:
+                    progress()
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+            # Keep draining so the encode stage never blocks on a full queue
+            while encoded.get() is not None:
+                pass
+
+    executor = (
+        ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("spawn"))
+        if jobs > 1
+        else None
+    )
+    submit = executor.submit if executor is not None else _run_inline
+    # Key states shared with each group of pictures' jobs, and the jobs.
+    shared: List[Tuple[shared_memory.SharedMemory, List[Future]]] = []
+
+    reader_thread = threading.Thread(target=reader, name="qoiv-reader", daemon=True)
+    writer_thread = threading.Thread(target=writer, name="qoiv-writer", daemon=True)
+    start = perf_counter()
+    reader_thread.start()
+    writer_thread.start()
+    key_future: Optional[Future] = None
+    key_state: Optional[Tuple[NDArray[np.uint8], NDArray[np.uint8]]] = None
+    shared_state: Optional[SharedKeyState] = None
+    try:
+        while (frame := get_frame()) is not None:
+            is_key, proxy = _plan_frame(encoder, frame)
+            if is_key:
+                future = key_future = submit(_encode_keyframe, options, frame, proxy)
+                key_state = shared_state = None
+            elif executor is None:
+                if key_state is None:
+                    assert key_future is not None
+                    result: EncodeResult = key_future.result()
+                    assert result.key_frame is not None
+                    assert result.key_pixels is not None
+                    key_state = (result.key_frame, result.key_pixels)
+                future = submit(_encode_predicted, options, frame, *key_state, proxy)
+            else:
+                if shared_state is None:
+                    assert key_future is not None
+                    result = key_future.result()
+                    assert result.key_frame is not None
+                    assert result.key_pixels is not None
+                    # Blocks are removed once the jobs using them are done.
+                    for entry in [e for e in shared if all(f.done() for f in e[1])]:
+                        shared.remove(entry)
+                        _release_key_state(entry[0])
+                    block, shared_state = SharedKeyState.create(
+                        result.key_frame, result.key_pixels
+                    )
+                    shared.append((block, []))
+                future = submit(
+                    _encode_shared_predicted, options, frame, shared_state, proxy
+                )
+                shared[-1][1].append(future)
+            encoded.put((future, frame))
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        encoded.put(None)
+        writer_thread.join()
+        stop.set()
+        reader_thread.join()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        for block, _ in shared:
+            _release_key_state(block)
+    stats.elapsed = perf_counter() - start
+    if errors:
+        raise errors[0]
+    return encoder, stats
+
+
+def decode_pipeline(
+    decoder: Decoder,
+    write: Callable[[NDArray[np.uint8]], None],
+    queue_size: int = 4,
+    progress: Optional[Callable[[], object]] = None,
+    step: int = 1,
+) -> PipelineStats:
+    """Decode frames on a separate thread to the one writing them.
+
+    write is called on the calling thread with each decoded frame, in order.
+    Frames are never reused by the decoder, so they can be written without a
+    copy, for example as a memoryview. A step above 1 only decodes every
+    step-th frame.
+    """
+    decode_stats = StageStats("decode")
+    write_stats = StageStats("write")
+    stats = PipelineStats(stages=[decode_stats, write_stats])
+    frames: queue.Queue[Optional[NDArray[np.uint8]]] = queue.Queue(queue_size)
+    errors: List[BaseException] = []
+    stop = threading.Event()
+
+    def put_frame(frame: Optional[NDArray[np.uint8]]) -> None:
+        """Queue a decoded frame to write, unless the pipeline stopped."""
+        while not stop.is_set():
+            try:
+                frames.put(frame, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def reader() -> None:
+        """Decode the frames, until there are no more."""
+        try:
+            iterator = (
+                (frame for frame, _ in decoder) if step == 1 else decoder.iter(step)
+            )
+            while not stop.is_set():
+                start = perf_counter()
+                frame = next(iterator, None)
+                decode_stats.busy += perf_counter() - start
+                if frame is None:
+                    break
+                decode_stats.items += 1
+                put_frame(frame)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put_frame(None)
+
+    decode_thread = threading.Thread(target=reader, name="qoiv-decoder", daemon=True)
+    start = perf_counter()
+    decode_thread.start()
+    try:
+        while (frame := frames.get()) is not None:
+            write_start = perf_counter()
+            write(frame)
+            write_stats.busy += perf_counter() - write_start
+            write_stats.items += 1
+            if progress is not None:
+                progress()
+    finally:
+        stop.set()
+        decode_thread.join()
+    stats.elapsed = perf_counter() - start
+    if errors:
+        raise errors[0]
+    return stats
@@ -0,0 +1,401 @@
+import mmap
+import multiprocessing
+import struct
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from io import BufferedIOBase, UnsupportedOperation
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+import numpy as np
+from .entropy import decompress
+from .tiles import bitmap_size, count_tiles
+from .types import Compression, FrameType, QovHeader
+
+# The names frameinfo reports opcodes by, matching the decoder.
+OPCODE_NAMES = (
+    "rgb",
+    "diff",
+    "run",
+    "index",
+    "diff_frame",
+    "frame_run",
+    "above_run",
+    "above_diff",
+    "gray",
+    "gray_diff",
+)
+(
+    RGB,
+    DIFF,
+    RUN,
+    INDEX,
+    DIFF_FRAME,
+    FRAME_RUN,
+    ABOVE_RUN,
+    ABOVE_DIFF,
+    GRAY,
+    GRAY_DIFF,
+) = range(10)
+
+HEADER_SIZE = 16
+
+# The bytes of a file, memory mapped when it is on disk.
+FileData = Union[bytes, mmap.mmap]
+
+
+@dataclass
+class FrameScan:
+    """The opcodes and location of a frame, found without decoding it."""
+
+    frame_number: int
+    frame_position: int
+    frame_size: int
+    frame_type: FrameType
+    opcodes: Dict[str, int]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a JSON serializable dictionary."""
+        return {
+            "frame_number": self.frame_number,
+            "frame_position": self.frame_position,
+            "frame_size": self.frame_size,
+            "frame_type": self.frame_type.name,
+            "opcodes": self.opcodes,
+        }
+
+
+def count_opcodes(
+    data: FileData,
+    position: int,
+    pixel_count: int,
+    version: int,
+    grayscale: bool = False,
+) -> Tuple[int, List[int]]:
+    """Tokenize the opcodes of one frame, returning where it ends and the counts.
+
+    Only the leading bytes of each opcode are inspected, so no pixels are
+    reconstructed. The counts are indexed like OPCODE_NAMES.
+    """
+    counts = [0] * len(OPCODE_NAMES)
+    has_above = version >= 1
+    pixels = 0
+    try:
+        while pixels < pixel_count:
+            code = data[position]
+            if code < 0x40:
+                counts[INDEX] += 1
+                position += 1
+                pixels += 1
+            elif code < 0x80:
+                counts[GRAY_DIFF if grayscale else DIFF] += 1
+                position += 1
+                pixels += 1
+            elif code < 0xC0:
+                if has_above and not data[position + 1] & 0xC0:
+                    counts[ABOVE_DIFF] += 1
+                else:
+                    counts[DIFF_FRAME] += 1
+                position += 2
+                pixels += 1
+            elif code < 0xFE:
+                counts[RUN] += 1
+                position += 1
+                pixels += (code & 0x3F) + 1
+            elif code == 0xFE:
+                counts[GRAY if grayscale else RGB] += 1
+                position += 2 if grayscale else 4
+                pixels += 1
+            else:
+                second = data[position + 1]
+                if second & 0x80 or not has_above:
+                    counts[FRAME_RUN] += 1
+                else:
+                    counts[ABOVE_RUN] += 1
+                position += 2
+                pixels += (second & 0x7F) + 1
+    except IndexError:
+        raise ValueError("Frame ends part way through an opcode.")
+    if position > len(data):
+        raise ValueError("Frame ends part way through an opcode.")
+    if pixels != pixel_count:
+        raise ValueError("Opcodes run past the end of the frame.")
+    return position, counts
+
+
+def _frame_header_size(data: FileData, position: int) -> Tuple[FrameType, int]:
+    """Read the type of the frame at position, and the size of its header."""
+    frame_type = FrameType(data[position])
+    if frame_type in (FrameType.Motion, FrameType.Proxy):
+        return frame_type, 5
+    return frame_type, 2 if frame_type == FrameType.Tiled else 1
+
+
+def _tile_size(data: FileData, position: int) -> int:
+    """The tile size of the frame at position, or 0 if it is not tiled."""
+    return data[position + 1] if data[position] == FrameType.Tiled else 0
+
+
+def count_frame_opcodes(
+    data: FileData,
+    position: int,
+    width: int,
+    height: int,
+    version: int,
+    tile_size: int = 0,
+    grayscale: bool = False,
+) -> Tuple[int, List[int]]:
+    """Tokenize the opcodes of a frame, after the bitmap of a tiled frame."""
+    pixel_count = width * height
+    if tile_size:
+        size = bitmap_size(width, height, tile_size)
+        bitmap = bytes(data[position : position + size])
+        if len(bitmap) != size:
+            raise ValueError("Frame ends part way through its bitmap.")
+        pixel_count = count_tiles(bitmap) * tile_size * tile_size
+        position += size
+    return count_opcodes(data, position, pixel_count, version, grayscale)
+
+
+def _scan_compressed(
+    blocks: List[bytes],
+    tile_sizes: List[int],
+    compression: Compression,
+    width: int,
+    height: int,
+    version: int,
+    grayscale: bool = False,
+) -> List[List[int]]:
+    """Decompress and count the opcodes of a group of frames."""
+    counts = []
+    for block, tile_size in zip(blocks, tile_sizes):
+        opcodes = decompress(block, compression)
+        end, frame_counts = count_frame_opcodes(
+            opcodes, 0, width, height, version, tile_size, grayscale
+        )
+        if end != len(opcodes):
+            raise ValueError("Compressed frame has trailing data.")
+        counts.append(frame_counts)
+    return counts
+
+
+def _counts_dict(counts: List[int]) -> Dict[str, int]:
+    """Name the non-zero opcode counts."""
+    return {name: count for name, count in zip(OPCODE_NAMES, counts) if count}
+
+
+def _map_file(file: BufferedIOBase) -> FileData:
+    """Memory map a file, falling back to reading it for in-memory streams."""
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, UnsupportedOperation):
+        file.seek(0)
+        return file.read()
+
+
+def scan_frames(
+    file: BufferedIOBase, jobs: int = 1, opcodes: bool = True
+) -> Iterator[FrameScan]:
+    """Scan the frames of a qoiv file without reconstructing any pixels.
+
+    Uncompressed frames are tokenized in order, as the end of a frame is only
+    known once its opcodes are. Compressed and sized frames are size
+    prefixed, so they are located first and, with more than one job, whole
+    groups of pictures are decompressed and tokenized in parallel. Without
+    opcodes, size prefixed frames are only located, and reported with no
+    opcode counts. Proxy frames are skipped.
+    """
+    file.seek(0)
+    header = QovHeader.read(file)
+    data = _map_file(file)
+    try:
+        yield from _scan_data(data, header, jobs, opcodes)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def _scan_data(
+    data: FileData, header: QovHeader, jobs: int, opcodes: bool
+) -> Iterator[FrameScan]:
+    """Scan the frames following the header in the bytes of a file."""
+    position = HEADER_SIZE
+    frame_number = 0
+
+    if not header.sized:
+        while position < len(data):
+            frame_type, header_size = _frame_header_size(data, position)
+            if frame_type == FrameType.Proxy:
+                block_start = position + header_size + 4
+                if block_start > len(data):
+                    raise ValueError("Frame ends part way through its header.")
+                (size,) = struct.unpack("<I", data[block_start - 4 : block_start])
+                position = block_start + size
+                continue
+            end, counts = count_frame_opcodes(
+                data,
+                position + header_size,
+                header.width,
+                header.height,
+                header.version,
+                _tile_size(data, position),
+                header.grayscale,
+            )
+            yield FrameScan(
+                frame_number,
+                position,
+                end - position,
+                frame_type,
+                _counts_dict(counts),
+            )
+            position = end
+            frame_number += 1
+        return
+
+    def groups() -> Iterator[List[Tuple[int, int, FrameType, bytes]]]:
+        """Locate the size prefixed frames, grouped by keyframe."""
+        nonlocal position
+        group: List[Tuple[int, int, FrameType, bytes]] = []
+        while position < len(data):
+            frame_type, header_size = _frame_header_size(data, position)
+            block_start = position + header_size + 4
+            if block_start > len(data):
+                raise ValueError("Frame ends part way through its header.")
+            (size,) = struct.unpack("<I", data[position + header_size : block_start])
+            if block_start + size > len(data):
+                raise ValueError("Frame ends part way through its opcodes.")
+            if frame_type == FrameType.Proxy:
+                position = block_start + size
+                continue
+            if frame_type == FrameType.Key and group:
+                yield group
+                group = []
+            block = bytes(data[block_start : block_start + size])
+            group.append((position, block_start + size - position, frame_type, block))
+            position = block_start + size
+        if group:
+            yield group
+
+    def scan_batch(
+        batch: List[List[Tuple[int, int, FrameType, bytes]]],
+    ) -> Iterator[FrameScan]:
+        """Count the opcodes of a batch of groups, possibly in parallel."""
+        nonlocal frame_number
+        arguments = (
+            [[frame[3] for frame in group] for group in batch],
+            [[_tile_size(data, frame[0]) for frame in group] for group in batch],
+            [header.compression] * len(batch),
+            [header.width] * len(batch),
+            [header.height] * len(batch),
+            [header.version] * len(batch),
+            [header.grayscale] * len(batch),
+        )
+        results = (executor.map if executor is not None else map)(
+            _scan_compressed, *arguments
+        )
+        for group, group_counts in zip(batch, results):
+            for (frame_position, frame_size, frame_type, _), counts in zip(
+                group, group_counts
+            ):
+                yield FrameScan(
+                    frame_number,
+                    frame_position,
+                    frame_size,
+                    frame_type,
+                    _counts_dict(counts),
+                )
+                frame_number += 1
+
+    if not opcodes:
+        for group in groups():
+            for frame_position, frame_size, frame_type, _ in group:
+                yield FrameScan(
+                    frame_number, frame_position, frame_size, frame_type, {}
+                )
+                frame_number += 1
+        return
+
+    # Groups are scanned in batches to bound the compressed data held in memory.
+    batch_size = 4 * jobs
+    executor = (
+        ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("spawn"))
+        if jobs > 1
+        else None
+    )
+    try:
+        batch: List[List[Tuple[int, int, FrameType, bytes]]] = []
+        for group in groups():
+            batch.append(group)
+            if len(batch) >= batch_size:
+                yield from scan_batch(batch)
+                batch = []
+        yield from scan_batch(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+@dataclass
+class ScanSummary:
+    """Aggregated statistics over the frames of a qoiv file."""
+
+    frames: int = 0
+    total_size: int = 0
+    sizes: Dict[str, List[int]] = field(default_factory=dict)
+    opcodes: Dict[str, Counter] = field(default_factory=dict)
+    gop_sizes: List[int] = field(default_factory=list)
+
+    def add(self, frame: FrameScan) -> None:
+        """Include a frame in the summary."""
+        if frame.frame_type == FrameType.Key or not self.gop_sizes:
+            self.gop_sizes.append(0)
+        self.gop_sizes[-1] += 1
+        self.frames += 1
+        self.total_size += frame.frame_size
+        name = frame.frame_type.name
+        self.sizes.setdefault(name, []).append(frame.frame_size)
+        self.opcodes.setdefault(name, Counter()).update(frame.opcodes)
+
+    @staticmethod
+    def percentiles(values: List[int]) -> Dict[str, float]:
+        """Describe the distribution of a list of values."""
+        array = np.array(values)
+        p50, p90, p99 = np.percentile(array, [50, 90, 99])
+        return {
+            "min": int(array.min()),
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+            "max": int(array.max()),
+            "mean": float(array.mean()),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a JSON serializable dictionary."""
+        summary: Dict[str, Any] = {"frames": self.frames, "bytes": self.total_size}
+        if not self.frames:
+            return summary
+        all_sizes = [size for sizes in self.sizes.values() for size in sizes]
+        summary["frame_size"] = {"all": ScanSummary.percentiles(all_sizes)}
+        summary["frame_types"] = {}
+        summary["opcode_mix"] = {}
+        for name, sizes in self.sizes.items():
+            summary["frame_types"][name] = len(sizes)
+            summary["frame_size"][name] = ScanSummary.percentiles(sizes)
+            opcodes = self.opcodes[name]
+            total = sum(opcodes.values())
+            summary["opcode_mix"][name] = {
+                opcode: opcodes[opcode] / total for opcode in sorted(opcodes)
+            }
+        summary["gop_size"] = ScanSummary.percentiles(self.gop_sizes)
+        summary["gop_sizes"] = {
+            str(size): count for size, count in sorted(Counter(self.gop_sizes).items())
+        }
+        return summary
+
+
+def summarize(frames: Iterable[FrameScan]) -> ScanSummary:
+    """Aggregate frame scans into a summary."""
+    summary = ScanSummary()
+    for frame in frames:
+        summary.add(frame)
+    return summary
@@ -0,0 +1,252 @@
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from io import BufferedReader, BytesIO
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+import numpy as np
+from numpy.typing import NDArray
+from .decode import Decoder
+from .encode import Encoder, KeyframeDecision
+from .types import ColourSpace
+
+MANIFEST_NAME = "manifest.json"
+
+
+@dataclass
+class SegmentInfo:
+    """A segment file, holding one group of pictures."""
+
+    sequence: int
+    name: str
+    # The number, across all segments, of the segment's first frame.
+    first_frame: int
+    frames: int = 0
+    size: int = 0
+    # Whether the segment is finished, rather than still being written.
+    complete: bool = False
+
+
+@dataclass
+class Manifest:
+    """The segments of a segmented stream, oldest first."""
+
+    segments: List[SegmentInfo] = field(default_factory=list)
+    # Set once the writer is closed, so no more segments will follow.
+    ended: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a JSON serializable dictionary."""
+        return {
+            "segments": [asdict(segment) for segment in self.segments],
+            "ended": self.ended,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Manifest":
+        """Convert from a dictionary written by to_dict."""
+        return cls(
+            [SegmentInfo(**segment) for segment in data["segments"]], data["ended"]
+        )
+
+    @classmethod
+    def read(cls, path: Path) -> "Manifest":
+        """Read a manifest file."""
+        return cls.from_dict(json.loads(path.read_text()))
+
+    def write(self, path: Path) -> None:
+        """Replace a manifest file, so readers never see it part written."""
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+        os.replace(temporary, path)
+
+
+class SegmentWriter(Encoder):
+    """An encoder writing each group of pictures to its own segment file.
+
+    Every segment is a self-contained qoiv file starting with a keyframe, or
+    the proxy preceding it, so playback can start from any of them. The
+    manifest in the directory lists the segments with their frame counts and
+    sizes, and is rewritten after every frame so readers can tail the
+    segment being written. With window, only the last window complete
+    segments are kept, and older ones are deleted.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        width: int,
+        height: int,
+        colourspace: ColourSpace,
+        window: Optional[int] = None,
+        **encoder_options,
+    ):
+        """Construct a new segment writer, taking the options of Encoder."""
+        if window is not None and window < 1:
+            raise ValueError("window must be at least 1.")
+        # The header is written to each segment rather than a single file.
+        super().__init__(BytesIO(), width, height, colourspace, **encoder_options)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.window = window
+        self.manifest = Manifest()
+        self.next_sequence = 0
+
+    @property
+    def manifest_path(self) -> Path:
+        """Where the manifest is written."""
+        return self.directory / MANIFEST_NAME
+
+    def start_segment(self) -> None:
+        """Finish the current segment, and write later frames to a new one."""
+        current = self.manifest.segments[-1] if self.manifest.segments else None
+        if current is not None and current.frames == 0:
+            return
+        self.finish_segment()
+        name = f"segment-{self.next_sequence:06d}.qoiv"
+        first_frame = current.first_frame + current.frames if current else 0
+        self.manifest.segments.append(
+            SegmentInfo(self.next_sequence, name, first_frame)
+        )
+        self.next_sequence += 1
+        self.file = open(self.directory / name, "wb")
+        self.header.write(self.file)
+
+    def finish_segment(self) -> None:
+        """Close the segment being written, if any."""
+        if not self.manifest.segments or self.manifest.segments[-1].complete:
+            return
+        self.file.close()
+        self.manifest.segments[-1].complete = True
+        self.drop_old_segments()
+
+    def drop_old_segments(self) -> None:
+        """Delete the complete segments that have left the window."""
+        if self.window is None:
+            return
+        complete = [segment for segment in self.manifest.segments if segment.complete]
+        for segment in complete[: max(len(complete) - self.window, 0)]:
+            self.manifest.segments.remove(segment)
+            (self.directory / segment.name).unlink(missing_ok=True)
+
+    def next_keyframe_decision(
+        self, frame: Optional[NDArray[np.uint8]] = None
+    ) -> Optional[KeyframeDecision]:
+        """Decide if the next frame is a keyframe, starting a segment if so."""
+        decision = super().next_keyframe_decision(frame)
+        if decision is not None:
+            self.start_segment()
+        return decision
+
+    def _push(self, frame: NDArray[np.uint8]) -> None:
+        """Encode and write a frame, then publish it in the manifest."""
+        super()._push(frame)
+        self.publish_frame()
+
+    def end_frame(self) -> None:
+        """Finish a frame pushed a block of rows at a time, then publish it."""
+        super().end_frame()
+        self.publish_frame()
+
+    def publish_frame(self) -> None:
+        """Add the frame just written to the manifest."""
+        self.file.flush()
+        segment = self.manifest.segments[-1]
+        segment.frames += 1
+        segment.size = self.file.tell()
+        self.manifest.write(self.manifest_path)
+
+    def close(self) -> None:
+        """Finish the last segment, and mark the stream as ended."""
+        self.finish_segment()
+        self.manifest.ended = True
+        self.manifest.write(self.manifest_path)
+
+    def __enter__(self) -> "SegmentWriter":
+        """Use the writer as a context manager."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Close the writer."""
+        self.close()
+
+
+class SegmentReader:
+    """Decode a segmented stream by following its manifest."""
+
+    def __init__(
+        self, directory: Union[str, Path], colourspace: Optional[ColourSpace] = None
+    ):
+        """Read the stream in directory, converting frames into colourspace."""
+        self.directory = Path(directory)
+        self.colourspace = colourspace
+
+    def manifest(self) -> Manifest:
+        """Read the current manifest."""
+        return Manifest.read(self.directory / MANIFEST_NAME)
+
+    def frames(
+        self,
+        live: bool = False,
+        follow: bool = False,
+        poll_interval: float = 0.1,
+        timeout: Optional[float] = None,
+    ) -> Iterator[NDArray[np.uint8]]:
+        """Decode the frames of the stream in order.
+
+        Live starts from the newest segment rather than the oldest, so
+        playback starts within a group of pictures of the writer. Follow
+        waits for new frames, polling the manifest every poll_interval
+        seconds, until the stream ends or nothing new is published for
+        timeout seconds. Segments deleted before they are reached are skipped.
+        """
+        sequence: Optional[int] = None
+        decoder: Optional[Decoder] = None
+        file: Optional[BufferedReader] = None
+        decoded = 0
+        waited = 0.0
+        try:
+            while True:
+                try:
+                    manifest = self.manifest()
+                except FileNotFoundError:
+                    if not follow:
+                        raise
+                    # The writer has not published any frames yet.
+                    manifest = Manifest()
+                segments = manifest.segments
+                if sequence is None and segments:
+                    sequence = segments[-1 if live else 0].sequence
+                progressed = False
+                for segment in segments:
+                    if sequence is None or segment.sequence < sequence:
+                        continue
+                    if segment.sequence > sequence or decoder is None:
+                        if file is not None:
+                            file.close()
+                        sequence = segment.sequence
+                        file = open(self.directory / segment.name, "rb")
+                        decoder = Decoder(file, colourspace=self.colourspace)
+                        decoded = 0
+                    assert decoder is not None
+                    while decoded < segment.frames:
+                        frame, _ = decoder.read_frame()
+                        decoded += 1
+                        progressed = True
+                        yield frame
+                    if not segment.complete:
+                        break
+                    sequence = segment.sequence + 1
+                    decoder = None
+                if manifest.ended or not follow:
+                    return
+                if progressed:
+                    waited = 0.0
+                elif timeout is not None and waited >= timeout:
+                    return
+                time.sleep(poll_interval)
+                waited += poll_interval
+        finally:
+            if file is not None:
+                file.close()
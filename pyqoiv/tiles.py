@@ -0,0 +1,71 @@
+from typing import Tuple
+import numpy as np
+from numpy.typing import NDArray
+
+
+def tile_grid(width: int, height: int, tile_size: int) -> Tuple[int, int]:
+    """The number of tile rows and columns covering a frame."""
+    return -(-height // tile_size), -(-width // tile_size)
+
+
+def bitmap_size(width: int, height: int, tile_size: int) -> int:
+    """The bytes in the changed tile bitmap of a frame."""
+    rows, columns = tile_grid(width, height, tile_size)
+    return -(-rows * columns // 8)
+
+
+def count_tiles(bitmap: bytes) -> int:
+    """Count the changed tiles marked in a bitmap."""
+    return int.from_bytes(bitmap).bit_count()
+
+
+def pad_to_tiles(frame: NDArray[np.uint8], tile_size: int) -> NDArray[np.uint8]:
+    """Extend a frame to whole tiles by repeating its last row and column."""
+    height, width = frame.shape[:2]
+    rows, columns = tile_grid(width, height, tile_size)
+    return np.pad(
+        frame,
+        ((0, rows * tile_size - height), (0, columns * tile_size - width), (0, 0)),
+        mode="edge",
+    )
+
+
+def tile_view(padded: NDArray[np.uint8], tile_size: int) -> NDArray[np.uint8]:
+    """View a padded frame as (rows, columns, tile_size, tile_size, channels) tiles."""
+    rows, columns = padded.shape[0] // tile_size, padded.shape[1] // tile_size
+    return padded.reshape(
+        rows, tile_size, columns, tile_size, padded.shape[2]
+    ).swapaxes(1, 2)
+
+
+def gather_tiles(
+    padded: NDArray[np.uint8], changed: NDArray[np.bool_], tile_size: int
+) -> NDArray[np.uint8]:
+    """Stack the changed tiles into an image one tile wide."""
+    return tile_view(padded, tile_size)[changed].reshape(-1, tile_size, padded.shape[2])
+
+
+def scatter_tiles(
+    padded: NDArray[np.uint8],
+    changed: NDArray[np.bool_],
+    tile_size: int,
+    tiles: NDArray[np.uint8],
+) -> None:
+    """Write the stacked changed tiles back into a padded frame."""
+    tile_view(padded, tile_size)[changed] = tiles.reshape(
+        -1, tile_size, tile_size, padded.shape[2]
+    )
+
+
+def pack_bitmap(changed: NDArray[np.bool_]) -> bytes:
+    """Pack the changed tiles, in raster order, into a bitmap."""
+    return np.packbits(changed.ravel()).tobytes()
+
+
+def unpack_bitmap(
+    bitmap: bytes, width: int, height: int, tile_size: int
+) -> NDArray[np.bool_]:
+    """Unpack a bitmap into which tiles changed, by tile row and column."""
+    rows, columns = tile_grid(width, height, tile_size)
+    bits = np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8), count=rows * columns)
+    return bits.astype(np.bool_).reshape(rows, columns)
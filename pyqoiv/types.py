@@ -5,6 +5,22 @@ from io import BufferedIOBase
 from numpy.typing import NDArray
 import numpy as np
 
+# The newest format version this implementation reads and writes.
+# Version 1 adds the AboveRunOpcode and AboveDiffOpcode.
+# Version 2 adds the choice of colour hash function and hash map size.
+# Version 3 adds proxy frames, and size prefixed frames without compression.
+# Version 4 adds tiled predicted frames.
+# Version 5 adds single channel grayscale frames.
+FORMAT_VERSION = 5
+
+# Header flag marking every frame as size prefixed.
+SIZED_FRAMES = 0x1
+# Header flag marking frames as a single grayscale channel.
+GRAYSCALE = 0x2
+
+# Index opcodes have 6 bits for the index, so hash maps hold at most 64 colours.
+HASH_SIZES = (64, 32, 16, 8)
+
 
 class ColourSpace(IntEnum):
     """Enum to differentiate colour spaces."""
@@ -13,6 +29,16 @@ class ColourSpace(IntEnum):
     Linear = 1
 
 
+class Compression(IntEnum):
+    """Enum to differentiate the entropy coder applied to each frame."""
+
+    none = 0
+    zlib = 1
+    lzma = 2
+    # Requires Python 3.14 or the zstandard package.
+    zstd = 3
+
+
 class FrameType(IntEnum):
     """Enum to differentiate frame types."""
 
@@ -20,6 +46,64 @@ class FrameType(IntEnum):
     Key = 0
     # Predicted Frame types are encoded based on the previous key frame.
     Predicted = 1
+    # Motion Frame types are predicted frames where the key frame is offset by
+    # a motion vector stored in the frame header.
+    Motion = 2
+    # Proxy Frame types are downscaled, independently decodeable copies of the
+    # frame that follows them, with their size in the frame header. They are
+    # always size prefixed, and are not counted as frames of the video.
+    Proxy = 3
+    # Tiled Frame types are predicted frames that start with a bitmap of the
+    # tiles that changed from the key frame, in raster order. Only the changed
+    # tiles are coded, stacked into an image one tile wide, and the others are
+    # copied from the key frame. The tile size is stored in the frame header.
+    Tiled = 4
+
+
+class HashFunction(IntEnum):
+    """Enum to differentiate the hash functions indexing the colour hash map."""
+
+    # The QOI hash, (r * 3 + g * 5 + b * 7) % size.
+    qoi = 0
+    # Knuth's multiplicative hash of the packed colour, using the top bits.
+    multiplicative = 1
+    # Channels multiplied by distinct odd constants, xored and folded.
+    xor = 2
+
+
+def hash_index(
+    function: HashFunction,
+    r: int | np.uint8,
+    g: int | np.uint8,
+    b: int | np.uint8,
+    size: int,
+) -> int:
+    """Calculate the hash map index of a colour for any hash function."""
+    if function == HashFunction.qoi:
+        return (int(r) * 3 + int(g) * 5 + int(b) * 7) % size
+    if function == HashFunction.multiplicative:
+        packed = int(r) << 16 | int(g) << 8 | int(b)
+        return ((packed * 2654435761) & 0xFFFFFFFF) * size >> 32
+    if function == HashFunction.xor:
+        h = int(r) * 0x1F ^ int(g) * 0x3D ^ int(b) * 0x61
+        return (h ^ h >> 6) % size
+    raise ValueError("Invalid hash function")
+
+
+def hash_indices(
+    function: HashFunction, pixels: NDArray[np.uint8], size: int
+) -> NDArray[np.int64]:
+    """Calculate the hash map indices of an array of colours, shaped (N, 3)."""
+    r, g, b = (pixels[:, channel].astype(np.int64) for channel in range(3))
+    if function == HashFunction.qoi:
+        return (r * 3 + g * 5 + b * 7) % size
+    if function == HashFunction.multiplicative:
+        packed = r << 16 | g << 8 | b
+        return ((packed * 2654435761) & 0xFFFFFFFF) * size >> 32
+    if function == HashFunction.xor:
+        h = r * 0x1F ^ g * 0x3D ^ b * 0x61
+        return (h ^ h >> 6) % size
+    raise ValueError("Invalid hash function")
 
 
 @dataclass
@@ -30,7 +114,23 @@ class QovHeader:
     width: int = 640
     height: int = 480
     colourspace: ColourSpace = ColourSpace.sRGB
-    # There are 3 padding bytes after the colourspace field to align the structure to 16 bytes.
+    version: int = FORMAT_VERSION
+    # When set, each frame header is followed by the compressed size of the
+    # frame's opcodes as a 4 byte little endian integer, and then the
+    # compressed opcodes.
+    compression: Compression = Compression.none
+    # From version 3, the high nibble of the compression byte holds flags.
+    # When sized_frames is set, frames are size prefixed as if compressed even
+    # without compression, so they can be skipped without reading opcodes.
+    sized_frames: bool = False
+    # From version 5, grayscale frames have a single channel, and use the
+    # GrayOpcode and GrayDiffOpcode in place of the RgbOpcode and DiffOpcode.
+    grayscale: bool = False
+    # From version 2, the last byte holds the hash function in the low nibble
+    # and the index of the hash map size in HASH_SIZES in the next 2 bits. It
+    # was padding, always 0, before that.
+    hash_function: HashFunction = HashFunction.qoi
+    hash_size: int = 64
 
     @staticmethod
     def read(file: BufferedIOBase) -> "QovHeader":
@@ -38,31 +138,85 @@ class QovHeader:
         header_packed: bytes = file.read(16)
         if len(header_packed) != 16:
             raise ValueError(f"Invalid header size, was {len(header_packed)}")
-        magic, width, height, colourspace = struct.unpack("<4sIIBxxx", header_packed)
+        magic, width, height, colourspace, version, compression, hashing = (
+            struct.unpack("<4sIIBBBB", header_packed)
+        )
         if magic != b"qoiv":
             raise ValueError("Invalid magic number")
         if colourspace not in ColourSpace:
             raise ValueError("Invalid colourspace")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Unsupported format version {version}")
+        flags, compression = compression >> 4, compression & 0x0F
+        if compression not in Compression:
+            raise ValueError("Invalid compression")
+        if flags and version < 3:
+            raise ValueError("Header flags need format version 3")
+        if flags & ~(SIZED_FRAMES | GRAYSCALE):
+            raise ValueError("Invalid header flags")
+        if flags & GRAYSCALE and version < 5:
+            raise ValueError("Grayscale needs format version 5")
+        if hashing and version < 2:
+            raise ValueError("Hash options need format version 2")
+        if hashing & 0xC0 or (hashing & 0x0F) not in HashFunction:
+            raise ValueError("Invalid hash options")
         return QovHeader(
             magic=magic.decode("utf-8"),
             width=width,
             height=height,
             colourspace=ColourSpace(colourspace),
+            version=version,
+            compression=Compression(compression),
+            sized_frames=bool(flags & SIZED_FRAMES),
+            grayscale=bool(flags & GRAYSCALE),
+            hash_function=HashFunction(hashing & 0x0F),
+            hash_size=HASH_SIZES[hashing >> 4],
         )
 
+    @property
+    def channels(self) -> int:
+        """The number of channels in each pixel."""
+        return 1 if self.grayscale else 3
+
+    @property
+    def sized(self) -> bool:
+        """Whether every frame's opcodes are size prefixed."""
+        return self.sized_frames or self.compression != Compression.none
+
     def write(self, file: BufferedIOBase) -> None:
         """Write the header to the provided file handle."""
         if self.magic != "qoiv":
             raise ValueError("Invalid magic number")
         if self.colourspace not in ColourSpace:
             raise ValueError("Invalid colourspace")
+        if not (0 <= self.version <= FORMAT_VERSION):
+            raise ValueError(f"Unsupported format version {self.version}")
+        if self.compression not in Compression:
+            raise ValueError("Invalid compression")
+        if self.hash_function not in HashFunction:
+            raise ValueError("Invalid hash function")
+        if self.hash_size not in HASH_SIZES:
+            raise ValueError(f"Hash size must be one of {HASH_SIZES}")
+        hashing = self.hash_function | HASH_SIZES.index(self.hash_size) << 4
+        if hashing and self.version < 2:
+            raise ValueError("Hash options need format version 2")
+        if self.sized_frames and self.version < 3:
+            raise ValueError("Sized frames need format version 3")
+        if self.grayscale and self.version < 5:
+            raise ValueError("Grayscale needs format version 5")
+        flags = (SIZED_FRAMES if self.sized_frames else 0) | (
+            GRAYSCALE if self.grayscale else 0
+        )
         file.write(
             struct.pack(
-                "<4sIIBxxx",
+                "<4sIIBBBB",
                 self.magic.encode("utf-8"),
                 self.width,
                 self.height,
                 self.colourspace,
+                self.version,
+                self.compression | flags << 4,
+                hashing,
             )
         )
 
@@ -70,17 +224,29 @@ class QovHeader:
 class PixelHashMap:
     """Hash map for constant time lookup of previously used colours."""
 
-    def __init__(self, size: int = 64):
-        """Construct a fixed size hash map for colours."""
+    def __init__(
+        self,
+        size: int = 64,
+        hash_function: HashFunction = HashFunction.qoi,
+        channels: int = 3,
+    ):
+        """Construct a fixed size hash map for colours.
+
+        Grayscale values, with a single channel, are hashed as the colour with
+        that value in every channel.
+        """
         self.size = size
-        self.pixels = np.array([[0, 0, 0]] * self.size)
+        self.hash_function = hash_function
+        self.channels = channels
+        self.pixels = np.array([[0] * channels] * self.size)
+        # Which slots have been pushed to, as empty slots also hold black.
+        self.written = bytearray(self.size)
 
     def push(self, pixel: NDArray[np.uint8]) -> int:
         """Push a pixel into the hash map."""
-        r, g, b = pixel
-
-        index = self.index_of(r, g, b)
+        index = self.index_of_pixel(pixel)
         self.pixels[index] = pixel
+        self.written[index] = 1
         return index
 
     def __getitem__(self, index: int) -> NDArray[np.uint8]:
@@ -91,16 +257,29 @@ class PixelHashMap:
 
     def __contains__(self, pixel: NDArray[np.uint8]) -> bool:
         """Check the colour is in the map"""
-        r, g, b = pixel
-        return PixelHashMap.pixel_equal(self.pixels[self.index_of(r, g, b)], pixel)
+        held = self.pixels[self.index_of_pixel(pixel)]
+        if self.channels == 1:
+            return held[0] == pixel[0]
+        return PixelHashMap.pixel_equal(held, pixel)
 
     def clear(self):
         """Clear the hash map."""
         self.pixels.fill(0)
+        self.written = bytearray(self.size)
 
     def index_of(self, r: int | np.uint8, g: int | np.uint8, b: int | np.uint8) -> int:
         """Calculate the index of a pixel in the hash map."""
-        return (r * 3 + g * 5 + b * 7) % self.size
+        if self.hash_function == HashFunction.qoi:
+            return (int(r) * 3 + int(g) * 5 + int(b) * 7) % self.size
+        return hash_index(self.hash_function, r, g, b, self.size)
+
+    def index_of_pixel(self, pixel: NDArray[np.uint8]) -> int:
+        """Calculate the index of a colour or grayscale pixel in the hash map."""
+        if self.channels == 1:
+            value = pixel[0]
+            return self.index_of(value, value, value)
+        r, g, b = pixel
+        return self.index_of(r, g, b)
 
     @staticmethod
     def pixel_equal(a: NDArray[np.uint8], b: NDArray[np.uint8]) -> bool:
@@ -113,6 +292,15 @@ class QovFrameHeader:
     """Header for a single frame."""
 
     frame_type: FrameType
+    # Motion vector, only stored for Motion frames. Pixel (x, y) is predicted
+    # from pixel (x + dx, y + dy) of the key frame, clamped to the frame edges.
+    dx: int = 0
+    dy: int = 0
+    # Dimensions, only stored for Proxy frames.
+    width: int = 0
+    height: int = 0
+    # Tile width and height, only stored for Tiled frames.
+    tile_size: int = 0
 
     @staticmethod
     def read(file: BufferedIOBase) -> "QovFrameHeader":
@@ -120,8 +308,31 @@ class QovFrameHeader:
         frame_type = FrameType(int.from_bytes(file.read(1)))
         if frame_type not in FrameType:
             raise ValueError("Invalid frame type")
+        if frame_type == FrameType.Proxy:
+            size = file.read(4)
+            if len(size) != 4:
+                raise ValueError("Invalid proxy frame size")
+            width, height = struct.unpack("<HH", size)
+            return QovFrameHeader(frame_type=frame_type, width=width, height=height)
+        if frame_type == FrameType.Tiled:
+            tile_size = int.from_bytes(file.read(1))
+            if not tile_size:
+                raise ValueError("Invalid tile size")
+            return QovFrameHeader(frame_type=frame_type, tile_size=tile_size)
+        if frame_type == FrameType.Motion:
+            motion = file.read(4)
+            if len(motion) != 4:
+                raise ValueError("Invalid motion vector")
+            dx, dy = struct.unpack("<hh", motion)
+            return QovFrameHeader(frame_type=frame_type, dx=dx, dy=dy)
         return QovFrameHeader(frame_type=frame_type)
 
     def write(self, file: BufferedIOBase):
         """Write the frame header to the provided file handle."""
         file.write(struct.pack("<B", self.frame_type))
+        if self.frame_type == FrameType.Motion:
+            file.write(struct.pack("<hh", self.dx, self.dy))
+        if self.frame_type == FrameType.Proxy:
+            file.write(struct.pack("<HH", self.width, self.height))
+        if self.frame_type == FrameType.Tiled:
+            file.write(struct.pack("<B", self.tile_size))
@@ -0,0 +1,64 @@
+from typing import BinaryIO
+import numpy as np
+from numpy.typing import NDArray
+
+# BT.601 studio swing RGB to YCbCr, as assumed by YUV4MPEG2 readers.
+RGB_TO_YCBCR = np.array(
+    [
+        [65.481, 128.553, 24.966],
+        [-37.797, -74.203, 112.0],
+        [112.0, -93.786, -18.214],
+    ],
+    dtype=np.float32,
+) / np.float32(255)
+YCBCR_OFFSET = np.array([16, 128, 128], dtype=np.float32)
+
+
+def rgb_to_ycbcr444(frame: NDArray[np.uint8]) -> NDArray[np.uint8]:
+    """Convert an RGB frame into planar 4:4:4 YCbCr, shaped (3, height, width)."""
+    ycbcr = frame.astype(np.float32) @ RGB_TO_YCBCR.T + YCBCR_OFFSET
+    planar = np.rint(ycbcr).clip(0, 255).astype(np.uint8)
+    return np.ascontiguousarray(planar.transpose(2, 0, 1))
+
+
+def gray_to_luma(frame: NDArray[np.uint8]) -> NDArray[np.uint8]:
+    """Convert a grayscale frame into studio swing luma, shaped (height, width)."""
+    luma = frame[..., 0].astype(np.float32) * np.float32(219 / 255) + np.float32(16)
+    return np.rint(luma).astype(np.uint8)
+
+
+class Y4mWriter:
+    """Write frames as a YUV4MPEG2 stream, which many tools read from a pipe."""
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        width: int,
+        height: int,
+        frame_rate: int = 30,
+        channels: int = 3,
+    ):
+        """Construct a new writer, writing the stream header.
+
+        Frames with a single channel are written as luma only, in mono.
+        """
+        if channels not in (1, 3):
+            raise ValueError("channels must be 1 or 3.")
+        self.file = file
+        self.width = width
+        self.height = height
+        self.channels = channels
+        colour = "mono" if channels == 1 else "444"
+        file.write(
+            f"YUV4MPEG2 W{width} H{height} F{frame_rate}:1 Ip A1:1 C{colour}\n".encode()
+        )
+
+    def write(self, frame: NDArray[np.uint8]) -> None:
+        """Write a RGB or grayscale frame."""
+        if frame.shape != (self.height, self.width, self.channels):
+            raise ValueError("Frame does not match the stream dimensions.")
+        self.file.write(b"FRAME\n")
+        if self.channels == 1:
+            self.file.write(gray_to_luma(frame).data)
+        else:
+            self.file.write(rgb_to_ycbcr444(frame).data)
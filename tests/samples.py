@@ -1,6 +1,7 @@
 from typing import Callable, Generator
 import numpy as np
 from numpy.typing import NDArray
+from pyqoiv.bench import add_noise, create_pan_clip
 from pyqoiv.types import ColourSpace
 
 
@@ -50,13 +51,57 @@ def create_ball_video(
     return ball_video
 
 
+def create_panning_video(
+    width: int, height: int, frames: int, speed: int = 3
+) -> Callable[[], Generator[NDArray[np.uint8]]]:
+    """Create a video panning horizontally across a blocky random texture."""
+    return create_pan_clip(width, height, frames, speed, seed=0)
+
+
+def create_striped_video(
+    width: int, height: int, frames: int
+) -> Callable[[], Generator[NDArray[np.uint8]]]:
+    """Create a video of vertical stripes, with a row that drifts slightly."""
+    rng = np.random.default_rng(1)
+    row = rng.integers(0, 250, size=(1, width, 3), dtype=np.uint8)
+
+    def stripes():
+        for i in range(frames):
+            frame = np.repeat(row, height, axis=0)
+            frame[i % height] += np.uint8(i % 5)
+            yield frame
+
+    return stripes
+
+
+def create_noisy_video(
+    width: int, height: int, frames: int, noise: int = 3
+) -> Callable[[], Generator[NDArray[np.uint8]]]:
+    """Create a ball video with sensor-like noise added to every pixel."""
+    return add_noise(create_ball_video(width, height, frames), noise, seed=2)
+
+
+def to_grayscale(
+    video: Callable[[], Generator[NDArray[np.uint8]]],
+) -> Callable[[], Generator[NDArray[np.uint8]]]:
+    """Convert a video to single channel frames, shaped (height, width, 1)."""
+
+    def gray():
+        for frame in video():
+            yield frame.mean(axis=2, keepdims=True).astype(np.uint8)
+
+    return gray
+
+
 short_test_sequences = [
     # Keyframe only
     (create_scanning_line(64, 20), 64, 1, 20, ColourSpace.sRGB, None),
     (create_static_video(64, 64, 20), 64, 64, 20, ColourSpace.sRGB, None),
     (create_ball_video(64, 64, 20), 64, 64, 20, ColourSpace.sRGB, None),
+    (create_striped_video(32, 16, 10), 32, 16, 10, ColourSpace.sRGB, None),
     # With inter frames
     (create_scanning_line(6, 200), 6, 1, 200, ColourSpace.sRGB, 6),
     (create_static_video(64, 64, 20), 64, 64, 20, ColourSpace.sRGB, 6),
     (create_ball_video(64, 64, 20), 64, 64, 20, ColourSpace.sRGB, 6),
+    (create_striped_video(32, 16, 10), 32, 16, 10, ColourSpace.sRGB, 6),
 ]
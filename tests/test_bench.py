@@ -0,0 +1,57 @@
+from pathlib import Path
+from pyqoiv.bench import (
+    CLIPS,
+    BenchResult,
+    compare_to_baseline,
+    load_baseline,
+    run_benchmark,
+    save_baseline,
+)
+import pytest
+
+# Regenerate with:
+# pyqoiv bench --resolution 16x16 --resolution 32x24 --frames 6
+#   --keyframe-interval 3 --baseline tests/baselines/bench.json
+#   --update-baseline --no-record-speed
+BASELINE = Path(__file__).parent / "baselines" / "bench.json"
+
+
+@pytest.mark.parametrize("resolution", [(16, 16), (32, 24)])
+@pytest.mark.parametrize("clip", list(CLIPS))
+def test_benchmark_against_baseline(clip: str, resolution):
+    width, height = resolution
+    result = run_benchmark(clip, width, height, 6, keyframe_interval=3)
+    baseline = load_baseline(BASELINE)
+
+    assert result.name in baseline, "Benchmark is missing from the baseline."
+    # Speeds depend on the machine, so only compression is checked here.
+    assert compare_to_baseline([result], baseline, speed_tolerance=None) == []
+    assert sum(result.opcodes.values()) > 0
+    assert result.encode_fps > 0 and result.decode_fps > 0
+
+
+def make_result(encoded_bytes: int, seconds: float) -> BenchResult:
+    return BenchResult("static", 8, 8, 10, 1920, encoded_bytes, seconds, seconds)
+
+
+def test_compare_to_baseline_finds_regressions():
+    baseline = {
+        "static-8x8": {"compression_ratio": 10.0, "encode_fps": 100, "decode_fps": 100}
+    }
+    assert compare_to_baseline([make_result(192, 0.1)], baseline) == []
+    assert compare_to_baseline([make_result(100, 0.12)], baseline) == []
+
+    regressions = compare_to_baseline([make_result(200, 0.2)], baseline)
+    assert len(regressions) == 3
+    assert "compression ratio" in regressions[0]
+    assert compare_to_baseline([make_result(192, 0.2)], baseline, None) == []
+
+
+def test_save_baseline_merges_entries(tmp_path: Path):
+    path = tmp_path / "baseline.json"
+    save_baseline(path, [make_result(192, 0.1)])
+    save_baseline(path, [run_benchmark("noise", 4, 4, 2)], include_speed=False)
+
+    baseline = load_baseline(path)
+    assert baseline["static-8x8"]["encode_fps"] == pytest.approx(100)
+    assert baseline["noise-4x4"].keys() == {"compression_ratio"}
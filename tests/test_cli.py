@@ -0,0 +1,24 @@
+from io import BytesIO
+from pyqoiv.cli import readinto_exact
+import numpy as np
+import pytest
+
+
+class ChunkedStream(BytesIO):
+    """A stream that returns at most a few bytes per read, like a pipe."""
+
+    def readinto(self, buffer, /) -> int:
+        return super().readinto(memoryview(buffer)[:5])
+
+
+def test_readinto_exact():
+    data = bytes(range(24))
+    stream = ChunkedStream(data * 2)
+    frame = np.zeros((2, 4, 3), dtype=np.uint8)
+    assert readinto_exact(stream, frame)
+    assert frame.tobytes() == data
+    assert readinto_exact(stream, frame)
+    assert not readinto_exact(stream, frame)
+
+    with pytest.raises(ValueError):
+        readinto_exact(ChunkedStream(data[:10]), frame)
@@ -0,0 +1,37 @@
+from pyqoiv.colour import (
+    LINEAR_TO_SRGB,
+    SRGB_TO_LINEAR,
+    conversion_table,
+    convert,
+    linear_to_srgb,
+    srgb_to_linear,
+)
+from pyqoiv.types import ColourSpace
+import numpy as np
+
+
+def test_transfer_functions_invert():
+    values = np.linspace(0, 1, 101, dtype=np.float64)
+    assert np.allclose(linear_to_srgb(srgb_to_linear(values)), values)
+    assert np.isclose(srgb_to_linear(np.array([0.5]))[0], 0.214041)
+
+
+def test_tables():
+    for table in (SRGB_TO_LINEAR, LINEAR_TO_SRGB):
+        assert table[0] == 0 and table[255] == 255
+        assert np.all(np.diff(table.astype(np.int16)) >= 0)
+    assert SRGB_TO_LINEAR[128] == 55
+    assert LINEAR_TO_SRGB[55] == 128
+    assert conversion_table(ColourSpace.sRGB, ColourSpace.sRGB) is None
+    assert conversion_table(ColourSpace.Linear, ColourSpace.sRGB) is LINEAR_TO_SRGB
+
+
+def test_convert():
+    frame = np.array([[[0, 128, 255]]], dtype=np.uint8)
+    assert convert(frame, ColourSpace.sRGB, ColourSpace.sRGB) is frame
+    converted = convert(frame, ColourSpace.sRGB, ColourSpace.Linear)
+    assert converted.tolist() == [[[0, 55, 255]]]
+    assert frame.tolist() == [[[0, 128, 255]]]
+
+    assert convert(frame, ColourSpace.sRGB, ColourSpace.Linear, out=frame) is frame
+    assert frame.tolist() == [[[0, 55, 255]]]
@@ -0,0 +1,95 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import pickle
+import numpy as np
+import pytest
+from pyqoiv.dataset import QoivDataset, SharedFrame
+from pyqoiv.encode import Encoder
+from pyqoiv.types import ColourSpace, Compression
+from .samples import create_ball_video, create_striped_video
+
+
+def write(path, video, width: int, height: int, **options):
+    with open(path, "wb") as file:
+        encoder = Encoder(file, width, height, ColourSpace.sRGB, **options)
+        for frame in video():
+            encoder.push(frame)
+        encoder.flush()
+    return list(video())
+
+
+@pytest.fixture
+def clips(tmp_path):
+    frames = write(
+        tmp_path / "ball.qoiv",
+        create_ball_video(32, 32, 10),
+        32,
+        32,
+        keyframe_interval=3,
+    )
+    frames += write(
+        tmp_path / "stripes.qoiv",
+        create_striped_video(16, 16, 5),
+        16,
+        16,
+        keyframe_interval=2,
+        compression=Compression.zlib,
+    )
+    return [tmp_path / "ball.qoiv", tmp_path / "stripes.qoiv"], frames
+
+
+def test_random_access(clips):
+    paths, frames = clips
+    with QoivDataset(paths, key_cache_bytes=4096) as dataset:
+        assert len(dataset) == 15
+        order = np.random.default_rng(0).permutation(len(dataset))
+        for index in order:
+            assert np.array_equal(dataset[int(index)], frames[index])
+        assert np.array_equal(dataset[-1], frames[-1])
+        assert dataset.locate(11) == (1, 1)
+        assert 0 < dataset.key_cache.bytes <= 4096
+        with pytest.raises(IndexError):
+            dataset[15]
+
+
+def test_uncached_random_access(clips):
+    paths, frames = clips
+    with QoivDataset(paths, key_cache_bytes=0) as dataset:
+        for index in (4, 2, 12, 0):
+            assert np.array_equal(dataset[index], frames[index])
+        assert len(dataset.key_cache) == 0
+
+
+def test_cached_keyframes_are_not_modified(clips):
+    paths, frames = clips
+    with QoivDataset(paths) as dataset:
+        dataset[0][...] = 0
+        assert np.array_equal(dataset[0], frames[0])
+        assert np.array_equal(dataset[1], frames[1])
+
+
+def test_shared_memory_frames(clips):
+    paths, frames = clips
+    with QoivDataset(paths, shared_memory=True, ring_size=4) as dataset:
+        shared = dataset[2]
+        assert isinstance(shared, SharedFrame)
+        pickled = pickle.dumps(shared)
+        assert len(pickled) < 200
+        assert np.array_equal(np.asarray(pickle.loads(pickled)), frames[2])
+
+
+def test_workers_return_shared_frames(clips):
+    paths, frames = clips
+    dataset = QoivDataset(paths, shared_memory=True)
+    pool = multiprocessing.get_context("spawn").Pool(2)
+    try:
+        shared = pool.map(dataset.__getitem__, range(len(dataset)))
+        for frame, expected in zip(shared, frames):
+            assert np.array_equal(frame.array, expected)
+    finally:
+        pool.close()
+        pool.join()
+    # Workers remove their blocks as they exit.
+    for name in {frame.name for frame in shared}:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name)
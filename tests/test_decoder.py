@@ -1,5 +1,6 @@
 from io import BytesIO
-from pyqoiv.decode import Decoder
+import pytest
+from pyqoiv.decode import DecodeMode, Decoder, KeyFrameCache
 import numpy as np
 from pyqoiv.types import QovHeader, QovFrameHeader, FrameType, PixelHashMap
 from pyqoiv.opcodes import (
@@ -8,8 +9,13 @@ from pyqoiv.opcodes import (
     RunOpcode,
     RgbOpcode,
     IndexOpcode,
+    AboveRunOpcode,
+    AboveDiffOpcode,
 )
-from pyqoiv.encode import EncodedFrame
+from pyqoiv.encode import EncodedFrame, Encoder
+from pyqoiv.metrics import Metrics
+from pyqoiv.types import ColourSpace
+from .samples import create_ball_video
 
 
 def test_decoder_decodes_flat_frame_as_expected():
@@ -30,6 +36,19 @@ def test_decoder_decodes_flat_frame_as_expected():
     )
 
 
+def test_decoder_stops_at_end_of_file():
+    file = BytesIO()
+    QovHeader(width=2, height=2).write(file)
+    for _ in range(3):
+        EncodedFrame(
+            header=QovFrameHeader(frame_type=FrameType.Key),
+            opcodes=[RgbOpcode(1, 2, 3), RunOpcode(3)],
+        ).write(file)
+    file.seek(0)
+    frames = [frame for frame, _ in Decoder(file)]
+    assert len(frames) == 3
+
+
 def test_decoder_decodes_diff_frame_as_expected():
     file = BytesIO()
     QovHeader(width=3, height=1).write(file)
@@ -195,3 +214,112 @@ def test_decoder_decodes_diff_frame_frame_as_expected():
         np.array([[[4, 4, 4], [2, 2, 2], [3, 3, 3], [4, 4, 4]]]),
         frame,
     )
+
+
+def test_decoder_decodes_above_opcodes_as_expected():
+    file = BytesIO()
+    QovHeader(width=2, height=3).write(file)
+    EncodedFrame(
+        header=QovFrameHeader(frame_type=FrameType.Key),
+        opcodes=[
+            RgbOpcode(10, 10, 10),
+            RgbOpcode(20, 20, 20),
+            AboveRunOpcode(run=2),
+            AboveDiffOpcode(diff=5, dr=-2, dg=0, db=1),
+            AboveDiffOpcode(diff=-1, dr=0, dg=0, db=0),
+        ],
+    ).write(file)
+    file.seek(0)
+    decoder = Decoder(file)
+    frame, details = next(decoder)
+    assert np.array_equal(
+        np.array(
+            [
+                [[10, 10, 10], [20, 20, 20]],
+                [[10, 10, 10], [20, 20, 20]],
+                [[13, 15, 16], [19, 19, 19]],
+            ]
+        ),
+        frame,
+    )
+    assert details["above_run"] == 1
+    assert details["above_diff"] == 2
+
+
+def test_decoder_random_access_and_reverse():
+    video = create_ball_video(16, 16, 9)
+    file = BytesIO()
+    encoder = Encoder(file, 16, 16, ColourSpace.sRGB, keyframe_interval=3)
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+    file.seek(0)
+    expected = list(video())
+
+    decoder = Decoder(file)
+    assert decoder.frame_count == 9
+    reversed_frames = list(decoder.reverse())
+    assert all(np.array_equal(a, b) for a, b in zip(reversed_frames, expected[::-1]))
+    assert len(decoder.key_cache) == 3
+    assert all(
+        np.array_equal(a, b) for a, b in zip(decoder.frames(1, None, 3), expected[1::3])
+    )
+    decoder.frame(4)
+    frame, _ = next(decoder)
+    assert np.array_equal(frame, expected[5])
+
+    size = KeyFrameCache.size_of(next(iter(decoder.key_cache.entries.values())))
+    file.seek(0)
+    decoder = Decoder(file, key_cache_bytes=size * 2 + 1)
+    list(decoder.reverse())
+    assert len(decoder.key_cache) == 2
+    assert decoder.key_cache.bytes == size * 2
+
+
+def test_decoder_skips_frames():
+    video = create_ball_video(16, 16, 10)
+    file = BytesIO()
+    encoder = Encoder(file, 16, 16, ColourSpace.sRGB, keyframe_interval=3)
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+    file.seek(0)
+    expected = list(video())
+
+    metrics = Metrics("decoder")
+    decoder = Decoder(file, metrics=metrics)
+    numbers = decoder.keyframe_numbers()
+    keyframes = list(decoder.keyframes())
+    assert numbers == [0, 4, 8]
+    assert all(
+        np.array_equal(frame, expected[n]) for n, frame in zip(numbers, keyframes)
+    )
+    assert sum(metrics.frames.values()) == 3
+
+    stepped = list(decoder.iter(step=4))
+    assert all(np.array_equal(a, b) for a, b in zip(stepped, expected[::4]))
+    assert len(stepped) == 3
+    # The key frames were cached, so are not decoded again.
+    assert sum(metrics.frames.values()) == 3
+
+
+@pytest.mark.parametrize("mode", list(DecodeMode))
+@pytest.mark.parametrize("version, ending", [(5, b"\x80\x40"), (0, b"\xff\x00")])
+def test_decoder_rejects_invalid_reference_opcodes(
+    mode: DecodeMode, version: int, ending: bytes
+):
+    file = BytesIO()
+    QovHeader(width=2, height=1, version=version).write(file)
+    EncodedFrame(
+        header=QovFrameHeader(frame_type=FrameType.Key),
+        opcodes=[RgbOpcode(1, 1, 1), RgbOpcode(2, 2, 2)],
+    ).write(file)
+    EncodedFrame(
+        header=QovFrameHeader(frame_type=FrameType.Predicted),
+        opcodes=[RgbOpcode(3, 3, 3)],
+    ).write(file)
+    file.write(ending)
+    file.seek(0)
+
+    with pytest.raises(ValueError, match="Invalid"):
+        list(Decoder(file, mode=mode))
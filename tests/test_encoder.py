@@ -1,6 +1,15 @@
-from pyqoiv.encode import EncodedFrame, Encoder
+from pyqoiv.encode import EncodedFrame, Encoder, EncoderPreset, KeyframeReason
 from pyqoiv.types import QovFrameHeader, FrameType, ColourSpace, PixelHashMap
-from pyqoiv.opcodes import IndexOpcode, RgbOpcode, RunOpcode, DiffOpcode, Opcode
+from pyqoiv.opcodes import (
+    IndexOpcode,
+    RgbOpcode,
+    RunOpcode,
+    DiffOpcode,
+    Opcode,
+    AboveRunOpcode,
+    AboveDiffOpcode,
+    DiffFrameOpcode,
+)
 from io import BufferedIOBase, BytesIO
 from typing import Callable, Generator, Optional
 import numpy as np
@@ -142,3 +151,110 @@ def test_encoder_uses_index_opcode_as_expected():
     assert isinstance(encoded_frame.opcodes[0], RgbOpcode)
     assert isinstance(encoded_frame.opcodes[1], RgbOpcode)
     assert isinstance(encoded_frame.opcodes[2], IndexOpcode)
+
+
+def test_encoder_uses_above_opcodes_for_vertical_structure():
+    rng = np.random.default_rng(0)
+    row = rng.integers(0, 256, size=(1, 16, 3), dtype=np.uint8)
+    frame = np.repeat(row, 4, axis=0)
+    frame[3] += 3
+    encoder = Encoder(BytesIO(), width=16, height=4, colourspace=ColourSpace.sRGB)
+    encoded_frame = encoder.encode_keyframe(frame, PixelHashMap())
+    assert sum(isinstance(op, AboveRunOpcode) for op in encoded_frame.opcodes) == 2
+    assert any(isinstance(op, AboveDiffOpcode) for op in encoded_frame.opcodes)
+
+    encoder = Encoder(
+        BytesIO(), width=16, height=4, colourspace=ColourSpace.sRGB, version=0
+    )
+    encoded_v0 = encoder.encode_keyframe(frame, PixelHashMap())
+    assert not any(
+        isinstance(op, (AboveRunOpcode, AboveDiffOpcode)) for op in encoded_v0.opcodes
+    )
+    assert len(encoded_frame) < len(encoded_v0)
+
+
+def test_encoder_places_keyframes_on_scene_changes():
+    width, height = 16, 16
+    scene_a = np.zeros((height, width, 3), dtype=np.uint8)
+    scene_b = np.full((height, width, 3), 200, dtype=np.uint8)
+    frames = [scene_a] * 4 + [scene_b] + [scene_a] * 8
+    encoder = Encoder(
+        BytesIO(),
+        width,
+        height,
+        ColourSpace.sRGB,
+        keyframe_interval=6,
+        scene_change_threshold=0.5,
+        min_keyframe_interval=2,
+    )
+    for frame in frames:
+        encoder.push(frame)
+    encoder.push(scene_a)
+    assert [(d.frame, d.reason) for d in encoder.keyframe_decisions] == [
+        (0, KeyframeReason.First),
+        (4, KeyframeReason.SceneChange),
+        # Frame 5 is too soon after the last keyframe to cut
+        (6, KeyframeReason.SceneChange),
+        (13, KeyframeReason.Interval),
+    ]
+    assert encoder.keyframe_decisions[1].changed_ratio == 1.0
+
+    encoder.trigger_keyframe()
+    encoder.push(scene_a)
+    assert encoder.keyframe_decisions[-1].reason == KeyframeReason.Forced
+
+
+def test_encoder_changed_ratio():
+    a = np.zeros((8, 8, 3), dtype=np.uint8)
+    b = a.copy()
+    b[:4] = 1
+    assert Encoder.changed_ratio(a, a) == 0.0
+    assert Encoder.changed_ratio(a, b, stride=1) == 0.5
+
+
+@pytest.mark.parametrize("preset", list(EncoderPreset))
+def test_encoder_presets_limit_searches(preset: EncoderPreset):
+    encoder = Encoder(
+        BytesIO(), width=4, height=1, colourspace=ColourSpace.sRGB, preset=preset
+    )
+    key_frame = np.array([[[10, 10, 10], [50, 60, 70], [90, 90, 90], [0, 0, 0]]])
+    key_pixels = PixelHashMap()
+    encoder.encode_keyframe(key_frame, key_pixels)
+    frame = np.array([[[90, 90, 90], [50, 60, 70], [11, 9, 10], [8, 9, 10]]])
+    encoded = encoder.encode_predicted(
+        frame, PixelHashMap(), key_frame.reshape(-1, 3), key_pixels
+    )
+    diff_frames = [op for op in encoded.opcodes if isinstance(op, DiffFrameOpcode)]
+    match preset:
+        case EncoderPreset.fast:
+            # Only the exact match at the same position
+            assert len(diff_frames) == 1
+        case EncoderPreset.balanced:
+            # Adds the exact match in the key frame's hash map
+            assert len(diff_frames) == 2
+        case EncoderPreset.small:
+            # Adds the near match in the hash map, and the offset diff
+            assert len(diff_frames) == 4
+    assert encoder.preset == preset
+
+
+def test_encoder_buffer_pool():
+    encoder = Encoder(BytesIO(), 4, 4, ColourSpace.sRGB, 2, buffer_pool_size=2)
+    first = encoder.acquire_buffer()
+    second = encoder.acquire_buffer()
+    with pytest.raises(RuntimeError):
+        encoder.acquire_buffer()
+    first[:] = 10
+    encoder.push(first)
+    encoder.release_buffer(second)
+
+    # The keyframe is owned by the encoder, so reusing the buffer is safe
+    reused = encoder.acquire_buffer()
+    reused[:] = 20
+    assert np.all(encoder.key_frame == 10)
+    assert not np.shares_memory(encoder.key_frame, reused)
+    encoder.push(reused)
+    assert len(encoder.pool.free) == 2
+
+    with pytest.raises(ValueError):
+        encoder.release_buffer(np.zeros((4, 4, 3), dtype=np.uint8))
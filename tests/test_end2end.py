@@ -1,14 +1,25 @@
-from pyqoiv.encode import Encoder
-from pyqoiv.decode import Decoder
-from pyqoiv.types import ColourSpace
+from pyqoiv.encode import Encoder, EncoderPreset, downscale
+from pyqoiv.colour import LINEAR_TO_SRGB, SRGB_TO_LINEAR
+from pyqoiv.decode import READ_CHUNK, DecodeMode, Decoder
+from pyqoiv.entropy import is_available
+from pyqoiv.layout import PixelFormat, PixelLayout
+from pyqoiv.metrics import Metrics
+from pyqoiv.types import ColourSpace, Compression, HashFunction
 import numpy as np
 from numpy.typing import NDArray
 from typing import Generator, Optional, Callable
 from io import BytesIO
 import pytest
-from .samples import short_test_sequences
+from .samples import (
+    short_test_sequences,
+    create_panning_video,
+    create_noisy_video,
+    create_ball_video,
+    to_grayscale,
+)
 
 
+@pytest.mark.parametrize("preset", list(EncoderPreset))
 @pytest.mark.parametrize(
     "video, width, height, frames, colourspace, keyframe_interval",
     short_test_sequences,
@@ -20,9 +31,12 @@ def test_end_to_end(
     frames: int,
     colourspace: ColourSpace,
     keyframe_interval: Optional[int],
+    preset: EncoderPreset,
 ):
     file = BytesIO()
-    encoder = Encoder(file, width, height, colourspace, keyframe_interval)
+    encoder = Encoder(
+        file, width, height, colourspace, keyframe_interval, preset=preset
+    )
     for frame in video():
         encoder.push(frame)
 
@@ -36,3 +50,459 @@ def test_end_to_end(
         assert np.array_equal(input_frame, frame), (
             "Decoded frame does not match input frame."
         )
+
+
+def test_end_to_end_motion():
+    video = create_panning_video(64, 32, 10)
+    file = BytesIO()
+    encoder = Encoder(
+        file, 64, 32, ColourSpace.sRGB, keyframe_interval=10, motion_search_range=16
+    )
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+    motion_size = file.tell()
+
+    file.seek(0)
+    decoder = Decoder(file)
+    for input_frame, (frame, details) in zip(video(), decoder):
+        assert np.array_equal(input_frame, frame)
+
+    plain = BytesIO()
+    encoder = Encoder(plain, 64, 32, ColourSpace.sRGB, keyframe_interval=10)
+    for frame in video():
+        encoder.push(frame)
+    assert motion_size < plain.tell()
+
+
+@pytest.mark.parametrize("tolerance", [1, (2, 1, 3)])
+def test_end_to_end_near_lossless(tolerance):
+    video = create_noisy_video(32, 32, 8)
+    sizes = []
+    for tol in (0, tolerance):
+        file = BytesIO()
+        encoder = Encoder(file, 32, 32, ColourSpace.sRGB, 4, tolerance=tol)
+        for frame in video():
+            encoder.push(frame)
+        sizes.append(file.tell())
+
+    file.seek(0)
+    limit = np.broadcast_to(np.array(tolerance), (3,))
+    for input_frame, (frame, _) in zip(video(), Decoder(file)):
+        error = np.abs(input_frame.astype(np.int16) - frame)
+        assert np.all(error <= limit)
+    assert sizes[1] < sizes[0]
+
+
+@pytest.mark.parametrize("compression", list(Compression))
+def test_end_to_end_compression(compression: Compression):
+    if not is_available(compression):
+        pytest.skip(f"{compression.name} is not available")
+    video = create_ball_video(64, 64, 10)
+    file = BytesIO()
+    encoder = Encoder(file, 64, 64, ColourSpace.sRGB, 4, compression=compression)
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+    size = file.tell()
+
+    file.seek(0)
+    decoder = Decoder(file)
+    assert decoder.header.compression == compression
+    decoded = [decoder.read_frame() for _ in range(10)]
+    for input_frame, (frame, _) in zip(video(), decoded):
+        assert np.array_equal(input_frame, frame)
+    assert file.tell() == size
+
+
+@pytest.mark.parametrize("hash_size", [64, 8])
+@pytest.mark.parametrize("hash_function", list(HashFunction))
+def test_end_to_end_hash_options(hash_function: HashFunction, hash_size: int):
+    video = create_noisy_video(32, 32, 6)
+    file = BytesIO()
+    encoder = Encoder(
+        file,
+        32,
+        32,
+        ColourSpace.sRGB,
+        3,
+        hash_function=hash_function,
+        hash_size=hash_size,
+    )
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+
+    file.seek(0)
+    for input_frame, (frame, _) in zip(video(), Decoder(file)):
+        assert np.array_equal(input_frame, frame)
+
+
+@pytest.mark.parametrize("compression", [Compression.none, Compression.zlib])
+@pytest.mark.parametrize("proxy_interval", [None, 2])
+def test_end_to_end_proxies(compression: Compression, proxy_interval: Optional[int]):
+    video = create_ball_video(32, 24, 7)
+    file = BytesIO()
+    encoder = Encoder(
+        file,
+        32,
+        24,
+        ColourSpace.sRGB,
+        keyframe_interval=3,
+        compression=compression,
+        proxy_scale=4,
+        proxy_interval=proxy_interval,
+    )
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+    file.seek(0)
+
+    decoder = Decoder(file)
+    assert decoder.header.sized
+    expected = list(video())
+    decoded = [frame for frame, _ in decoder]
+    assert all(np.array_equal(a, b) for a, b in zip(decoded, expected))
+    assert len(decoded) == 7
+    assert decoder.frame_count == 7
+
+    proxies = list(decoder.proxies())
+    numbers = [0, 4] if proxy_interval is None else [0, 2, 4, 6]
+    assert [number for number, _ in proxies] == numbers
+    for number, proxy in proxies:
+        assert np.array_equal(proxy, downscale(expected[number], 4))
+        assert proxy.shape == (6, 8, 3)
+
+
+def test_truncated_proxy_files_raise_value_error():
+    file = BytesIO()
+    encoder = Encoder(file, 16, 8, ColourSpace.sRGB, keyframe_interval=2, proxy_scale=4)
+    for frame in create_ball_video(16, 8, 3)():
+        encoder.push(frame)
+    data = file.getvalue()
+
+    for end in range(16, len(data)):
+        decoder = Decoder(BytesIO(data[:end]))
+        for frames in (lambda: [f for f, _ in decoder], decoder.proxies):
+            try:
+                list(frames())
+            except ValueError:
+                pass
+
+
+def test_proxies_need_version_3():
+    with pytest.raises(ValueError):
+        Encoder(BytesIO(), 32, 24, ColourSpace.sRGB, version=2, proxy_scale=4)
+
+
+@pytest.mark.parametrize("compression", [Compression.none, Compression.zlib])
+@pytest.mark.parametrize("tolerance", [0, 2])
+def test_end_to_end_tiled(compression: Compression, tolerance: int):
+    video = create_ball_video(40, 24, 6)
+    file = BytesIO()
+    encoder = Encoder(
+        file,
+        40,
+        24,
+        ColourSpace.sRGB,
+        keyframe_interval=10,
+        compression=compression,
+        tolerance=tolerance,
+        tile_size=16,
+    )
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+    file.seek(0)
+
+    metrics = Metrics("decoder")
+    decoder = Decoder(file, metrics=metrics)
+    decoded = [frame for frame, _ in decoder]
+    assert len(decoded) == 6
+    for a, b in zip(decoded, video()):
+        assert np.all(np.abs(a.astype(np.int16) - b) <= tolerance)
+    assert metrics.frames == {"Key": 1, "Tiled": 5}
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(),
+        dict(compression=Compression.zlib),
+        dict(tile_size=16),
+        dict(tolerance=2),
+        dict(motion_search_range=4),
+    ],
+)
+def test_end_to_end_grayscale(options):
+    video = to_grayscale(create_noisy_video(40, 24, 6))
+    file = BytesIO()
+    encoder = Encoder(
+        file, 40, 24, ColourSpace.sRGB, keyframe_interval=3, grayscale=True, **options
+    )
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+    file.seek(0)
+
+    decoder = Decoder(file)
+    assert decoder.header.channels == 1
+    decoded = [frame for frame, _ in decoder]
+    assert len(decoded) == 6
+    tolerance = options.get("tolerance", 0)
+    for a, b in zip(decoded, video()):
+        assert a.shape == (24, 40, 1)
+        assert np.all(np.abs(a.astype(np.int16) - b) <= tolerance)
+
+
+def test_grayscale_is_smaller_than_rgb():
+    video = to_grayscale(create_noisy_video(40, 24, 4))
+    sizes = []
+    for grayscale in (False, True):
+        file = BytesIO()
+        encoder = Encoder(file, 40, 24, ColourSpace.sRGB, grayscale=grayscale)
+        for frame in video():
+            encoder.push(frame if grayscale else np.repeat(frame, 3, axis=2))
+        encoder.flush()
+        sizes.append(len(file.getvalue()))
+    assert sizes[1] < sizes[0]
+
+
+def test_grayscale_needs_version_5():
+    with pytest.raises(ValueError):
+        Encoder(BytesIO(), 32, 24, ColourSpace.sRGB, version=4, grayscale=True)
+
+
+def test_end_to_end_colourspace_conversion():
+    video = create_ball_video(32, 24, 6)
+    file = BytesIO()
+    encoder = Encoder(
+        file,
+        32,
+        24,
+        ColourSpace.Linear,
+        keyframe_interval=3,
+        input_colourspace=ColourSpace.sRGB,
+    )
+    for frame in video():
+        buffer = encoder.acquire_buffer()
+        buffer[...] = frame
+        encoder.push(buffer)
+        assert np.array_equal(buffer, SRGB_TO_LINEAR[frame])
+    encoder.flush()
+    file.seek(0)
+
+    linear = [frame for frame, _ in Decoder(file)]
+    for a, b in zip(linear, video()):
+        assert np.array_equal(a, SRGB_TO_LINEAR[b])
+
+    file.seek(0)
+    decoder = Decoder(file, colourspace=ColourSpace.sRGB)
+    srgb = [frame for frame, _ in decoder]
+    for a, b in zip(srgb, linear):
+        assert np.array_equal(a, LINEAR_TO_SRGB[b])
+    for frame_number in [3, 4, 3, 0]:
+        assert np.array_equal(decoder.frame(frame_number), srgb[frame_number])
+
+
+@pytest.mark.parametrize(
+    "layout",
+    [
+        PixelLayout(PixelFormat.BGRA, stride=36 * 4 + 8),
+        PixelLayout(PixelFormat.BGR, planar=True),
+    ],
+)
+def test_end_to_end_pixel_layouts(layout: PixelLayout):
+    video = create_ball_video(36, 24, 5)
+    file = BytesIO()
+    encoder = Encoder(file, 36, 24, ColourSpace.sRGB, keyframe_interval=3)
+    buffer = bytearray(layout.frame_size(36, 24))
+    for frame in video():
+        layout.pack(frame, buffer)
+        encoder.push(buffer, layout)
+    # Strided views are gathered too.
+    encoder.push(layout.unpack(buffer, 36, 24))
+    encoder.flush()
+    file.seek(0)
+
+    decoder = Decoder(file)
+    expected = list(video())
+    expected.append(expected[-1])
+    for frame in expected:
+        buffer[:] = bytes(len(buffer))
+        assert decoder.read_into(buffer, layout)
+        assert np.array_equal(layout.unpack(buffer, 36, 24), frame)
+    assert not decoder.read_into(buffer, layout)
+    with pytest.raises(ValueError):
+        encoder.push(buffer, PixelLayout(PixelFormat.GRAY))
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(),
+        dict(compression=Compression.zlib),
+        dict(tolerance=2),
+        dict(input_colourspace=ColourSpace.Linear),
+    ],
+)
+@pytest.mark.parametrize("block", [1, 5, 24])
+def test_end_to_end_rows(options, block: int):
+    video = create_noisy_video(40, 24, 5)
+    file = BytesIO()
+    metrics = Metrics()
+    encoder = Encoder(
+        file,
+        40,
+        24,
+        ColourSpace.sRGB,
+        keyframe_interval=2,
+        metrics=metrics,
+        **options,
+    )
+    for frame in video():
+        encoder.begin_frame()
+        for start in range(0, 24, block):
+            encoder.push_rows(frame[start : start + block])
+        encoder.end_frame()
+    encoder.flush()
+    assert metrics.frames == {"Key": 2, "Predicted": 3}
+    file.seek(0)
+
+    tolerance = options.get("tolerance", 0)
+    expected = list(video())
+    if "input_colourspace" in options:
+        expected = [LINEAR_TO_SRGB[frame] for frame in expected]
+    decoder = Decoder(file)
+    for frame in expected:
+        blocks = list(decoder.rows(7))
+        assert [len(rows) for rows in blocks] == [7, 7, 7, 3]
+        assert not blocks[0].flags.writeable
+        decoded = np.concatenate(blocks)
+        assert np.all(np.abs(decoded.astype(np.int16) - frame) <= tolerance)
+    assert list(decoder.rows()) == []
+
+
+@pytest.mark.parametrize("block", [1, 5, 24])
+def test_rows_with_colourspace_match_frames(block: int):
+    file = BytesIO()
+    encoder = Encoder(file, 40, 24, ColourSpace.sRGB, keyframe_interval=2)
+    for frame in create_noisy_video(40, 24, 5)():
+        encoder.push(frame)
+    encoder.flush()
+
+    file.seek(0)
+    expected = [frame for frame, _ in Decoder(file, colourspace=ColourSpace.Linear)]
+    file.seek(0)
+    decoder = Decoder(file, colourspace=ColourSpace.Linear)
+    for frame in expected:
+        assert np.array_equal(np.concatenate(list(decoder.rows(block))), frame)
+
+
+def test_rows_are_yielded_before_the_frame_is_read():
+    file = BytesIO()
+    encoder = Encoder(file, 32, 24, ColourSpace.sRGB)
+    encoder.begin_frame()
+    with pytest.raises(ValueError):
+        encoder.push(np.zeros((24, 32, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        encoder.end_frame()
+    for frame in create_noisy_video(32, 24, 1)():
+        encoder.push_rows(frame)
+    with pytest.raises(ValueError):
+        encoder.push_rows(frame[:1])
+    encoder.end_frame()
+    with pytest.raises(ValueError):
+        encoder.push_rows(frame[:1])
+    file.seek(0)
+
+    decoder = Decoder(file)
+    rows = decoder.rows()
+    assert np.array_equal(next(rows), frame[:1])
+    assert decoder.file.tell() < len(file.getvalue())
+    assert len(list(rows)) == 23
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(),
+        dict(version=0),
+        dict(compression=Compression.zlib, proxy_scale=4),
+        dict(motion_search_range=4),
+        dict(tile_size=8),
+        dict(grayscale=True),
+        dict(hash_function=HashFunction.xor, hash_size=16, tolerance=2),
+    ],
+)
+def test_fast_decode_matches_strict(options):
+    video = create_panning_video(40, 24, 6)
+    if options.get("grayscale"):
+        video = to_grayscale(video)
+    file = BytesIO()
+    encoder = Encoder(file, 40, 24, ColourSpace.sRGB, keyframe_interval=3, **options)
+    for frame in video():
+        encoder.push(frame)
+    encoder.flush()
+
+    decoded = {}
+    for mode in DecodeMode:
+        file.seek(0)
+        decoded[mode] = [
+            (frame, dict(details)) for frame, details in Decoder(file, mode=mode)
+        ]
+    assert len(decoded[DecodeMode.fast]) == 6
+    for (strict, strict_details), (fast, fast_details) in zip(
+        decoded[DecodeMode.strict], decoded[DecodeMode.fast]
+    ):
+        assert np.array_equal(strict, fast)
+        assert strict_details == fast_details
+
+
+@pytest.mark.parametrize("mode", list(DecodeMode))
+def test_decode_unchanged_tiled_frames(mode: DecodeMode):
+    frame = next(create_ball_video(32, 24, 1)())
+    file = BytesIO()
+    encoder = Encoder(file, 32, 24, ColourSpace.sRGB, keyframe_interval=10, tile_size=8)
+    for _ in range(3):
+        encoder.push(frame)
+    file.seek(0)
+
+    metrics = Metrics()
+    decoded = [decoded for decoded, _ in Decoder(file, metrics=metrics, mode=mode)]
+    assert metrics.frames == {"Key": 1, "Tiled": 2}
+    assert len(decoded) == 3
+    assert all(np.array_equal(decoded_frame, frame) for decoded_frame in decoded)
+
+
+def test_fast_decode_reads_files_in_chunks(tmp_path):
+    video = create_noisy_video(128, 128, 12)
+    with open(tmp_path / "noisy.qoiv", "wb") as file:
+        encoder = Encoder(file, 128, 128, ColourSpace.sRGB, keyframe_interval=3)
+        for frame in video():
+            encoder.push(frame)
+        encoder.flush()
+    assert (tmp_path / "noisy.qoiv").stat().st_size > 2 * READ_CHUNK
+
+    with open(tmp_path / "noisy.qoiv", "rb") as file:
+        decoded = [frame for frame, _ in Decoder(file, mode=DecodeMode.fast)]
+    assert len(decoded) == 12
+    assert all(np.array_equal(a, b) for a, b in zip(decoded, video()))
+
+
+@pytest.mark.parametrize("mode", list(DecodeMode))
+def test_decode_modes_reject_corrupt_frames(mode: DecodeMode):
+    file = BytesIO()
+    encoder = Encoder(file, 32, 24, ColourSpace.sRGB)
+    for frame in create_noisy_video(32, 24, 2)():
+        encoder.push(frame)
+    encoder.flush()
+    data = file.getvalue()
+
+    with pytest.raises(ValueError) as error:
+        list(Decoder(BytesIO(data[:-3]), mode=mode))
+    if mode == DecodeMode.strict:
+        assert "opcode at offset" in str(error.value)
+    # A run past the end of the frame.
+    with pytest.raises(ValueError):
+        list(Decoder(BytesIO(data[:17] + b"\xfd" * 20), mode=mode))
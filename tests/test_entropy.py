@@ -0,0 +1,28 @@
+from pyqoiv.entropy import compress, decompress, is_available
+from pyqoiv.types import Compression
+import pytest
+
+
+@pytest.mark.parametrize("compression", list(Compression))
+def test_round_trip(compression: Compression):
+    if not is_available(compression):
+        pytest.skip(f"{compression.name} is not available")
+    data = b"qoiv" * 1000
+    packed = compress(data, compression)
+    if compression != Compression.none:
+        assert len(packed) < len(data)
+    assert decompress(packed, compression) == data
+
+
+@pytest.mark.parametrize("compression", list(Compression)[1:])
+def test_corrupt_blocks_raise_value_error(compression: Compression):
+    if not is_available(compression):
+        pytest.skip(f"{compression.name} is not available")
+    packed = compress(b"qoiv" * 1000, compression)
+    with pytest.raises(ValueError):
+        decompress(packed[: len(packed) // 2] + b"\xff" * 8, compression)
+
+
+def test_zlib_level():
+    data = bytes(range(256)) * 64
+    assert decompress(compress(data, Compression.zlib, 1), Compression.zlib) == data
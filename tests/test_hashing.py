@@ -0,0 +1,52 @@
+from pyqoiv.hashing import HashStats, analyze_hashes, select_hash, simulate_hash_map
+from pyqoiv.types import HashFunction, hash_index, hash_indices
+import numpy as np
+import pytest
+
+RED = [255, 0, 0]
+# Shares red's slot in the QOI hash, as (27 * 7) % 64 == (255 * 3) % 64
+BLUE = [0, 0, 27]
+
+
+@pytest.mark.parametrize("function", list(HashFunction))
+@pytest.mark.parametrize("size", [64, 8])
+def test_hash_indices_match_hash_index(function: HashFunction, size: int):
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(100, 3), dtype=np.uint8)
+    indices = hash_indices(function, pixels, size)
+    assert indices.tolist() == [
+        hash_index(function, r, g, b, size) for r, g, b in pixels
+    ]
+    assert indices.min() >= 0 and indices.max() < size
+
+
+def test_simulate_hash_map_counts_evictions():
+    frame = np.array([[RED, RED, BLUE, RED, BLUE, [1, 2, 3], RED]], dtype=np.uint8)
+
+    stats = simulate_hash_map(frame, HashFunction.qoi, 64)
+    # The repeated red is a run, so is not looked up.
+    assert stats == HashStats(lookups=6, hits=0, misses=6, evictions=4)
+
+    assert hash_index(HashFunction.multiplicative, 255, 0, 0, 64) != hash_index(
+        HashFunction.multiplicative, 0, 0, 27, 64
+    )
+    stats = simulate_hash_map(frame, HashFunction.multiplicative, 64)
+    assert (stats.hits, stats.evictions) == (3, 0)
+    assert stats.hit_rate == pytest.approx(0.5)
+
+
+def test_select_hash_prefers_fewer_collisions():
+    frame = np.array([[RED, BLUE] * 8], dtype=np.uint8)
+    options = [(HashFunction.qoi, 64), (HashFunction.multiplicative, 64)]
+    assert select_hash([frame], options) == (HashFunction.multiplicative, 64)
+
+    # Ties keep the QOI hash
+    flat = np.full((4, 4, 3), 7, dtype=np.uint8)
+    assert select_hash([flat]) == (HashFunction.qoi, 64)
+
+
+def test_analyze_hashes_records_each_frame():
+    frames = [np.zeros((2, 2, 3), dtype=np.uint8)] * 3
+    results = analyze_hashes(frames)
+    assert len(results) == len(HashFunction) * 4
+    assert all(len(per_frame) == 3 for per_frame in results.values())
@@ -0,0 +1,62 @@
+from pyqoiv.layout import PixelFormat, PixelLayout
+import numpy as np
+import pytest
+
+
+def frame(height: int = 3, width: int = 4) -> np.ndarray:
+    return np.arange(height * width * 3, dtype=np.uint8).reshape(height, width, 3)
+
+
+@pytest.mark.parametrize(
+    "layout",
+    [
+        PixelLayout(),
+        PixelLayout(PixelFormat.BGR),
+        PixelLayout(PixelFormat.RGBA, stride=20),
+        PixelLayout(PixelFormat.BGRA, stride=17),
+        PixelLayout(PixelFormat.RGB, planar=True),
+        PixelLayout(PixelFormat.BGR, planar=True, stride=6),
+    ],
+)
+def test_pack_unpack(layout: PixelLayout):
+    expected = frame()
+    buffer = bytearray(layout.frame_size(4, 3))
+    layout.pack(expected, buffer)
+    unpacked = layout.unpack(buffer, 4, 3)
+    assert np.shares_memory(unpacked, np.frombuffer(buffer, np.uint8))
+    assert np.array_equal(unpacked, expected)
+    if layout.pixel_format.bytes_per_pixel == 4:
+        assert np.all(layout.view(buffer, 4, 3)[..., 3] == 255)
+
+
+def test_bgra_padded_rows():
+    layout = PixelLayout(PixelFormat.BGRA, stride=20)
+    assert layout.frame_size(4, 3) == 56
+    buffer = np.zeros((3, 20), dtype=np.uint8)
+    buffer[0, :4] = [1, 2, 3, 4]
+    assert layout.unpack(buffer, 4, 3)[0, 0].tolist() == [3, 2, 1]
+
+
+def test_planar():
+    layout = PixelLayout(planar=True)
+    assert layout.frame_size(4, 3) == 36
+    buffer = np.arange(36, dtype=np.uint8)
+    assert layout.unpack(buffer, 4, 3)[1, 2].tolist() == [6, 18, 30]
+
+
+def test_pack_through_table():
+    table = np.arange(256, dtype=np.uint8)[::-1].copy()
+    layout = PixelLayout(PixelFormat.BGR)
+    buffer = bytearray(36)
+    layout.pack(frame(), buffer, table)
+    assert np.array_equal(layout.unpack(buffer, 4, 3), 255 - frame())
+
+
+def test_invalid_layouts():
+    with pytest.raises(ValueError):
+        PixelLayout(stride=11).view(bytearray(100), 4, 3)
+    with pytest.raises(ValueError):
+        PixelLayout().view(bytearray(35), 4, 3)
+    with pytest.raises(ValueError):
+        PixelLayout(PixelFormat.GRAY).pack(frame(), bytearray(100))
+    assert not PixelLayout().view(bytes(36), 4, 3).flags.writeable
@@ -0,0 +1,109 @@
+from pyqoiv.decode import Decoder
+from pyqoiv.encode import Encoder
+from pyqoiv.metrics import FrameMetrics, Metrics
+from pyqoiv.types import ColourSpace, Compression, PixelHashMap
+from io import BytesIO
+import json
+import numpy as np
+from .samples import create_ball_video, create_panning_video
+
+
+def test_encoder_and_decoder_metrics_agree():
+    video = create_ball_video(32, 32, 6)
+    encoder_frames = []
+    encoder_metrics = Metrics(callbacks=[encoder_frames.append])
+    file = BytesIO()
+    encoder = Encoder(
+        file,
+        32,
+        32,
+        ColourSpace.sRGB,
+        keyframe_interval=2,
+        compression=Compression.zlib,
+        metrics=encoder_metrics,
+    )
+    for frame in video():
+        encoder.push(frame)
+
+    file.seek(0)
+    decoder_metrics = Metrics("decoder")
+    for _ in Decoder(file, metrics=decoder_metrics):
+        pass
+
+    assert [frame.frame_number for frame in encoder_frames] == list(range(6))
+    assert encoder_metrics.frames == {"Key": 2, "Predicted": 4}
+    assert encoder_metrics.frames == decoder_metrics.frames
+    assert encoder_metrics.opcodes == decoder_metrics.opcodes
+    assert encoder_metrics.opcode_bytes == decoder_metrics.opcode_bytes
+    assert encoder_metrics.bytes == decoder_metrics.bytes == len(file.getvalue()) - 16
+    assert set(encoder_metrics.timings) == {"compare", "select", "serialize", "io"}
+    assert set(decoder_metrics.timings) == {"io", "decode"}
+    assert encoder_metrics.hash_lookups >= encoder_metrics.hash_hits > 0
+    assert encoder_metrics.hash_hits == encoder_metrics.opcodes["index"]
+
+
+def test_encoder_metrics_time_motion_search():
+    metrics = Metrics()
+    encoder = Encoder(
+        BytesIO(),
+        64,
+        32,
+        ColourSpace.sRGB,
+        keyframe_interval=10,
+        motion_search_range=8,
+        metrics=metrics,
+    )
+    for frame in create_panning_video(64, 32, 3)():
+        encoder.push(frame)
+    assert metrics.timings["motion"] > 0
+
+
+def test_frame_metrics_counts_collisions():
+    pixels = PixelHashMap()
+    frame = FrameMetrics(frame_number=0)
+    red = np.array([255, 0, 0], dtype=np.uint8)
+    pixels.push(red)
+    frame.count_lookup(pixels, red, red in pixels)
+    frame.count_lookup(pixels, np.array([1, 2, 3], dtype=np.uint8), False)
+    # Shares red's slot, as (27 * 7) % 64 == (255 * 3) % 64
+    colliding = np.array([0, 0, 27], dtype=np.uint8)
+    assert pixels.index_of(0, 0, 27) == pixels.index_of(255, 0, 0)
+    frame.count_lookup(pixels, colliding, colliding in pixels)
+    assert (frame.hash_lookups, frame.hash_hits, frame.hash_collisions) == (3, 1, 1)
+
+
+def test_frame_metrics_counts_collisions_with_black():
+    pixels = PixelHashMap()
+    frame = FrameMetrics(frame_number=0)
+    # Shares the slot of black, as (64 * 7) % 64 == 0
+    colliding = np.array([0, 0, 64], dtype=np.uint8)
+    assert pixels.index_of(0, 0, 64) == pixels.index_of(0, 0, 0)
+    frame.count_lookup(pixels, colliding, colliding in pixels)
+    assert frame.hash_collisions == 0
+    pixels.push(np.zeros(3, dtype=np.uint8))
+    frame.count_lookup(pixels, colliding, colliding in pixels)
+    assert frame.hash_collisions == 1
+    pixels.clear()
+    frame.count_lookup(pixels, colliding, colliding in pixels)
+    assert frame.hash_collisions == 1
+
+
+def test_metrics_export():
+    metrics = Metrics()
+    frame = metrics.start_frame()
+    frame.frame_type = "Key"
+    frame.size = 10
+    frame.opcodes = {"rgb": 2, "run": 2}
+    frame.timings["select"] += 0.5
+    metrics.record(frame)
+
+    exported = json.loads(metrics.to_json())
+    assert exported["frames"] == {"Key": 1}
+    assert exported["opcode_bytes"] == {"rgb": 8, "run": 2}
+
+    text = metrics.to_prometheus()
+    assert "# TYPE qoiv_encoder_frames_total counter" in text
+    assert 'qoiv_encoder_frames_total{type="Key"} 1' in text
+    assert 'qoiv_encoder_opcode_bytes_total{opcode="rgb"} 8' in text
+    assert 'qoiv_encoder_stage_seconds_total{stage="select"} 0.5' in text
+    assert "qoiv_encoder_bytes_total 10" in text
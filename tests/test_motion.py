@@ -0,0 +1,33 @@
+from pyqoiv.motion import shift_frame, estimate_motion, count_matching
+import numpy as np
+from .samples import create_panning_video
+
+
+def test_shift_frame():
+    frame = np.arange(12, dtype=np.uint8).reshape(2, 2, 3)
+    assert np.array_equal(shift_frame(frame, 0, 0), frame)
+    shifted = shift_frame(frame, 1, 0)
+    assert np.array_equal(shifted[:, 0], frame[:, 1])
+    # Lookups past the edge are clamped
+    assert np.array_equal(shifted[:, 1], frame[:, 1])
+    shifted = shift_frame(frame, 0, -1)
+    assert np.array_equal(shifted[0], frame[0])
+    assert np.array_equal(shifted[1], frame[0])
+
+
+def test_count_matching():
+    a = np.zeros((2, 2, 3), dtype=np.uint8)
+    b = a.copy()
+    assert count_matching(a, b) == 4
+    b[0, 0, 2] = 1
+    assert count_matching(a, b) == 3
+
+
+def test_estimate_motion_finds_pan():
+    key, _, frame = list(create_panning_video(64, 32, 3, speed=5)())
+    assert estimate_motion(frame, key, search_range=16) == (10, 0)
+
+
+def test_estimate_motion_prefers_zero():
+    frame = np.full((16, 16, 3), 7, dtype=np.uint8)
+    assert estimate_motion(frame, frame, search_range=8) == (0, 0)
@@ -0,0 +1,155 @@
+from pyqoiv import multistream
+from pyqoiv.decode import Decoder
+from pyqoiv.encode import Encoder
+from pyqoiv.multistream import (
+    MultiStreamEncoder,
+    MultiStreamServer,
+    StreamClient,
+    serve_stream,
+)
+from pyqoiv.types import ColourSpace
+from io import BytesIO
+from pathlib import Path
+import socket
+import threading
+import numpy as np
+import pytest
+from .samples import create_ball_video, create_panning_video, create_striped_video
+
+VIDEOS = [
+    (create_ball_video(32, 32, 10), 32, 32),
+    (create_panning_video(64, 32, 7), 64, 32),
+    (create_striped_video(16, 8, 12), 16, 8),
+]
+
+
+def encode_alone(video, width: int, height: int, **options) -> bytes:
+    file = BytesIO()
+    encoder = Encoder(file, width, height, ColourSpace.sRGB, **options)
+    for frame in video():
+        encoder.push(frame)
+    return file.getvalue()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_multistream_matches_separate_encoders(jobs: int):
+    files = [BytesIO() for _ in VIDEOS]
+    with MultiStreamEncoder(jobs=jobs, max_pending=2) as multi:
+        for stream_id, ((_, width, height), file) in enumerate(zip(VIDEOS, files)):
+            multi.add_stream(
+                stream_id, file, width, height, ColourSpace.sRGB, keyframe_interval=3
+            )
+        # Interleave the streams, reusing one buffer per stream.
+        iterators = [video() for video, _, _ in VIDEOS]
+        buffers = [np.empty((h, w, 3), np.uint8) for _, w, h in VIDEOS]
+        while iterators:
+            for stream_id, iterator in enumerate(iterators):
+                frame = next(iterator, None)
+                if frame is not None:
+                    buffers[stream_id][...] = frame
+                    multi.push(stream_id, buffers[stream_id])
+            if all(multi.frames_written(i) for i in range(len(VIDEOS))):
+                break
+        for stream_id, iterator in enumerate(iterators):
+            for frame in iterator:
+                multi.push(stream_id, frame)
+        encoder = multi.close_stream(0)
+        assert encoder.total_frames == 10
+        assert [d.frame for d in encoder.keyframe_decisions] == [0, 4, 8]
+
+    for (video, width, height), file in zip(VIDEOS, files):
+        expected = encode_alone(video, width, height, keyframe_interval=3)
+        assert file.getvalue() == expected
+
+
+def test_inline_jobs_run_without_the_lock(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    encode_keyframe = multistream._encode_keyframe
+
+    def slow_keyframe(*args):
+        started.set()
+        release.wait(5)
+        return encode_keyframe(*args)
+
+    monkeypatch.setattr(multistream, "_encode_keyframe", slow_keyframe)
+    frame = np.zeros((8, 8, 3), np.uint8)
+    with MultiStreamEncoder(jobs=1) as multi:
+        multi.add_stream(0, BytesIO(), 8, 8, ColourSpace.sRGB)
+        multi.push(0, frame)
+        try:
+            assert started.wait(5)
+            pushed = threading.Event()
+            threading.Thread(
+                target=lambda: (multi.push(0, frame), pushed.set()), daemon=True
+            ).start()
+            # Feeding the encoder does not wait for the running encode.
+            assert pushed.wait(1)
+            assert multi.frames_written(0) == 0
+        finally:
+            release.set()
+        multi.close_stream(0)
+
+
+def test_multistream_rejects_unknown_and_duplicate_streams():
+    with MultiStreamEncoder() as multi:
+        multi.add_stream("a", BytesIO(), 4, 4, ColourSpace.sRGB)
+        with pytest.raises(ValueError):
+            multi.add_stream("a", BytesIO(), 4, 4, ColourSpace.sRGB)
+        with pytest.raises(KeyError):
+            multi.push("b", np.zeros((4, 4, 3), np.uint8))
+
+
+def test_multistream_rejects_mismatched_frames():
+    with MultiStreamEncoder() as multi:
+        multi.add_stream("a", BytesIO(), 4, 4, ColourSpace.sRGB)
+        with pytest.raises(ValueError):
+            multi.push("a", np.zeros((2, 2, 3), np.uint8))
+
+
+def test_serve_stream_over_pipe(tmp_path: Path):
+    messages = BytesIO()
+    client = StreamClient(messages)
+    for stream_id, (video, width, height) in enumerate(VIDEOS[:2]):
+        client.open_stream(stream_id, width, height, ColourSpace.sRGB)
+    for stream_id, (video, _, _) in enumerate(VIDEOS[:2]):
+        for frame in video():
+            client.send_frame(stream_id, frame)
+    client.close_stream(0)
+    messages.seek(0)
+
+    with MultiStreamEncoder() as multi:
+        serve_stream(multi, messages, tmp_path, keyframe_interval=3)
+
+    for stream_id, (video, width, height) in enumerate(VIDEOS[:2]):
+        encoded = (tmp_path / f"{stream_id}.qoiv").read_bytes()
+        assert encoded == encode_alone(video, width, height, keyframe_interval=3)
+
+
+def test_server_over_tcp(tmp_path: Path):
+    video, width, height = VIDEOS[0]
+    with MultiStreamEncoder(jobs=1) as multi:
+        server = MultiStreamServer(("127.0.0.1", 0), multi, tmp_path)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with socket.create_connection(
+                ("127.0.0.1", server.server_address[1])
+            ) as connection:
+                client = StreamClient(connection.makefile("wb"))
+                client.open_stream(7, width, height, ColourSpace.sRGB)
+                for frame in video():
+                    client.send_frame(7, frame)
+                client.close_stream(7)
+                connection.shutdown(socket.SHUT_WR)
+                connection.recv(1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    decoded = [
+        frame for frame, _ in Decoder(BytesIO((tmp_path / "7.qoiv").read_bytes()))
+    ]
+    assert len(decoded) == 10
+    for expected, frame in zip(video(), decoded):
+        assert np.array_equal(expected, frame)
@@ -5,6 +5,10 @@ from pyqoiv.opcodes import (
     DiffOpcode,
     RunOpcode,
     FrameRunOpcode,
+    AboveRunOpcode,
+    AboveDiffOpcode,
+    GrayOpcode,
+    GrayDiffOpcode,
 )
 from io import BytesIO
 import pytest
@@ -187,3 +191,74 @@ def test_comparisions():
                 assert b.is_next(file)
             else:
                 assert not b.is_next(file), f"Expected {a} and {b} to not be equal"
+
+
+def test_above_run_opcode():
+    above_run = AboveRunOpcode(run=100)
+    assert len(above_run) == 2
+    file = BytesIO()
+    above_run.write(file)
+    file.seek(0)
+    assert AboveRunOpcode.is_next(file)
+    assert not AboveDiffOpcode.is_next(file)
+    assert AboveRunOpcode.read(file) == above_run
+
+    file = BytesIO()
+    FrameRunOpcode(is_keyframe=True, run=3).write(file)
+    file.seek(0)
+    assert not AboveRunOpcode.is_next(file)
+    with pytest.raises(ValueError):
+        AboveRunOpcode.read(file)
+    with pytest.raises(ValueError):
+        AboveRunOpcode(run=129).write(BytesIO())
+
+
+def test_above_diff_opcode():
+    above_diff = AboveDiffOpcode(diff=-20, dr=1, dg=0, db=-2)
+    assert len(above_diff) == 2
+    file = BytesIO()
+    above_diff.write(file)
+    file.seek(0)
+    assert AboveDiffOpcode.is_next(file)
+    assert not AboveRunOpcode.is_next(file)
+    assert AboveDiffOpcode.read(file) == above_diff
+
+    file = BytesIO()
+    DiffFrameOpcode(True, False, 0, 0, 0, diff=0).write(file)
+    file.seek(0)
+    assert not AboveDiffOpcode.is_next(file)
+    with pytest.raises(ValueError):
+        AboveDiffOpcode.read(file)
+    with pytest.raises(ValueError):
+        AboveDiffOpcode(diff=32, dr=0, dg=0, db=0).write(BytesIO())
+    with pytest.raises(ValueError):
+        AboveDiffOpcode(diff=0, dr=2, dg=0, db=0).write(BytesIO())
+
+
+def test_gray_opcode():
+    gray = GrayOpcode(200)
+    assert len(gray) == 2
+    file = BytesIO()
+    gray.write(file)
+    assert file.getvalue() == b"\xfe\xc8"
+    file.seek(0)
+    assert GrayOpcode.is_next(file)
+    assert GrayOpcode.read(file) == gray
+    with pytest.raises(ValueError):
+        GrayOpcode.read(BytesIO(b"\xfe"))
+
+
+def test_gray_diff_opcode():
+    for diff in (-32, 0, 31):
+        gray_diff = GrayDiffOpcode(diff)
+        assert len(gray_diff) == 1
+        file = BytesIO()
+        gray_diff.write(file)
+        file.seek(0)
+        assert GrayDiffOpcode.is_next(file)
+        assert not GrayOpcode.is_next(file)
+        assert GrayDiffOpcode.read(file) == gray_diff
+    with pytest.raises(ValueError):
+        GrayDiffOpcode(32).write(BytesIO())
+    with pytest.raises(ValueError):
+        GrayDiffOpcode.read(BytesIO(b"\xfe"))
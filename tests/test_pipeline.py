@@ -0,0 +1,200 @@
+from pyqoiv.encode import Encoder
+from pyqoiv.decode import Decoder
+from pyqoiv.pipeline import (
+    MAX_WORKERS,
+    SharedKeyState,
+    _encode_keyframe,
+    _encode_predicted,
+    _encode_shared_predicted,
+    _release_key_state,
+    _worker_for,
+    decode_pipeline,
+    encode_pipeline,
+)
+from pyqoiv.types import ColourSpace
+import numpy as np
+from numpy.typing import NDArray
+from typing import Any, Callable, Dict, Iterator
+from io import BytesIO
+import pickle
+import threading
+import pytest
+from .samples import create_ball_video, create_panning_video
+
+
+def frame_reader(
+    frames: Iterator[NDArray[np.uint8]],
+) -> Callable[[NDArray[np.uint8]], bool]:
+    def read_frame(buffer: NDArray[np.uint8]) -> bool:
+        frame = next(frames, None)
+        if frame is None:
+            return False
+        buffer[...] = frame
+        return True
+
+    return read_frame
+
+
+@pytest.mark.parametrize("proxies", [{}, dict(proxy_scale=4, proxy_interval=4)])
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_pipeline_matches_encoder(jobs: int, proxies):
+    video = create_panning_video(64, 32, 12)
+    options: Dict[str, Any] = dict(
+        keyframe_interval=5, motion_search_range=8, **proxies
+    )
+
+    expected = BytesIO()
+    encoder = Encoder(expected, 64, 32, ColourSpace.sRGB, **options)
+    for frame in video():
+        encoder.push(frame)
+
+    progress = []
+    file = BytesIO()
+    pipeline_encoder, stats = encode_pipeline(
+        frame_reader(video()),
+        file,
+        64,
+        32,
+        ColourSpace.sRGB,
+        jobs=jobs,
+        queue_size=2,
+        progress=lambda: progress.append(1),
+        **options,
+    )
+
+    assert file.getvalue() == expected.getvalue()
+    assert pipeline_encoder.total_frames == 12
+    assert [d.frame for d in pipeline_encoder.keyframe_decisions] == [0, 6]
+    assert len(progress) == 12
+    assert [stage.name for stage in stats.stages] == ["read", "encode", "write"]
+    assert all(stage.items == 12 for stage in stats.stages)
+    assert "encode" in stats.report()
+
+
+def test_predicted_jobs_share_the_key_state():
+    options: Dict[str, Any] = dict(width=64, height=32, colourspace=ColourSpace.sRGB)
+    frames = list(create_panning_video(64, 32, 2)())
+    key = _encode_keyframe(options, frames[0])
+    assert key.key_frame is not None and key.key_pixels is not None
+    block, state = SharedKeyState.create(key.key_frame, key.key_pixels)
+    try:
+        assert len(pickle.dumps(state)) < 200
+        shared = _encode_shared_predicted(options, frames[1], state)
+        direct = _encode_predicted(options, frames[1], key.key_frame, key.key_pixels)
+        assert shared.payload == direct.payload
+    finally:
+        _release_key_state(block)
+
+
+def test_pipeline_scene_changes():
+    video = create_ball_video(32, 32, 10)
+    options: Dict[str, Any] = dict(keyframe_interval=100, scene_change_threshold=0.01)
+
+    expected = BytesIO()
+    encoder = Encoder(expected, 32, 32, ColourSpace.sRGB, **options)
+    for frame in video():
+        encoder.push(frame)
+
+    file = BytesIO()
+    pipeline_encoder, _ = encode_pipeline(
+        frame_reader(video()), file, 32, 32, ColourSpace.sRGB, **options
+    )
+    assert file.getvalue() == expected.getvalue()
+    assert pipeline_encoder.keyframe_decisions == encoder.keyframe_decisions
+
+
+def test_pipeline_read_error():
+    def read_frame(buffer: NDArray[np.uint8]) -> bool:
+        raise ValueError("Stream ended part way through a frame.")
+
+    with pytest.raises(ValueError):
+        encode_pipeline(read_frame, BytesIO(), 8, 8, ColourSpace.sRGB)
+
+
+def test_decode_pipeline_writes_frames_in_order():
+    video = create_panning_video(64, 32, 8)
+    file = BytesIO()
+    encoder = Encoder(file, 64, 32, ColourSpace.sRGB, keyframe_interval=3)
+    for frame in video():
+        encoder.push(frame)
+    file.seek(0)
+
+    output = BytesIO()
+
+    def write(frame: NDArray[np.uint8]) -> None:
+        output.write(memoryview(frame))
+
+    stats = decode_pipeline(Decoder(file), write, queue_size=2)
+
+    expected = b"".join(frame.tobytes() for frame in video())
+    assert output.getvalue() == expected
+    assert [stage.items for stage in stats.stages] == [8, 8]
+
+
+def test_decode_pipeline_skips_frames():
+    video = create_panning_video(64, 32, 8)
+    file = BytesIO()
+    encoder = Encoder(file, 64, 32, ColourSpace.sRGB, keyframe_interval=3)
+    for frame in video():
+        encoder.push(frame)
+    file.seek(0)
+
+    output = []
+    decode_pipeline(Decoder(file), output.append, step=3)
+
+    assert all(np.array_equal(a, b) for a, b in zip(output, list(video())[::3]))
+    assert len(output) == 3
+
+
+def test_decode_pipeline_write_error():
+    file = BytesIO()
+    encoder = Encoder(file, 16, 16, ColourSpace.sRGB)
+    for frame in create_ball_video(16, 16, 20)():
+        encoder.push(frame)
+    file.seek(0)
+
+    def write(frame: NDArray[np.uint8]) -> None:
+        raise OSError("Broken pipe")
+
+    with pytest.raises(OSError):
+        decode_pipeline(Decoder(file), write, queue_size=1)
+
+
+def test_workers_are_per_thread_and_bounded():
+    options: Dict[str, Any] = dict(width=8, height=8, colourspace=ColourSpace.sRGB)
+    worker = _worker_for(options)
+    assert _worker_for(options) is worker
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(_worker_for(options)))
+    thread.start()
+    thread.join()
+    assert other[0] is not worker
+
+    for size in range(MAX_WORKERS):
+        _worker_for(dict(options, hash_size=[32, 16, 8, 64][size]))
+    assert _worker_for(options) is not worker
+
+
+def test_inline_pipelines_on_threads_match_encoder():
+    video = create_panning_video(64, 32, 12)
+    options: Dict[str, Any] = dict(keyframe_interval=3)
+    expected = BytesIO()
+    encoder = Encoder(expected, 64, 32, ColourSpace.sRGB, **options)
+    for frame in video():
+        encoder.push(frame)
+
+    files = [BytesIO() for _ in range(4)]
+    threads = [
+        threading.Thread(
+            target=encode_pipeline,
+            args=(frame_reader(video()), file, 64, 32, ColourSpace.sRGB),
+            kwargs=options,
+        )
+        for file in files
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(file.getvalue() == expected.getvalue() for file in files)
@@ -0,0 +1,114 @@
+from pyqoiv.decode import DecodeMode, Decoder
+from pyqoiv.encode import Encoder
+from pyqoiv.scan import scan_frames, summarize
+from pyqoiv.types import ColourSpace, Compression, FrameType
+from io import BytesIO
+import pytest
+from .samples import (
+    create_ball_video,
+    create_noisy_video,
+    create_panning_video,
+    create_striped_video,
+    to_grayscale,
+)
+
+
+def encode(video, width: int, height: int, **options) -> BytesIO:
+    file = BytesIO()
+    encoder = Encoder(file, width, height, ColourSpace.sRGB, **options)
+    for frame in video():
+        encoder.push(frame)
+    file.seek(0)
+    return file
+
+
+@pytest.mark.parametrize("compression", [Compression.none, Compression.zlib])
+@pytest.mark.parametrize(
+    "video, width, height, options",
+    [
+        (create_ball_video(32, 32, 12), 32, 32, dict(keyframe_interval=4)),
+        (create_striped_video(16, 16, 6), 16, 16, dict(keyframe_interval=3)),
+        (
+            create_panning_video(64, 32, 8),
+            64,
+            32,
+            dict(keyframe_interval=10, motion_search_range=8),
+        ),
+        (create_ball_video(40, 24, 6), 40, 24, dict(keyframe_interval=10, tile_size=8)),
+        (
+            to_grayscale(create_noisy_video(32, 16, 6)),
+            32,
+            16,
+            dict(keyframe_interval=3, grayscale=True),
+        ),
+    ],
+)
+def test_scan_matches_decoder(video, width, height, options, compression):
+    file = encode(video, width, height, compression=compression, **options)
+    decoded = [dict(details) for _, details in Decoder(file)]
+    scanned = list(scan_frames(file))
+
+    assert [frame.opcodes for frame in scanned] == decoded
+    assert [frame.frame_number for frame in scanned] == list(range(len(decoded)))
+    assert scanned[0].frame_position == 16
+    for frame, following in zip(scanned, scanned[1:]):
+        assert frame.frame_position + frame.frame_size == following.frame_position
+    assert sum(frame.frame_size for frame in scanned) == len(file.getvalue()) - 16
+
+
+def test_scan_skips_proxies():
+    file = encode(
+        create_ball_video(32, 32, 6), 32, 32, keyframe_interval=2, proxy_scale=2
+    )
+    decoded = [dict(details) for _, details in Decoder(file)]
+    scanned = list(scan_frames(file))
+    assert [frame.opcodes for frame in scanned] == decoded
+    assert [frame.frame_type for frame in scanned[:3]] == [
+        FrameType.Key,
+        FrameType.Predicted,
+        FrameType.Predicted,
+    ]
+
+
+def test_scan_compressed_in_parallel():
+    file = encode(
+        create_ball_video(32, 32, 12),
+        32,
+        32,
+        keyframe_interval=2,
+        compression=Compression.zlib,
+    )
+    assert list(scan_frames(file, jobs=2)) == list(scan_frames(file))
+
+
+def test_scan_truncated_file():
+    file = encode(create_ball_video(32, 32, 2), 32, 32)
+    truncated = BytesIO(file.getvalue()[:-1])
+    with pytest.raises(ValueError):
+        list(scan_frames(truncated))
+
+
+def test_scan_corrupt_compressed_block():
+    file = encode(create_noisy_video(32, 32, 2), 32, 32, compression=Compression.zlib)
+    data = bytearray(file.getvalue())
+    data[32:48] = b"\xff" * 16
+    with pytest.raises(ValueError):
+        list(scan_frames(BytesIO(data)))
+    for mode in DecodeMode:
+        with pytest.raises(ValueError):
+            list(Decoder(BytesIO(data), mode=mode))
+
+
+def test_summarize():
+    file = encode(create_ball_video(32, 32, 9), 32, 32, keyframe_interval=3)
+    frames = list(scan_frames(file))
+    summary = summarize(frames).to_dict()
+
+    assert summary["frames"] == 9
+    assert summary["bytes"] == len(file.getvalue()) - 16
+    assert summary["frame_types"] == {"Key": 3, "Predicted": 6}
+    assert summary["gop_sizes"] == {"1": 1, "4": 2}
+    assert summary["frame_size"]["all"]["max"] == max(f.frame_size for f in frames)
+    for mix in summary["opcode_mix"].values():
+        assert sum(mix.values()) == pytest.approx(1)
+    assert FrameType.Key.name in summary["opcode_mix"]
@@ -0,0 +1,107 @@
+import threading
+import time
+import numpy as np
+import pytest
+from pyqoiv.decode import Decoder
+from pyqoiv.segment import Manifest, SegmentReader, SegmentWriter
+from pyqoiv.types import ColourSpace
+from .samples import create_ball_video
+
+
+def write(directory, frames: int = 9, **options):
+    video = create_ball_video(32, 24, frames)
+    with SegmentWriter(
+        directory, 32, 24, ColourSpace.sRGB, keyframe_interval=3, **options
+    ) as writer:
+        for frame in video():
+            writer.push(frame)
+    return list(video())
+
+
+def test_segments_and_manifest(tmp_path):
+    frames = write(tmp_path)
+    manifest = Manifest.read(tmp_path / "manifest.json")
+    assert manifest.ended
+    assert [segment.frames for segment in manifest.segments] == [4, 4, 1]
+    assert [segment.first_frame for segment in manifest.segments] == [0, 4, 8]
+    assert all(segment.complete for segment in manifest.segments)
+
+    for segment in manifest.segments:
+        path = tmp_path / segment.name
+        assert path.stat().st_size == segment.size
+        with open(path, "rb") as file:
+            decoded = [frame for frame, _ in Decoder(file)]
+        expected = frames[segment.first_frame : segment.first_frame + segment.frames]
+        assert len(decoded) == len(expected)
+        for a, b in zip(decoded, expected):
+            assert np.array_equal(a, b)
+
+    decoded = list(SegmentReader(tmp_path).frames())
+    assert len(decoded) == len(frames)
+    for a, b in zip(decoded, frames):
+        assert np.array_equal(a, b)
+
+
+def test_rolling_window(tmp_path):
+    frames = write(tmp_path, frames=12, window=2, proxy_scale=2)
+    manifest = Manifest.read(tmp_path / "manifest.json")
+    assert [segment.sequence for segment in manifest.segments] == [1, 2]
+    assert sorted(path.name for path in tmp_path.glob("*.qoiv")) == [
+        "segment-000001.qoiv",
+        "segment-000002.qoiv",
+    ]
+    decoded = list(SegmentReader(tmp_path).frames())
+    assert len(decoded) == 8
+    for a, b in zip(decoded, frames[4:]):
+        assert np.array_equal(a, b)
+    live = list(SegmentReader(tmp_path).frames(live=True))
+    assert len(live) == 4
+
+
+def test_follow_live_writer(tmp_path):
+    video = create_ball_video(32, 24, 7)
+    started = threading.Event()
+
+    def writer():
+        with SegmentWriter(
+            tmp_path, 32, 24, ColourSpace.sRGB, keyframe_interval=2
+        ) as segments:
+            for frame in video():
+                segments.push(frame)
+                started.set()
+                time.sleep(0.02)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    started.wait()
+    decoded = list(
+        SegmentReader(tmp_path).frames(follow=True, poll_interval=0.01, timeout=5)
+    )
+    thread.join()
+    assert len(decoded) == 7
+    for a, b in zip(decoded, video()):
+        assert np.array_equal(a, b)
+
+
+def test_missing_manifest(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        list(SegmentReader(tmp_path).frames())
+    assert list(SegmentReader(tmp_path).frames(follow=True, timeout=0.05)) == []
+    with pytest.raises(ValueError):
+        SegmentWriter(tmp_path, 32, 24, ColourSpace.sRGB, window=0)
+
+
+def test_segments_of_rows(tmp_path):
+    video = create_ball_video(32, 24, 5)
+    with SegmentWriter(
+        tmp_path, 32, 24, ColourSpace.sRGB, keyframe_interval=2
+    ) as writer:
+        for frame in video():
+            writer.begin_frame()
+            writer.push_rows(frame[:10])
+            writer.push_rows(frame[10:])
+            writer.end_frame()
+    manifest = Manifest.read(tmp_path / "manifest.json")
+    assert [segment.frames for segment in manifest.segments] == [3, 2]
+    for a, b in zip(SegmentReader(tmp_path).frames(), video()):
+        assert np.array_equal(a, b)
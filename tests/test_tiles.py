@@ -0,0 +1,47 @@
+import numpy as np
+from pyqoiv.tiles import (
+    bitmap_size,
+    count_tiles,
+    gather_tiles,
+    pack_bitmap,
+    pad_to_tiles,
+    scatter_tiles,
+    tile_grid,
+    unpack_bitmap,
+)
+
+
+def test_tile_grid_covers_partial_tiles():
+    assert tile_grid(33, 16, 16) == (1, 3)
+    assert bitmap_size(33, 16, 16) == 1
+    assert bitmap_size(160, 16, 16) == 2
+
+
+def test_bitmap_round_trip():
+    changed = np.zeros((3, 5), dtype=np.bool_)
+    changed[0, 1] = changed[2, 4] = changed[1, 0] = True
+    bitmap = pack_bitmap(changed)
+    assert len(bitmap) == bitmap_size(5 * 4, 3 * 4, 4)
+    assert count_tiles(bitmap) == 3
+    assert np.array_equal(unpack_bitmap(bitmap, 20, 12, 4), changed)
+
+
+def test_gather_and_scatter_tiles():
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(10, 13, 3), dtype=np.uint8)
+    padded = pad_to_tiles(frame, 4)
+    assert padded.shape == (12, 16, 3)
+    assert np.array_equal(padded[:10, :13], frame)
+    assert np.array_equal(padded[11, :13], frame[9])
+
+    changed = np.zeros((3, 4), dtype=np.bool_)
+    changed[0, 0] = changed[2, 3] = True
+    tiles = gather_tiles(padded, changed, 4)
+    assert tiles.shape == (8, 4, 3)
+    assert np.array_equal(tiles[:4], padded[:4, :4])
+    assert np.array_equal(tiles[4:], padded[8:, 12:])
+
+    target = np.zeros_like(padded)
+    scatter_tiles(target, changed, 4, tiles)
+    assert np.array_equal(target[8:, 12:], padded[8:, 12:])
+    assert not target[4:8].any()
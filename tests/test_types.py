@@ -1,5 +1,13 @@
 import pytest
-from pyqoiv.types import QovHeader, PixelHashMap, QovFrameHeader, FrameType
+from pyqoiv.types import (
+    QovHeader,
+    PixelHashMap,
+    QovFrameHeader,
+    FrameType,
+    FORMAT_VERSION,
+    Compression,
+    HashFunction,
+)
 from io import BytesIO
 import numpy as np
 
@@ -79,3 +87,114 @@ def test_frame_header():
         h.write(file)
         file.seek(0)
         h2 = QovFrameHeader.read(file)
+
+
+def test_motion_frame_header():
+    h = QovFrameHeader(FrameType.Motion, dx=-3, dy=12)
+    file = BytesIO()
+    h.write(file)
+    assert file.tell() == 5
+    file.seek(0)
+    assert QovFrameHeader.read(file) == h
+
+
+def test_header_version():
+    file = BytesIO()
+    QovHeader(version=0).write(file)
+    file.seek(0)
+    assert QovHeader.read(file).version == 0
+
+    with pytest.raises(ValueError):
+        QovHeader(version=FORMAT_VERSION + 1).write(BytesIO())
+    file = BytesIO()
+    QovHeader().write(file)
+    data = bytearray(file.getvalue())
+    data[13] = FORMAT_VERSION + 1
+    with pytest.raises(ValueError):
+        QovHeader.read(BytesIO(bytes(data)))
+
+
+def test_header_compression():
+    file = BytesIO()
+    QovHeader(compression=Compression.lzma).write(file)
+    file.seek(0)
+    assert QovHeader.read(file).compression == Compression.lzma
+
+    data = bytearray(file.getvalue())
+    data[14] = 200
+    with pytest.raises(ValueError):
+        QovHeader.read(BytesIO(bytes(data)))
+
+
+def test_header_sized_frames():
+    file = BytesIO()
+    QovHeader(sized_frames=True).write(file)
+    assert file.getvalue()[14] == 0x10
+    file.seek(0)
+    header = QovHeader.read(file)
+    assert header.sized_frames and header.sized
+    assert QovHeader(compression=Compression.zlib).sized
+    assert not QovHeader().sized
+
+    with pytest.raises(ValueError):
+        QovHeader(version=2, sized_frames=True).write(BytesIO())
+    data = bytearray(file.getvalue())
+    data[13] = 2
+    with pytest.raises(ValueError):
+        QovHeader.read(BytesIO(bytes(data)))
+
+
+def test_header_grayscale():
+    file = BytesIO()
+    header = QovHeader(grayscale=True)
+    assert header.channels == 1
+    header.write(file)
+    assert file.getvalue()[14] == 0x20
+    file.seek(0)
+    assert QovHeader.read(file) == header
+    assert QovHeader().channels == 3
+
+    with pytest.raises(ValueError):
+        QovHeader(version=4, grayscale=True).write(BytesIO())
+    data = bytearray(file.getvalue())
+    data[13] = 4
+    with pytest.raises(ValueError):
+        QovHeader.read(BytesIO(bytes(data)))
+
+
+def test_gray_pixel_hash_map():
+    pixels = PixelHashMap(64, HashFunction.qoi, channels=1)
+    pixels.push(np.array([42], dtype=np.uint8))
+    assert np.array([42], dtype=np.uint8) in pixels
+    assert np.array([43], dtype=np.uint8) not in pixels
+    assert pixels[pixels.index_of_pixel(np.array([42]))][0] == 42
+
+
+def test_proxy_frame_header():
+    file = BytesIO()
+    h = QovFrameHeader(frame_type=FrameType.Proxy, width=160, height=90)
+    h.write(file)
+    assert file.tell() == 5
+    file.seek(0)
+    assert QovFrameHeader.read(file) == h
+
+
+def test_header_hash_options():
+    file = BytesIO()
+    QovHeader(hash_function=HashFunction.xor, hash_size=16).write(file)
+    assert file.getvalue()[15] == 0x22
+    file.seek(0)
+    header = QovHeader.read(file)
+    assert (header.hash_function, header.hash_size) == (HashFunction.xor, 16)
+
+    with pytest.raises(ValueError):
+        QovHeader(version=1, hash_function=HashFunction.xor).write(BytesIO())
+    with pytest.raises(ValueError):
+        QovHeader(hash_size=128).write(BytesIO())
+
+    file = BytesIO()
+    QovHeader(version=1).write(file)
+    data = bytearray(file.getvalue())
+    data[15] = 0x01
+    with pytest.raises(ValueError):
+        QovHeader.read(BytesIO(bytes(data)))
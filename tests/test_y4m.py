@@ -0,0 +1,50 @@
+from io import BytesIO
+from pyqoiv.y4m import Y4mWriter, rgb_to_ycbcr444
+import numpy as np
+import pytest
+
+
+def test_rgb_to_ycbcr444_maps_greys_to_studio_range():
+    frame = np.array([[[0, 0, 0], [255, 255, 255], [128, 128, 128]]], dtype=np.uint8)
+    planar = rgb_to_ycbcr444(frame)
+    assert planar.shape == (3, 1, 3)
+    assert planar[0].tolist() == [[16, 235, 126]]
+    assert planar[1].tolist() == [[128, 128, 128]]
+    assert planar[2].tolist() == [[128, 128, 128]]
+
+
+def test_y4m_writer_writes_header_and_frames():
+    file = BytesIO()
+    writer = Y4mWriter(file, 4, 2, frame_rate=25)
+    frame = np.zeros((2, 4, 3), dtype=np.uint8)
+    frame[..., 0] = 255
+    writer.write(frame)
+    writer.write(frame)
+
+    header, rest = file.getvalue().split(b"\n", 1)
+    assert header == b"YUV4MPEG2 W4 H2 F25:1 Ip A1:1 C444"
+    frame_size = len(b"FRAME\n") + 4 * 2 * 3
+    assert len(rest) == 2 * frame_size
+    assert rest.startswith(b"FRAME\n")
+    # Pure red in BT.601
+    assert rest[6:14] == bytes([81] * 8)
+    assert rest[14:22] == bytes([90] * 8)
+    assert rest[22:30] == bytes([240] * 8)
+
+
+def test_y4m_writer_rejects_mismatched_frames():
+    writer = Y4mWriter(BytesIO(), 4, 2)
+    with pytest.raises(ValueError):
+        writer.write(np.zeros((4, 2, 3), dtype=np.uint8))
+
+
+def test_y4m_writer_writes_mono_frames():
+    file = BytesIO()
+    writer = Y4mWriter(file, 3, 1, channels=1)
+    writer.write(np.array([[[0], [255], [128]]], dtype=np.uint8))
+
+    header, rest = file.getvalue().split(b"\n", 1)
+    assert header == b"YUV4MPEG2 W3 H1 F30:1 Ip A1:1 Cmono"
+    assert rest == b"FRAME\n" + bytes([16, 235, 126])
+    with pytest.raises(ValueError):
+        writer.write(np.zeros((1, 3, 3), dtype=np.uint8))